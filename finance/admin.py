@@ -1,20 +1,61 @@
 from django.contrib import admin
 
-from finance.models import Gateway, Payment
+from finance.models import Gateway, Payment, PaymentCallback, PaymentEvent, GatewayMaintenance, \
+    QueuedPaymentStart
+
+
+class PaymentEventInline(admin.TabularInline):
+    model = PaymentEvent
+    fields = ("created_time", "scope", "payload")
+    readonly_fields = ("created_time", "scope", "payload")
+    ordering = ('created_time',)
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
 
 
 class PaymentAdmin(admin.ModelAdmin):
     list_display = [
         "invoice_number", "user", "created_time", "modified_time",
-        "amount", "gateway", "is_paid"
+        "amount", "gateway", "is_paid", "settlement_status"
     ]
-    list_filter = ("is_paid", "gateway")
+    list_filter = ("is_paid", "settlement_status", "gateway")
     list_editable = ("is_paid", )
     search_fields = ["user__username", "user__phone_number", "user__email", "invoice_number"]
     date_hierarchy = "created_time"
     ordering = ('-created_time',)
-    # readonly_fields = ('is_paid',)
+    readonly_fields = ('payment_log',)
+    inlines = [PaymentEventInline]
+
+
+class PaymentCallbackAdmin(admin.ModelAdmin):
+    list_display = ["payment", "created_time", "is_duplicate"]
+    list_filter = ("is_duplicate",)
+    search_fields = ["payment__invoice_number", "payload"]
+    raw_id_fields = ("payment",)
+    date_hierarchy = "created_time"
+    ordering = ('-created_time',)
 
 
 admin.site.register(Payment, PaymentAdmin)
+admin.site.register(PaymentCallback, PaymentCallbackAdmin)
 admin.site.register(Gateway)
+
+
+class GatewayMaintenanceAdmin(admin.ModelAdmin):
+    list_display = ["gateway", "title", "start_time", "end_time", "is_enable"]
+    list_filter = ("is_enable", "gateway")
+    list_editable = ("is_enable",)
+
+
+class QueuedPaymentStartAdmin(admin.ModelAdmin):
+    list_display = ["payment", "gateway_code", "release_time", "released_time"]
+    list_filter = ("gateway_code",)
+    raw_id_fields = ("payment",)
+    ordering = ('-release_time',)
+
+
+admin.site.register(GatewayMaintenance, GatewayMaintenanceAdmin)
+admin.site.register(QueuedPaymentStart, QueuedPaymentStartAdmin)
@@ -0,0 +1,109 @@
+import datetime
+import time
+from collections import defaultdict
+
+import pytz
+from django.conf import settings
+from django.utils import timezone
+
+from finance.gateways import gateway_registry
+
+TEHRAN = pytz.timezone('Asia/Tehran')
+
+# Daily settlement of Shaparak which all gateways and direct debit are down in
+DEFAULT_MAINTENANCE_WINDOWS = (
+    (datetime.time(23, 45), datetime.time(0, 30)),
+)
+
+
+class GatewayAvailability:
+    """
+    Maintenance windows of gateways in Tehran time. Windows of
+    PAYMENT_MAINTENANCE_WINDOWS setting and GatewayMaintenance rows without
+    gateway apply to all gateways and direct debit, other rows apply to their
+    gateway. Windows are loaded with one query at most once per ttl seconds
+    and invalidated by GatewayMaintenance signals like gateway_registry
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._windows = None
+        self._loaded_at = 0
+
+    def get_ttl(self):
+        if self.ttl is not None:
+            return self.ttl
+        return getattr(settings, 'GATEWAY_REGISTRY_TTL', 60)
+
+    def load(self):
+        from finance.models import GatewayMaintenance
+        windows = defaultdict(list)
+        windows[None].extend(getattr(settings, 'PAYMENT_MAINTENANCE_WINDOWS', DEFAULT_MAINTENANCE_WINDOWS))
+        for code, start_time, end_time in GatewayMaintenance.objects.filter(is_enable=True).values_list(
+                'gateway__gateway_code', 'start_time', 'end_time'):
+            windows[code].append((start_time, end_time))
+        return dict(windows)
+
+    def windows(self, code=None):
+        """Windows of given gateway code, None means windows of all gateways"""
+        if self._windows is None or time.monotonic() - self._loaded_at > self.get_ttl():
+            self._windows = self.load()
+            self._loaded_at = time.monotonic()
+        windows = list(self._windows.get(None, ()))
+        if code is not None:
+            windows.extend(self._windows.get(code, ()))
+        return windows
+
+    def invalidate(self):
+        self._windows = None
+
+    @staticmethod
+    def local_now(now=None):
+        return timezone.localtime(now or timezone.now(), TEHRAN)
+
+    @staticmethod
+    def in_window(clock, start_time, end_time):
+        """Windows which end before they start pass midnight"""
+        if start_time <= end_time:
+            return start_time <= clock < end_time
+        return clock >= start_time or clock < end_time
+
+    def closes_at(self, code=None, now=None):
+        """
+        End of the maintenance of the gateway at now, overlapping and adjacent
+        windows are merged
+        :return: aware datetime in Tehran time or None when it is available
+        """
+        local_now = moment = self.local_now(now)
+        windows = self.windows(code)
+        for _ in range(len(windows)):
+            ends = list()
+            for start_time, end_time in windows:
+                if self.in_window(moment.time(), start_time, end_time):
+                    end = TEHRAN.localize(datetime.datetime.combine(moment.date(), end_time))
+                    ends.append(end if end > moment else end + datetime.timedelta(days=1))
+            if not ends:
+                break
+            moment = max(ends)
+        return moment if moment != local_now else None
+
+    def is_available(self, code=None, now=None):
+        return self.closes_at(code, now) is None
+
+    def available_gateway(self, code=None, now=None):
+        """Enabled gateway of given code if it is available otherwise the first
+        available one, None when all gateways are in maintenance"""
+        entries = sorted(gateway_registry.entries(), key=lambda entry: entry.code != code)
+        for entry in entries:
+            if self.is_available(entry.code, now):
+                return entry
+        return None
+
+    def release_time(self, now=None):
+        """Earliest time which one of enabled gateways becomes available"""
+        ends = [self.closes_at(entry.code, now) for entry in gateway_registry.entries()]
+        ends = [end for end in ends if end is not None]
+        return min(ends) if ends else None
+
+
+gateway_availability = GatewayAvailability()
@@ -0,0 +1,58 @@
+import json
+import threading
+
+
+def to_payload(data):
+    """JSON compatible copy of gateway responses and callback data, values
+    which are not serializable (suds texts, decimals, dates) are stored as
+    strings"""
+    if hasattr(data, 'dict'):
+        data = data.dict()
+    return json.loads(json.dumps(data, default=str))
+
+
+class PaymentEventBuffer:
+    """
+    Collect PaymentEvent rows of the current thread and insert them together.
+    While a request is buffered by PaymentEventMiddleware events are written
+    with one bulk insert at the end of it, outside of buffering (celery
+    tasks, shell) each event is inserted immediately
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def events(self):
+        return getattr(self._local, 'events', None)
+
+    def start(self):
+        self._local.events = list()
+
+    def record(self, payment, scope, data):
+        from finance.models import PaymentEvent
+        event = PaymentEvent(payment_id=payment.pk, scope=scope, payload=to_payload(data))
+        if self.events is None:
+            event.save()
+        else:
+            self.events.append(event)
+        return event
+
+    def record_bulk(self, events):
+        """Insert iterable of (payment, scope, data) at once regardless of
+        buffering, used by batch paths which are not in a request"""
+        from finance.models import PaymentEvent
+        return PaymentEvent.objects.bulk_create([
+            PaymentEvent(payment_id=payment.pk, scope=scope, payload=to_payload(data))
+            for payment, scope, data in events
+        ])
+
+    def flush(self):
+        from finance.models import PaymentEvent
+        events, self._local.events = self.events, None
+        if events:
+            PaymentEvent.objects.bulk_create(events)
+        return events or list()
+
+
+payment_events = PaymentEventBuffer()
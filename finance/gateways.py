@@ -0,0 +1,82 @@
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.urls import reverse
+
+INVOICE_PLACEHOLDER = 'INVOICE'
+
+GatewayEntry = namedtuple('GatewayEntry', (
+    'pk', 'title', 'code', 'request_handler', 'verify_handler', 'payment_url', 'instant_url'
+))
+
+
+class GatewayRegistry:
+    """
+    In-process catalogue of enabled gateways with their handlers and URL
+    templates of payment pages. Entries do not keep Gateway instances, so
+    model instances are never shared between requests. It is loaded with one query at most once per
+    ttl seconds and is invalidated by Gateway post_save and post_delete
+    signals, other processes see the change after ttl
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._entries = None
+        self._loaded_at = 0
+
+    def get_ttl(self):
+        if self.ttl is not None:
+            return self.ttl
+        return getattr(settings, 'GATEWAY_REGISTRY_TTL', 60)
+
+    def load(self):
+        from finance.models import Gateway
+        entries = list()
+        for gateway in Gateway.objects.filter(is_enable=True).order_by('pk'):
+            payment_url = reverse('payment', args=[INVOICE_PLACEHOLDER, gateway.gateway_code])
+            entries.append(GatewayEntry(
+                pk=gateway.pk, title=gateway.title, code=gateway.gateway_code,
+                request_handler=gateway.get_request_handler(), verify_handler=gateway.get_verify_handler(),
+                payment_url=payment_url.replace(INVOICE_PLACEHOLDER, '{}'),
+                instant_url='https://website.com/finance/pay/{}/' + gateway.gateway_code + '/',
+            ))
+        return tuple(entries)
+
+    def entries(self):
+        """Enabled gateways ordered by pk, the tuple is replaced as a whole so
+        readers in other threads never see a half loaded catalogue"""
+        if self._entries is None or time.monotonic() - self._loaded_at > self.get_ttl():
+            self._entries = self.load()
+            self._loaded_at = time.monotonic()
+        return self._entries
+
+    def get(self, code):
+        for entry in self.entries():
+            if entry.code == code:
+                return entry
+        return None
+
+    def get_by_pk(self, pk):
+        for entry in self.entries():
+            if entry.pk == pk:
+                return entry
+        return None
+
+    def default(self):
+        """First enabled gateway which is used for instant payment links"""
+        entries = self.entries()
+        return entries[0] if entries else None
+
+    def invalidate(self):
+        self._entries = None
+
+    def payment_options(self, invoice_number):
+        """Gateways data of payment serializers"""
+        return [
+            {'title': entry.title, 'code': entry.code, 'url': entry.payment_url.format(invoice_number)}
+            for entry in self.entries()
+        ]
+
+
+gateway_registry = GatewayRegistry()
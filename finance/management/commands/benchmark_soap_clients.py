@@ -0,0 +1,53 @@
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from suds.client import Client
+
+from finance.utils.soap import SoapClientPool
+from finance.utils.soap_stub import start_stub_server
+
+
+class Command(BaseCommand):
+    help = "Compare per call overhead of a new suds client per call and pooled clients against local stub " \
+           "SOAP server"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, dest='calls', default=50)
+        parser.add_argument('--latency', type=float, dest='latency', default=0.02, help="seconds per response")
+
+    def measure(self, call, calls):
+        durations = list()
+        for i in range(calls):
+            started = time.perf_counter()
+            result = call()
+            durations.append(time.perf_counter() - started)
+            assert result.Status == 100, result
+        durations.sort()
+        return sum(durations) / calls, durations[calls // 2], durations[-1]
+
+    def handle(self, *args, **options):
+        server = start_stub_server(latency=options['latency'])
+        url = server.wsdl_url
+        pool = SoapClientPool(cache_location=tempfile.mkdtemp(prefix='suds-wsdl-'))
+        arguments = ('merchant', 1000, 'benchmark', '', '', 'http://127.0.0.1/')
+
+        def legacy():
+            return Client(url, cache=None).service.PaymentRequest(*arguments)
+
+        def pooled():
+            with pool.client(url) as client:
+                return client.service.PaymentRequest(*arguments)
+
+        print('-' * 80)
+        print("Stub server:\t", url, "latency:", options['latency'])
+        try:
+            for name, call in (('new client', legacy), ('pooled client', pooled)):
+                average, median, worst = self.measure(call, options['calls'])
+                print("{}:\taverage: {:.2f}ms\tmedian: {:.2f}ms\tworst: {:.2f}ms".format(
+                    name, average * 1000, median * 1000, worst * 1000
+                ))
+        finally:
+            server.shutdown()
+            server.server_close()
+        print('-' * 80)
@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from finance.verification import PaymentVerificationEngine
+
+
+class Command(BaseCommand):
+    help = "Verify unpaid Zarinpal and Parsian payments of last days concurrently and apply paid ones in bulk"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, dest='days', default=None)
+        parser.add_argument('--workers', type=int, dest='workers', default=None)
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=200)
+
+    def handle(self, *args, **options):
+        from_date = None
+        if options['days'] is not None:
+            from_date = timezone.now() - timedelta(days=options['days'])
+        engine = PaymentVerificationEngine(workers=options['workers'], batch_size=options['batch_size'])
+        report = engine.run(engine.get_candidates(from_date))
+        print('-' * 80)
+        print("Paid payments:\t", len(report['paid']))
+        for code, stats in report['gateways'].items():
+            print("{}:\tchecked: {checked}\tpaid: {paid}\terrors: {errors}\taverage: {:.2f}ms\tmax: {:.2f}ms".format(
+                code, stats['average_latency'] * 1000, stats['max_latency'] * 1000, **stats
+            ))
+        print('-' * 80)
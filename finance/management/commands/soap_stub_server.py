@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from finance.utils.soap_stub import StubSoapServer
+
+
+class Command(BaseCommand):
+    help = "Run local stub SOAP server of Zarinpal and Parsian operations, set request and verify urls of a " \
+           "test gateway to the printed WSDL url"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', dest='host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, dest='port', default=8070)
+        parser.add_argument('--latency', type=float, dest='latency', default=0, help="seconds per response")
+
+    def handle(self, *args, **options):
+        server = StubSoapServer((options['host'], options['port']), options['latency'])
+        print('-' * 80)
+        print("WSDL url:\t", server.wsdl_url)
+        print('-' * 80)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,16 @@
+from finance.events import payment_events
+
+
+class PaymentEventMiddleware:
+    """Buffer payment events of each request and write them after the
+    response is generated"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        payment_events.start()
+        try:
+            return self.get_response(request)
+        finally:
+            payment_events.flush()
@@ -1,13 +1,15 @@
 import json
 import uuid
 
+from django.contrib.postgres.fields import JSONField
 from django.db import models
 from django.conf import settings
-from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
-from finance.utils import zpal_request_handler, zpal_payment_checker
-from finance.utils.parsian import parsian_request_handler, parsian_payment_checker
+from finance.events import payment_events
+from finance.gateways import gateway_registry
+from finance.utils import zpal_request_handler, zpal_payment_checker, zpal_payment_probe
+from finance.utils.parsian import parsian_request_handler, parsian_payment_checker, parsian_payment_probe
 from lib.common_model import BaseModel
 from subscription.models import BaseTransaction
 
@@ -22,11 +24,13 @@ class Gateway(BaseModel):
     FUNCTION_SHAPARAK = 'shaparak'
     FUNCTION_FINOTECH = 'finotech'
     FUNCTION_ZARRINPAL = 'zarrinpal'
+    FUNCTION_PARSIAN = 'parsian'
     GATEWAY_FUNCTIONS = (
         (FUNCTION_SAMAN, _('Saman')),
         (FUNCTION_SHAPARAK, _('Shaparak')),
         (FUNCTION_FINOTECH, _('FinoTech')),
         (FUNCTION_ZARRINPAL, _("Zarrinpal")),
+        (FUNCTION_PARSIAN, _("Parsian")),
     )
 
     title = models.CharField(max_length=100, verbose_name=_("gateway title"))
@@ -63,12 +67,53 @@ class Gateway(BaseModel):
         }
         return handlers[self.gateway_code]
 
+    def get_probe_handler(self):
+        """Handlers which verify a payment without saving it, used by batch
+        verification of failed payments"""
+        handlers = {
+            self.FUNCTION_SAMAN: None,
+            self.FUNCTION_SHAPARAK: None,
+            self.FUNCTION_FINOTECH: None,
+            self.FUNCTION_ZARRINPAL: zpal_payment_probe,
+            self.FUNCTION_PARSIAN: parsian_payment_probe,
+        }
+        return handlers[self.gateway_code]
+
     @property
     def credentials(self):
         return json.loads(self.auth_data)
 
 
+class GatewayMaintenance(BaseModel):
+    """Daily maintenance window of a gateway in Tehran time, windows without
+    gateway apply to all gateways and direct debit"""
+    gateway = models.ForeignKey(
+        Gateway, related_name='maintenances', null=True, blank=True, verbose_name=_("gateway")
+    )
+    title = models.CharField(max_length=100, verbose_name=_("title"), blank=True)
+    start_time = models.TimeField(verbose_name=_("start time"))
+    end_time = models.TimeField(verbose_name=_("end time"))
+    is_enable = models.BooleanField(_('is enable'), default=True)
+
+    class Meta:
+        verbose_name = _("GatewayMaintenance")
+        verbose_name_plural = _("GatewayMaintenances")
+
+    def __str__(self):
+        return '{}: {} - {}'.format(self.gateway or _("All gateways"), self.start_time, self.end_time)
+
+
 class Payment(BaseModel):
+    SETTLEMENT_NONE = 0
+    SETTLEMENT_PENDING = 5
+    SETTLEMENT_DONE = 10
+    SETTLEMENT_FAILED = 15
+    SETTLEMENT_CHOICES = (
+        (SETTLEMENT_NONE, _("none")),
+        (SETTLEMENT_PENDING, _("pending")),
+        (SETTLEMENT_DONE, _("done")),
+        (SETTLEMENT_FAILED, _("failed")),
+    )
     invoice_number = models.UUIDField(verbose_name=_("invoice number"), unique=True, default=uuid.uuid4)
     amount = models.PositiveIntegerField(verbose_name=_("payment amount"), editable=True)
     gateway = models.ForeignKey(Gateway, related_name="payments", null=True, blank=True, verbose_name=_("gateway"))
@@ -77,6 +122,9 @@ class Payment(BaseModel):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name=_('User'), null=True)
     transaction = models.OneToOneField(BaseTransaction, verbose_name=_("transaction"), related_name='payment')
     authority = models.CharField(max_length=64, verbose_name=_("authority"), blank=True)
+    settlement_status = models.PositiveSmallIntegerField(
+        verbose_name=_("settlement status"), choices=SETTLEMENT_CHOICES, default=SETTLEMENT_NONE
+    )
 
     class Meta:
         verbose_name = _("Payment")
@@ -89,9 +137,14 @@ class Payment(BaseModel):
         super().__init__(*args, **kwargs)
         self._b_is_paid = self.is_paid
 
+    def get_gateway_entry(self):
+        """Registry entry of the payment gateway, None when it is disabled"""
+        return gateway_registry.get_by_pk(self.gateway_id) if self.gateway_id is not None else None
+
     @property
     def bank_page(self):
-        handler = self.gateway.get_request_handler()
+        entry = self.get_gateway_entry()
+        handler = entry.request_handler if entry is not None else self.gateway.get_request_handler()
         if handler is not None:
             return handler(self.gateway, self)
 
@@ -107,7 +160,9 @@ class Payment(BaseModel):
         return self.is_paid != self._b_is_paid
 
     def verify(self, data):
-        handler = self.gateway.get_verify_handler()
+        # payments of gateways which are disabled since they were started are still verified
+        entry = self.get_gateway_entry()
+        handler = entry.verify_handler if entry is not None else self.gateway.get_verify_handler()
         if not self.is_paid and handler is not None:
             handler(self, data)
         return self.is_paid
@@ -116,11 +171,17 @@ class Payment(BaseModel):
         return 'https://website.com/dashboards?invoice={}#wallet'.format(self.invoice_number)
 
     def get_gateway(self):
-        gateway = Gateway.objects.filter(is_enable=True).first()
-        return gateway.gateway_code
+        gateway = gateway_registry.default()
+        return gateway.code if gateway is not None else None
 
-    def get_instant_link(self):
-        return 'https://website.com/finance/pay/{}/{}/'.format(self.invoice_number, self.get_gateway())
+    def get_instant_link(self, gateway_code=None):
+        """Link of instant payment page with given or default gateway, which
+        is read from gateway_registry without any query. The dashboard link of
+        the invoice is returned when the gateway is not enabled"""
+        entry = gateway_registry.default() if gateway_code is None else gateway_registry.get(gateway_code)
+        if entry is None:
+            return self.get_absolute_url()
+        return entry.instant_url.format(self.invoice_number)
 
     def is_wallet_charge(self):
         if self.transaction is None:
@@ -135,14 +196,9 @@ class Payment(BaseModel):
             return getattr(transaction, 'payment')
         return cls.objects.create(amount=transaction.amount, user=transaction.user, transaction=transaction)
 
-    def save_log(self, data, scope='Request handler', save=True):
-        generated_log = "[{}][{}] {}\n".format(timezone.now(), scope, data)
-        if self.payment_log != '':
-            self.payment_log += generated_log
-        else:
-            self.payment_log = generated_log
-        if save:
-            self.save()
+    def save_log(self, data, scope='Request handler'):
+        """Record a PaymentEvent, payment row itself is not changed"""
+        return payment_events.record(self, scope, data)
 
     def clone(self):
         transaction = self.transaction
@@ -151,3 +207,71 @@ class Payment(BaseModel):
         transaction.transaction_type = transaction.WALLET_CHARGE
         transaction.save()
         return Payment.create_payment(transaction)
+
+    @property
+    def settlement_state(self):
+        """State of the payment which is polled by the payment result page"""
+        if not self.is_paid:
+            return 'unpaid'
+        if self.settlement_status == self.SETTLEMENT_PENDING:
+            return 'pending'
+        if self.settlement_status == self.SETTLEMENT_FAILED:
+            return 'failed'
+        return 'settled'
+
+
+class QueuedPaymentStart(BaseModel):
+    """Payment which is started while all gateways were in maintenance, its
+    payment link is sent to the user after release_time"""
+    payment = models.ForeignKey(Payment, related_name='queued_starts', verbose_name=_("payment"))
+    gateway_code = models.CharField(max_length=12, verbose_name=_("gateway code"), blank=True)
+    release_time = models.DateTimeField(verbose_name=_("release time"), db_index=True)
+    released_time = models.DateTimeField(verbose_name=_("released time"), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("QueuedPaymentStart")
+        verbose_name_plural = _("QueuedPaymentStarts")
+
+    def __str__(self):
+        return '{}: {}'.format(self.payment_id, self.release_time)
+
+    @classmethod
+    def queue(cls, payment, gateway_code, release_time):
+        """Queue payment once, repeated requests move its release time"""
+        queued, _created = cls.objects.update_or_create(
+            payment=payment, released_time=None,
+            defaults=dict(gateway_code=gateway_code or '', release_time=release_time)
+        )
+        return queued
+
+
+class PaymentCallback(BaseModel):
+    """Raw payload of each bank callback, it is saved before verification so
+    duplicate and failed callbacks can be audited and replayed"""
+    payment = models.ForeignKey(
+        Payment, related_name='callbacks', null=True, blank=True, verbose_name=_("payment")
+    )
+    payload = models.TextField(verbose_name=_("payload"), blank=True)
+    is_duplicate = models.BooleanField(verbose_name=_("is duplicate"), default=False)
+
+    class Meta:
+        verbose_name = _("PaymentCallback")
+        verbose_name_plural = _("PaymentCallbacks")
+
+    def __str__(self):
+        return '{}: {}'.format(self.payment_id, self.created_time)
+
+
+class PaymentEvent(BaseModel):
+    """Append only log of gateway requests, responses and callbacks of a
+    payment, rows are only inserted"""
+    payment = models.ForeignKey(Payment, related_name='events', verbose_name=_("payment"))
+    scope = models.CharField(max_length=64, verbose_name=_("scope"), db_index=True)
+    payload = JSONField(verbose_name=_("payload"), default=dict, blank=True)
+
+    class Meta:
+        verbose_name = _("PaymentEvent")
+        verbose_name_plural = _("PaymentEvents")
+
+    def __str__(self):
+        return '{}: {}'.format(self.payment_id, self.scope)
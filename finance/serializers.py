@@ -1,7 +1,7 @@
-from django.urls import reverse
 from rest_framework import serializers
 
-from finance.models import Payment, Gateway
+from finance.gateways import gateway_registry
+from finance.models import Payment
 from subscription.models import BaseTransaction
 from user.serializers import UserLightSerializer
 
@@ -23,19 +23,9 @@ class PaymentInlineSerializer(serializers.ModelSerializer):
         extra_kwargs = {'is_paid': {'read_only': True}}
 
     def get_gateways(self, obj):
-        gateways = list()
         if obj.is_paid:
-            return gateways
-        for gateway in Gateway.objects.filter(is_enable=True):
-            gateways.append(
-                {
-                    'title': gateway.title,
-                    'code': gateway.gateway_code,
-                    'url': reverse('payment', args=[obj.invoice_number,
-                                                    gateway.gateway_code])
-                }
-            )
-        return gateways
+            return list()
+        return gateway_registry.payment_options(obj.invoice_number)
 
 
 class PaymentLightSerializer(serializers.ModelSerializer):
@@ -67,20 +57,9 @@ class PaymentSerializer(serializers.ModelSerializer):
         extra_kwargs = {'is_paid': {'read_only': True}}
 
     def get_gateways(self, obj):
-        gateways = list()
         if obj.is_paid:
-            return gateways
-        for gateway in Gateway.objects.filter(is_enable=True):
-            gateways.append(
-                {
-                    'title': gateway.title,
-                    'code': gateway.gateway_code,
-                    'url': reverse(
-                        'payment', args=[obj.invoice_number, gateway.gateway_code]
-                    )
-                }
-            )
-        return gateways
+            return list()
+        return gateway_registry.payment_options(obj.invoice_number)
 
     def get_transaction(self, obj):
         if obj.transaction.transaction_type == BaseTransaction.INSTANT:
@@ -1,10 +1,37 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
-from finance.models import Payment
+from finance.availability import gateway_availability
+from finance.gateways import gateway_registry
+from finance.models import Payment, Gateway, GatewayMaintenance
+from subscription.models import WalletEntry
 from subscription.models.transactions import BaseTransaction
 
 
+@receiver(post_save, sender=Gateway)
+@receiver(post_delete, sender=Gateway)
+def invalidate_gateway_registry(sender, instance, **kwargs):
+    """Reload enabled gateways of this process on next read"""
+    gateway_registry.invalidate()
+
+
+@receiver(post_save, sender=GatewayMaintenance)
+@receiver(post_delete, sender=GatewayMaintenance)
+def invalidate_gateway_availability(sender, instance, **kwargs):
+    """Reload maintenance windows of this process on next read"""
+    gateway_availability.invalidate()
+
+
+@receiver(post_save, sender=Payment)
+def post_payment_to_wallet(sender, instance, created, **kwargs):
+    """
+    Paid payments of wallet charge transactions increase the wallet value,
+    should be received before enable_user_credentials which reads the wallet
+    """
+    if instance.status_changed() or (created and instance.is_paid):
+        WalletEntry.sync(instance.transaction, WalletEntry.PAYMENT, instance.is_paid)
+
+
 @receiver(post_save, sender=Payment)
 def enable_user_credentials(sender, instance, created, **kwargs):
     """
@@ -5,25 +5,32 @@ from celery import shared_task
 from celery.schedules import crontab
 from celery.task import periodic_task
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import ugettext as _
 
-from finance.models import Payment, Gateway
+from finance.availability import gateway_availability
+from finance.models import Payment, QueuedPaymentStart
+from finance.verification import PaymentVerificationEngine
+from utils.notifications.sender import notify_by_sms
 
 logger = logging.getLogger(__file__)
 
+
 @periodic_task(name='Find failed payments', run_every=crontab(hour=23, minute=30))
 def check_failed_payments(from_date=None):
-    if from_date is None:
-        from_date = timezone.now().today() - timedelta(days=1)
-
-    payments = Payment.objects.filter(
-        created_time__gte=from_date, gateway__gateway_code=Gateway.FUNCTION_ZARRINPAL, is_paid=False
-    ).values_list('id', flat=True)
-    for payment in payments:
-        # logger
-        logger.info('#### check_failed_payments ####')
-        logger.info('from_date= {0},  payment= {1}'.format(from_date, payment))
-        #
-        recheck_payment.delay(payment)
+    """Verify unpaid payments of the lookback window in batches with
+    PaymentVerificationEngine instead of one task per payment"""
+    if isinstance(from_date, str):
+        from_date = parse_datetime(from_date)
+    engine = PaymentVerificationEngine()
+    report = engine.run(engine.get_candidates(from_date))
+    PaymentVerificationEngine.settle_pending(Payment.objects.filter(
+        settlement_status__in=[Payment.SETTLEMENT_PENDING, Payment.SETTLEMENT_FAILED],
+        modified_time__lt=timezone.now() - timedelta(minutes=10)
+    ).values_list('id', flat=True))
+    logger.info('#### check_failed_payments ####')
+    logger.info('from_date= {0},  paid= {1}'.format(from_date, report['paid']))
+    return report['gateways']
 
 
 @shared_task(name="Re-check failed payments")
@@ -41,3 +48,40 @@ def recheck_payment(pid):
     logger.info('payment= {0},  status_changed= {1}'.format(payment, status_changed))
     #
     return "{} status changed" if payment.status_changed() else "No change"
+
+
+@shared_task(bind=True, name="Settle paid payments", max_retries=5)
+def settle_payments(self, payment_ids):
+    """Deferred settlement of payments which are verified by bank callback,
+    failed settlements are retried and then left for check_failed_payments"""
+    try:
+        return PaymentVerificationEngine.settle_pending(payment_ids)
+    except Exception as error:
+        if self.request.retries >= self.max_retries:
+            Payment.objects.filter(pk__in=payment_ids, settlement_status=Payment.SETTLEMENT_PENDING).update(
+                settlement_status=Payment.SETTLEMENT_FAILED
+            )
+            raise
+        raise self.retry(exc=error, countdown=10 * 2 ** self.request.retries)
+
+
+@periodic_task(name='Release queued payments', run_every=crontab(minute='*/5'))
+def release_queued_payments():
+    """Send payment links of payments which are queued during gateways
+    maintenance when an enabled gateway is available again"""
+    queued_starts = QueuedPaymentStart.objects.filter(
+        released_time=None, release_time__lte=timezone.now(), payment__is_paid=False
+    ).select_related('payment', 'payment__user')
+    released = list()
+    for queued in queued_starts:
+        entry = gateway_availability.available_gateway(queued.gateway_code)
+        if entry is None:
+            break
+        payment = queued.payment
+        if payment.user is not None:
+            notify_by_sms(payment.user.phone_number, _("Gateways are available now, pay {} Tomans here: {}").format(
+                payment.amount, payment.get_instant_link(entry.code)
+            ))
+        released.append(queued.pk)
+    QueuedPaymentStart.objects.filter(pk__in=released).update(released_time=timezone.now())
+    return len(released)
@@ -1,7 +1,21 @@
+import datetime
+import tempfile
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.http import Http404
+from django.test import TestCase, override_settings
+from django.urls import reverse
 
 from business.models import Business, Tier
+from finance.gateways import gateway_registry
+from finance.availability import gateway_availability, TEHRAN
+from finance.events import payment_events
+from finance.models import Gateway, Payment, PaymentCallback, PaymentEvent, GatewayMaintenance
+from finance.serializers import PaymentInlineSerializer
+from finance.utils.soap import SoapClientPool
+from finance.utils.soap_stub import start_stub_server
+from finance.verification import PaymentVerificationEngine, verify_callback
+from finance.views import route_payment
 from subscription.models import Subscription, BaseTransaction
 from subscription.models.transactions import SubscriptionTransaction
 
@@ -16,6 +30,9 @@ class PaymentTestCase(TestCase):
         self.business = Business.objects.first()
         self.tier = Tier.objects.first()
         self.subscription = Subscription.objects.create(user=self.user, business=self.business, tier=self.tier)
+        # registries are module level, gateways of other tests should not be seen
+        gateway_registry.invalidate()
+        gateway_availability.invalidate()
 
     def test_wallet_charge_identification(self):
         self.assertEqual(BaseTransaction.wallet(self.user), 0, "Wallet charge is not 0 at initial time")
@@ -26,3 +43,132 @@ class PaymentTestCase(TestCase):
         # TODO: For instant payment
         # TODO: For wallet charge
         pass
+
+    def test_gateway_registry(self):
+        gateway = Gateway.objects.create(title='test', gateway_code=Gateway.FUNCTION_ZARRINPAL)
+        base_transaction = BaseTransaction.objects.create(
+            user=self.user, amount=self.tier.amount, transaction_type=BaseTransaction.WALLET_CHARGE
+        )
+        payment = Payment.objects.create(user=self.user, amount=base_transaction.amount, transaction=base_transaction)
+        gateway_registry.entries()
+        with self.assertNumQueries(0):
+            gateways = PaymentInlineSerializer(payment).data['gateways']
+            link = payment.get_instant_link()
+        self.assertEqual([item['code'] for item in gateways], [Gateway.FUNCTION_ZARRINPAL])
+        self.assertTrue(link.endswith('/{}/{}/'.format(payment.invoice_number, Gateway.FUNCTION_ZARRINPAL)))
+        self.assertEqual(gateway_registry.get_by_pk(gateway.pk).request_handler, gateway.get_request_handler())
+        gateway.is_enable = False
+        gateway.save()
+        self.assertIsNone(gateway_registry.default(), "Registry is not invalidated on gateway save")
+        self.assertEqual(payment.get_instant_link(), payment.get_absolute_url(), "Link of disabled gateway is built")
+
+    def test_soap_client_pool(self):
+        server = start_stub_server()
+        pool = SoapClientPool(cache_location=tempfile.mkdtemp())
+        try:
+            with pool.client(server.wsdl_url) as client:
+                result = client.service.PaymentRequest('merchant', 1000, 'test', '', '', 'http://127.0.0.1/')
+            with pool.client(server.wsdl_url) as second_client:
+                self.assertIs(second_client, client, "SOAP client is not reused")
+            self.assertEqual(result.Status, 100)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_batch_verification(self):
+        server = start_stub_server()
+        try:
+            gateway = Gateway.objects.create(
+                title='test', gateway_code=Gateway.FUNCTION_ZARRINPAL, gateway_request_url=server.wsdl_url,
+                auth_data='{"merchant_id": "test"}'
+            )
+            payments = list()
+            for i in range(3):
+                base_transaction = BaseTransaction.objects.create(
+                    user=self.user, amount=self.tier.amount, transaction_type=BaseTransaction.WALLET_CHARGE
+                )
+                payments.append(Payment.objects.create(
+                    user=self.user, amount=base_transaction.amount, transaction=base_transaction,
+                    gateway=gateway, authority='authority{}'.format(i)
+                ))
+            engine = PaymentVerificationEngine(workers=2)
+            report = engine.run(engine.get_candidates())
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(sorted(report['paid']), sorted(payment.pk for payment in payments))
+        self.assertEqual(report['gateways'][Gateway.FUNCTION_ZARRINPAL]['paid'], 3)
+        self.assertEqual(Payment.objects.filter(pk__in=report['paid'], is_paid=True).count(), 3)
+        self.assertEqual(BaseTransaction.wallet(self.user), self.tier.amount * 3, "Wallet is not charged")
+
+    @override_settings(PAYMENT_DEFER_SETTLEMENT=False)
+    def test_duplicate_callbacks(self):
+        server = start_stub_server()
+        try:
+            gateway = Gateway.objects.create(
+                title='test', gateway_code=Gateway.FUNCTION_ZARRINPAL, gateway_request_url=server.wsdl_url,
+                auth_data='{"merchant_id": "test"}'
+            )
+            base_transaction = BaseTransaction.objects.create(
+                user=self.user, amount=self.tier.amount, transaction_type=BaseTransaction.WALLET_CHARGE
+            )
+            payment = Payment.objects.create(
+                user=self.user, amount=base_transaction.amount, transaction=base_transaction,
+                gateway=gateway, authority='authority'
+            )
+            for i in range(2):
+                response = self.client.get(reverse('payment-verify'), {'Authority': 'authority', 'Status': 'OK'})
+                self.assertEqual(response.status_code, 200)
+        finally:
+            server.shutdown()
+            server.server_close()
+        payment.refresh_from_db()
+        self.assertTrue(payment.is_paid)
+        self.assertEqual(payment.settlement_state, 'settled')
+        self.assertEqual(PaymentCallback.objects.filter(payment=payment, is_duplicate=True).count(), 1)
+        self.assertEqual(BaseTransaction.wallet(self.user), self.tier.amount, "Wallet is charged twice")
+        self.assertTrue(verify_callback(payment, {}))
+
+    def test_payment_events(self):
+        base_transaction = BaseTransaction.objects.create(
+            user=self.user, amount=self.tier.amount, transaction_type=BaseTransaction.WALLET_CHARGE
+        )
+        payment = Payment.create_payment(base_transaction)
+        payment_events.start()
+        payment.save_log({'status': 0}, 'Bank operation')
+        payment.save_log({'status': 0, 'token': 1}, 'Payment checker')
+        self.assertEqual(PaymentEvent.objects.filter(payment=payment).count(), 0, "Events are not buffered")
+        with self.assertNumQueries(1):
+            payment_events.flush()
+        payment.save_log({'status': 100}, 'Callback verification')
+        self.assertEqual(
+            list(payment.events.order_by('pk').values_list('scope', flat=True)),
+            ['Bank operation', 'Payment checker', 'Callback verification']
+        )
+        payment.refresh_from_db()
+        self.assertEqual(payment.payment_log, '')
+
+    @override_settings(PAYMENT_MAINTENANCE_WINDOWS=((datetime.time(23, 45), datetime.time(0, 30)),))
+    def test_gateway_availability(self):
+        zarinpal = Gateway.objects.create(title='zarinpal', gateway_code=Gateway.FUNCTION_ZARRINPAL)
+        Gateway.objects.create(title='parsian', gateway_code=Gateway.FUNCTION_PARSIAN)
+        GatewayMaintenance.objects.create(
+            gateway=zarinpal, start_time=datetime.time(0, 30), end_time=datetime.time(1, 0)
+        )
+
+        def at(hour, minute):
+            return TEHRAN.localize(datetime.datetime(2019, 6, 1, hour, minute))
+
+        self.assertTrue(gateway_availability.is_available(Gateway.FUNCTION_ZARRINPAL, at(12, 0)))
+        self.assertEqual(gateway_availability.closes_at(None, at(23, 50)), at(0, 30) + datetime.timedelta(days=1))
+        self.assertEqual(gateway_availability.closes_at(Gateway.FUNCTION_ZARRINPAL, at(0, 10)), at(1, 0))
+        self.assertIsNone(gateway_availability.available_gateway(Gateway.FUNCTION_ZARRINPAL, at(0, 10)))
+        self.assertEqual(
+            gateway_availability.available_gateway(Gateway.FUNCTION_ZARRINPAL, at(0, 40)).code,
+            Gateway.FUNCTION_PARSIAN, "Payment is not routed to the available gateway"
+        )
+        zarinpal.is_enable = False
+        zarinpal.save()
+        for code in (Gateway.FUNCTION_ZARRINPAL, 'unknown'):
+            with self.assertRaises(Http404, msg="Disabled or unknown gateway is routed"):
+                route_payment(code)
@@ -1,3 +1,3 @@
-from .zarinpal import zpal_request_handler, zpal_payment_checker
+from .zarinpal import zpal_request_handler, zpal_payment_checker, zpal_payment_probe
 
-__all__ = ['zpal_request_handler', 'zpal_payment_checker']
+__all__ = ['zpal_request_handler', 'zpal_payment_checker', 'zpal_payment_probe']
@@ -1,17 +1,18 @@
 from django.conf import settings
-from suds.client import Client
+
+from finance.utils.soap import soap_clients
 
 
 def parsian_request_handler(gateway, payment):
-    client = Client(gateway.gateway_request_url)
     data = dict(
         LoginAccount=gateway.credentials['pin'], Amount=payment.amount*10,
         OrderId=payment.id, CallBackUrl=settings.BASE_PATH + '/finance/VerifyPayment',
         AdditionalData=''
     )
-    result = client.service.SalePaymentRequest(requestData=data)
+    with soap_clients.client(gateway.gateway_request_url) as client:
+        result = client.service.SalePaymentRequest(requestData=data)
     response = {"token": getattr(result, 'Token', ''), "status": getattr(result, 'Status', ''), "message": getattr(result, 'Message', '')}
-    payment.save_log(response, scope='result handler', save=True)
+    payment.save_log(response, scope='result handler')
     if result.Status == 0 and result.Token > 0:
         payment.authority = result.Token
         payment.save()
@@ -20,14 +21,21 @@ def parsian_request_handler(gateway, payment):
         return None
 
 
-def parsian_payment_checker(payment, data):
-    payment.save_log(data, "Bank operation", save=True)
-    client = Client(payment.gateway.gateway_verify_url)
+def parsian_payment_probe(payment):
+    """Confirm payment on the gateway without saving it
+    :return: paid status and gateway response"""
     data = dict(LoginAccount=payment.gateway.credentials['pin'], Token=payment.authority)
-    result = client.service.ConfirmPayment(requestData=data)
+    with soap_clients.client(payment.gateway.gateway_verify_url) as client:
+        result = client.service.ConfirmPayment(requestData=data)
     response = {"token": getattr(result, 'Token', ''), "status": getattr(result, 'Status', ''), "RRn": getattr(result, 'RRN', 0), "card_number": getattr(result, '‫‪CardNumberMasked‬‬', '')}
-    payment.save_log(response, "Payment checker", save=True)
-    if result.Status == 0 and result.Token > 0:
+    return result.Status == 0 and result.Token > 0, response
+
+
+def parsian_payment_checker(payment, data):
+    payment.save_log(data, "Bank operation")
+    is_paid, response = parsian_payment_probe(payment)
+    payment.save_log(response, "Payment checker")
+    if is_paid:
         payment.is_paid = True
         payment.save()
     return payment.is_paid
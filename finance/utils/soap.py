@@ -0,0 +1,84 @@
+import io
+import os
+import queue
+import tempfile
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+import requests
+from django.conf import settings
+from suds.cache import ObjectCache
+from suds.client import Client
+from suds.transport import Transport, Reply, TransportError
+
+
+class RequestsTransport(Transport):
+    """suds transport over a pooled requests session with separate connect
+    and read timeouts, urllib transport of suds opens a new connection per
+    call and has only one timeout"""
+
+    def __init__(self, connect_timeout, read_timeout):
+        super().__init__()
+        self.session = requests.Session()
+        self.timeout = (connect_timeout, read_timeout)
+
+    def open(self, request):
+        response = self.session.get(request.url, timeout=self.timeout)
+        response.raise_for_status()
+        return io.BytesIO(response.content)
+
+    def send(self, request):
+        response = self.session.post(
+            request.url, data=request.message, headers=request.headers, timeout=self.timeout
+        )
+        if response.status_code in (202, 204):
+            return None
+        if response.status_code >= 400:
+            raise TransportError(response.reason, response.status_code, io.BytesIO(response.content))
+        return Reply(response.status_code, response.headers, response.content)
+
+
+class SoapClientPool:
+    """
+    Reuse suds clients of each WSDL url across requests. Parsed WSDL is kept
+    in memory by the idle clients and pickled on disk for new processes, a
+    client is used by one thread at a time
+    """
+
+    def __init__(self, cache_location=None, timeout=None, max_idle=8):
+        self.cache_location = cache_location or getattr(
+            settings, 'SOAP_WSDL_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'suds-wsdl')
+        )
+        self.timeout = timeout or getattr(settings, 'SOAP_CLIENT_TIMEOUT', (5, 30))
+        self.max_idle = max_idle
+        self._idle = defaultdict(queue.LifoQueue)
+        self._lock = threading.Lock()
+
+    def build(self, url):
+        connect_timeout, read_timeout = self.timeout
+        return Client(
+            url, cache=ObjectCache(location=self.cache_location, days=1),
+            transport=RequestsTransport(connect_timeout, read_timeout), timeout=read_timeout,
+        )
+
+    @contextmanager
+    def client(self, url):
+        with self._lock:
+            idle = self._idle[url]
+        try:
+            client = idle.get_nowait()
+        except queue.Empty:
+            client = self.build(url)
+        try:
+            yield client
+        finally:
+            if idle.qsize() < self.max_idle:
+                idle.put_nowait(client)
+
+    def clear(self):
+        with self._lock:
+            self._idle.clear()
+
+
+soap_clients = SoapClientPool()
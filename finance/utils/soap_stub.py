@@ -0,0 +1,210 @@
+import re
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+WSDL = '''<?xml version="1.0" encoding="UTF-8"?>
+<definitions xmlns="http://schemas.xmlsoap.org/wsdl/" xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+             xmlns:xs="http://www.w3.org/2001/XMLSchema" xmlns:tns="urn:stub" targetNamespace="urn:stub">
+  <types>
+    <xs:schema targetNamespace="urn:stub" elementFormDefault="qualified">
+      <xs:complexType name="ClientSaleRequestData">
+        <xs:sequence>
+          <xs:element name="LoginAccount" type="xs:string"/>
+          <xs:element name="Amount" type="xs:long"/>
+          <xs:element name="OrderId" type="xs:long"/>
+          <xs:element name="CallBackUrl" type="xs:string"/>
+          <xs:element name="AdditionalData" type="xs:string" minOccurs="0"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="ClientSaleResponseData">
+        <xs:sequence>
+          <xs:element name="Token" type="xs:long"/>
+          <xs:element name="Message" type="xs:string"/>
+          <xs:element name="Status" type="xs:short"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="ClientConfirmRequestData">
+        <xs:sequence>
+          <xs:element name="LoginAccount" type="xs:string"/>
+          <xs:element name="Token" type="xs:long"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="ClientConfirmResponseData">
+        <xs:sequence>
+          <xs:element name="Status" type="xs:short"/>
+          <xs:element name="RRN" type="xs:long"/>
+          <xs:element name="CardNumberMasked" type="xs:string"/>
+          <xs:element name="Token" type="xs:long"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:element name="PaymentRequest">
+        <xs:complexType>
+          <xs:sequence>
+            <xs:element name="MerchantID" type="xs:string"/>
+            <xs:element name="Amount" type="xs:int"/>
+            <xs:element name="Description" type="xs:string"/>
+            <xs:element name="Email" type="xs:string" minOccurs="0"/>
+            <xs:element name="Mobile" type="xs:string" minOccurs="0"/>
+            <xs:element name="CallbackURL" type="xs:string"/>
+          </xs:sequence>
+        </xs:complexType>
+      </xs:element>
+      <xs:element name="PaymentRequestResponse">
+        <xs:complexType>
+          <xs:sequence>
+            <xs:element name="Status" type="xs:int"/>
+            <xs:element name="Authority" type="xs:string"/>
+          </xs:sequence>
+        </xs:complexType>
+      </xs:element>
+      <xs:element name="PaymentVerification">
+        <xs:complexType>
+          <xs:sequence>
+            <xs:element name="MerchantID" type="xs:string"/>
+            <xs:element name="Authority" type="xs:string"/>
+            <xs:element name="Amount" type="xs:int"/>
+          </xs:sequence>
+        </xs:complexType>
+      </xs:element>
+      <xs:element name="PaymentVerificationResponse">
+        <xs:complexType>
+          <xs:sequence>
+            <xs:element name="Status" type="xs:int"/>
+            <xs:element name="RefID" type="xs:long"/>
+          </xs:sequence>
+        </xs:complexType>
+      </xs:element>
+      <xs:element name="SalePaymentRequest">
+        <xs:complexType>
+          <xs:sequence>
+            <xs:element name="requestData" type="tns:ClientSaleRequestData"/>
+          </xs:sequence>
+        </xs:complexType>
+      </xs:element>
+      <xs:element name="SalePaymentRequestResponse">
+        <xs:complexType>
+          <xs:sequence>
+            <xs:element name="SalePaymentRequestResult" type="tns:ClientSaleResponseData"/>
+          </xs:sequence>
+        </xs:complexType>
+      </xs:element>
+      <xs:element name="ConfirmPayment">
+        <xs:complexType>
+          <xs:sequence>
+            <xs:element name="requestData" type="tns:ClientConfirmRequestData"/>
+          </xs:sequence>
+        </xs:complexType>
+      </xs:element>
+      <xs:element name="ConfirmPaymentResponse">
+        <xs:complexType>
+          <xs:sequence>
+            <xs:element name="ConfirmPaymentResult" type="tns:ClientConfirmResponseData"/>
+          </xs:sequence>
+        </xs:complexType>
+      </xs:element>
+    </xs:schema>
+  </types>
+  {messages}
+  <portType name="StubPortType">{port_operations}
+  </portType>
+  <binding name="StubBinding" type="tns:StubPortType">
+    <soap:binding style="document" transport="http://schemas.xmlsoap.org/soap/http"/>{binding_operations}
+  </binding>
+  <service name="StubService">
+    <port name="StubPort" binding="tns:StubBinding">
+      <soap:address location="{location}"/>
+    </port>
+  </service>
+</definitions>
+'''
+
+RESPONSES = {
+    'PaymentRequest': '<Status>100</Status><Authority>000000000000000000000000000000000001</Authority>',
+    'PaymentVerification': '<Status>100</Status><RefID>1000001</RefID>',
+    'SalePaymentRequest': '<SalePaymentRequestResult><Token>1000001</Token><Message>OK</Message>'
+                          '<Status>0</Status></SalePaymentRequestResult>',
+    'ConfirmPayment': '<ConfirmPaymentResult><Status>0</Status><RRN>1000001</RRN>'
+                      '<CardNumberMasked>6037-99**-****-0001</CardNumberMasked><Token>1000001</Token>'
+                      '</ConfirmPaymentResult>',
+}
+
+ENVELOPE = '<?xml version="1.0" encoding="UTF-8"?>' \
+           '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>' \
+           '<{operation}Response xmlns="urn:stub">{content}</{operation}Response>' \
+           '</soap:Body></soap:Envelope>'
+
+OPERATION_PATTERN = re.compile(r'<(?:\w+:)?(SalePaymentRequest|PaymentRequest|PaymentVerification|ConfirmPayment)\b')
+
+
+def render_wsdl(location):
+    messages, port_operations, binding_operations = list(), list(), list()
+    for operation in RESPONSES:
+        messages.append(
+            '<message name="{0}Input"><part name="parameters" element="tns:{0}"/></message>'
+            '<message name="{0}Output"><part name="parameters" element="tns:{0}Response"/></message>'.format(operation)
+        )
+        port_operations.append(
+            '<operation name="{0}"><input message="tns:{0}Input"/><output message="tns:{0}Output"/>'
+            '</operation>'.format(operation)
+        )
+        binding_operations.append(
+            '<operation name="{0}"><soap:operation soapAction="urn:stub#{0}"/>'
+            '<input><soap:body use="literal"/></input><output><soap:body use="literal"/></output>'
+            '</operation>'.format(operation)
+        )
+    return WSDL.replace('{messages}', ''.join(messages)).replace(
+        '{port_operations}', ''.join(port_operations)
+    ).replace('{binding_operations}', ''.join(binding_operations)).replace('{location}', location)
+
+
+class StubSoapHandler(BaseHTTPRequestHandler):
+    """Serve WSDL on GET and successful canned responses of Zarinpal and
+    Parsian operations on POST after the latency of the server"""
+
+    def send_xml(self, body, status=200):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        self.send_xml(render_wsdl(self.server.location))
+
+    def do_POST(self):
+        time.sleep(self.server.latency)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        match = OPERATION_PATTERN.search(body)
+        if match is None:
+            self.send_xml('', status=400)
+            return
+        operation = match.group(1)
+        self.send_xml(ENVELOPE.format(operation=operation, content=RESPONSES[operation]))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubSoapServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0):
+        super().__init__(address, StubSoapHandler)
+        self.latency = latency
+        self.location = 'http://{}:{}/'.format(*self.server_address[:2])
+
+    @property
+    def wsdl_url(self):
+        return self.location + '?wsdl'
+
+
+def start_stub_server(address=('127.0.0.1', 0), latency=0):
+    """Start stub SOAP server in a daemon thread, call shutdown and
+    server_close of the result to stop it"""
+    server = StubSoapServer(address, latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
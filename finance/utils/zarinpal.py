@@ -1,15 +1,16 @@
 from django.conf import settings
-from suds.client import Client
+
+from finance.utils.soap import soap_clients
 
 
 def zpal_request_handler(gateway, payment):
-    client = Client(gateway.gateway_request_url)
-    result = client.service.PaymentRequest(
-        gateway.credentials['merchant_id'], payment.amount,
-        payment.detail,
-        payment.user.email, payment.user.phone_number,
-        settings.BASE_PATH + '/finance/VerifyPayment',
-    )
+    with soap_clients.client(gateway.gateway_request_url) as client:
+        result = client.service.PaymentRequest(
+            gateway.credentials['merchant_id'], payment.amount,
+            payment.detail,
+            payment.user.email, payment.user.phone_number,
+            settings.BASE_PATH + '/finance/VerifyPayment',
+        )
     if result.Status == 100:
         payment.authority = result.Authority
         payment.save()
@@ -18,14 +19,22 @@ def zpal_request_handler(gateway, payment):
         return None
 
 
+def zpal_payment_probe(payment):
+    """Verify payment on the gateway without saving it
+    :return: paid status and gateway response"""
+    with soap_clients.client(payment.gateway.gateway_request_url) as client:
+        result = client.service.PaymentVerification(
+            payment.gateway.credentials['merchant_id'],
+            payment.authority, payment.amount
+        )
+    response = {"status": getattr(result, 'Status', ''), "ref_id": getattr(result, 'RefID', '')}
+    return result.Status in [100, 101], response
+
+
 def zpal_payment_checker(payment, *args, **kwargs):
-    client = Client(payment.gateway.gateway_request_url)
-    result = client.service.PaymentVerification(
-        payment.gateway.credentials['merchant_id'],
-        payment.authority, payment.amount
-    )
-    if result.Status in [100, 101]:
+    is_paid, response = zpal_payment_probe(payment)
+    if is_paid:
         payment.is_paid = True
-        payment.ref_id = result.RefID
+        payment.ref_id = response['ref_id']
         payment.save()
     return payment.is_paid
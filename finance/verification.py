@@ -0,0 +1,236 @@
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from finance.events import payment_events
+from finance.models import Payment, Gateway
+from subscription.models import BaseTransaction, WalletEntry
+from subscription.models.transactions import SubscriptionTransaction
+
+logger = logging.getLogger(__file__)
+
+
+class PaymentVerificationEngine:
+    """
+    Batch verification of unpaid payments. Gateways are probed concurrently
+    by a bounded thread pool without touching the database, then paid
+    transitions of the batch are applied with bulk updates inside one
+    database transaction. Payment post_save signals are not sent, their
+    side effects (wallet, related transactions and owed settlement) are
+    applied here.
+    """
+    GATEWAY_CODES = (Gateway.FUNCTION_ZARRINPAL, Gateway.FUNCTION_PARSIAN)
+    scope = 'Batch verification'
+
+    def __init__(self, workers=None, batch_size=200):
+        """
+        :param workers: maximum concurrent gateway calls
+        :param batch_size: number of payments which are applied together
+        """
+        self.workers = workers or getattr(settings, 'PAYMENT_VERIFICATION_WORKERS', 8)
+        self.batch_size = batch_size
+        self.stats = defaultdict(lambda: dict(checked=0, paid=0, errors=0, total_latency=0.0, max_latency=0.0))
+
+    @classmethod
+    def get_candidates(cls, from_date=None):
+        """Ids of unpaid payments of verifiable gateways since from_date, the
+        default is PAYMENT_RECHECK_LOOKBACK_DAYS days ago"""
+        if from_date is None:
+            from_date = timezone.now() - timedelta(days=getattr(settings, 'PAYMENT_RECHECK_LOOKBACK_DAYS', 1))
+        return Payment.objects.filter(
+            created_time__gte=from_date, gateway__gateway_code__in=cls.GATEWAY_CODES, is_paid=False
+        ).exclude(authority='').values_list('id', flat=True)
+
+    def probe(self, payment):
+        """Verify one payment on its gateway, runs in worker threads
+        :return: (payment, is_paid, response, latency) which is_paid is None
+        when the gateway call has failed"""
+        started = time.perf_counter()
+        try:
+            is_paid, response = payment.gateway.get_probe_handler()(payment)
+        except Exception as error:
+            logger.warning('payment {} verification failed: {}'.format(payment.pk, error))
+            is_paid, response = None, None
+        return payment, is_paid, response, time.perf_counter() - started
+
+    def update_stats(self, payment, is_paid, latency):
+        stats = self.stats[payment.gateway.gateway_code]
+        stats['checked'] += 1
+        stats['total_latency'] += latency
+        stats['max_latency'] = max(stats['max_latency'], latency)
+        if is_paid is None:
+            stats['errors'] += 1
+        elif is_paid:
+            stats['paid'] += 1
+
+    def apply(self, paid):
+        """
+        Flag verified payments as paid with bulk updates and apply the side
+        effects of their paid transitions
+        :param paid: list of (payment, gateway response)
+        :return: list of paid payment ids
+        """
+        responses = {payment.pk: response for payment, response in paid}
+        with transaction.atomic():
+            payments = self.lock_payments(pk__in=responses, is_paid=False)
+            if not payments:
+                return list()
+            Payment.objects.filter(pk__in=[payment.pk for payment in payments]).update(
+                is_paid=True, settlement_status=Payment.SETTLEMENT_DONE, modified_time=timezone.now()
+            )
+            payment_events.record_bulk((payment, self.scope, responses[payment.pk]) for payment in payments)
+            self.settle(payments)
+        return [payment.pk for payment in payments]
+
+    @staticmethod
+    def lock_payments(**filters):
+        """
+        Lock payments which match filters and load them with their related
+        transactions. Payment rows are locked alone, PostgreSQL does not lock
+        the nullable side of the outer joins of reverse relations
+        :return: list of locked payments
+        """
+        payment_ids = list(Payment.objects.select_for_update().filter(**filters).values_list('pk', flat=True))
+        if not payment_ids:
+            return list()
+        return list(Payment.objects.filter(pk__in=payment_ids).select_related(
+            'transaction', 'transaction__subscription_transaction', 'transaction__target_transaction'
+        ))
+
+    @classmethod
+    def settle(cls, payments):
+        """Apply side effects of paid transitions of given payments, same as
+        Payment post_save signals, should be called inside the database
+        transaction which has flagged them"""
+        cls.post_to_wallets(payments)
+        settle_users, subscription_transactions = set(), list()
+        for payment in payments:
+            if payment.is_wallet_charge():
+                settle_users.add(payment.user_id)
+                continue
+            related = payment.transaction.related
+            if isinstance(related, SubscriptionTransaction):
+                subscription_transactions.append(related.pk)
+            else:
+                related.set_paid()
+        SubscriptionTransaction.set_paid_bulk(subscription_transactions)
+        for user_id in settle_users:
+            BaseTransaction.check_owed(user_id)
+
+    @classmethod
+    def settle_pending(cls, payment_ids):
+        """
+        Settle paid payments which their settlement is deferred, payments
+        which are already settled are skipped so it is safe to run twice
+        :param payment_ids: iterable of Payment ids
+        :return: list of settled payment ids
+        """
+        with transaction.atomic():
+            payments = cls.lock_payments(
+                pk__in=list(payment_ids), is_paid=True,
+                settlement_status__in=[Payment.SETTLEMENT_PENDING, Payment.SETTLEMENT_FAILED]
+            )
+            if not payments:
+                return list()
+            cls.settle(payments)
+            Payment.objects.filter(pk__in=[payment.pk for payment in payments]).update(
+                settlement_status=Payment.SETTLEMENT_DONE, modified_time=timezone.now()
+            )
+        return [payment.pk for payment in payments]
+
+    @staticmethod
+    def post_to_wallets(payments):
+        """Bulk mode of WalletEntry.sync for paid payments"""
+        transactions = [
+            payment.transaction for payment in payments
+            if payment.transaction.transaction_type in BaseTransaction.WALLET_CREDIT_TYPES
+        ]
+        posted = dict(WalletEntry.objects.filter(
+            transaction__in=transactions, source=WalletEntry.PAYMENT
+        ).values_list('transaction').annotate(Sum('amount')).order_by())
+        WalletEntry.post_bulk([
+            WalletEntry(
+                user_id=base_transaction.user_id, transaction=base_transaction, source=WalletEntry.PAYMENT,
+                amount=base_transaction.amount - posted.get(base_transaction.pk, 0)
+            ) for base_transaction in transactions if base_transaction.amount != posted.get(base_transaction.pk, 0)
+        ])
+
+    def verify(self, payment_ids):
+        """
+        Probe given payments concurrently and apply paid ones
+        :param payment_ids: iterable of Payment ids
+        :return: list of paid payment ids
+        """
+        payments = Payment.objects.filter(pk__in=list(payment_ids), is_paid=False).select_related('gateway')
+        paid = list()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for payment, is_paid, response, latency in executor.map(self.probe, payments):
+                self.update_stats(payment, is_paid, latency)
+                if is_paid:
+                    paid.append((payment, response))
+        return self.apply(paid) if paid else list()
+
+    def run(self, payment_ids):
+        """
+        Verify payments batch by batch
+        :return: dict of paid ids and per gateway statistics
+        """
+        payment_ids, paid_ids = list(payment_ids), list()
+        for index in range(0, len(payment_ids), self.batch_size):
+            paid_ids.extend(self.verify(payment_ids[index:index + self.batch_size]))
+        report = dict(paid=paid_ids, gateways=self.get_stats())
+        logger.warning('payments verification: {}'.format(report['gateways']))
+        return report
+
+    def get_stats(self):
+        return {
+            code: dict(
+                checked=stats['checked'], paid=stats['paid'], errors=stats['errors'],
+                average_latency=stats['total_latency'] / stats['checked'] if stats['checked'] else 0,
+                max_latency=stats['max_latency'],
+            ) for code, stats in self.stats.items()
+        }
+
+
+def verify_callback(payment, data):
+    """
+    Fast path of bank callbacks, the payment is verified on its gateway and
+    flagged as paid with a conditional update, so only the first of
+    duplicate callbacks queues the settlement. Settlement runs by
+    settle_payments task after commit, or in place when
+    PAYMENT_DEFER_SETTLEMENT is False
+    :param payment: Payment instance with gateway
+    :param data: callback payload
+    :return: paid status
+    """
+    from finance.tasks import settle_payments
+    if payment.is_paid:
+        return True
+    handler = payment.gateway.get_probe_handler() if payment.gateway is not None else None
+    if handler is None:
+        return payment.verify(data)
+
+    is_paid, response = handler(payment)
+    if not is_paid:
+        payment.save_log(response, scope='Callback verification')
+        return False
+
+    defer = getattr(settings, 'PAYMENT_DEFER_SETTLEMENT', True)
+    with transaction.atomic():
+        flagged = Payment.objects.filter(pk=payment.pk, is_paid=False).update(
+            is_paid=True, settlement_status=Payment.SETTLEMENT_PENDING, modified_time=timezone.now()
+        )
+        payment.save_log(response, scope='Callback verification')
+        if flagged and defer:
+            transaction.on_commit(lambda: settle_payments.delay([payment.pk]))
+        elif flagged:
+            PaymentVerificationEngine.settle_pending([payment.pk])
+    payment.refresh_from_db(fields=['is_paid', 'settlement_status'])
+    return payment.is_paid
@@ -15,18 +15,44 @@ from rest_framework.viewsets import GenericViewSet
 from rest_framework_jwt.authentication import JSONWebTokenAuthentication
 from rest_framework.exceptions import ValidationError
 
-from finance.models import Payment, Gateway
+from finance.availability import gateway_availability
+from finance.gateways import gateway_registry
+from finance.models import Payment, PaymentCallback, QueuedPaymentStart
 from finance.serializers import PaymentInlineSerializer, WalletChargeSerializer \
     , PaymentSerializer
+from finance.verification import verify_callback
 from subscription.models import BaseTransaction
 
-import datetime
+import json
+
+
+def route_payment(gateway_code):
+    """
+    Enabled gateway to start the payment, requested gateway is used when it
+    is not in maintenance otherwise another available gateway. Unknown and
+    disabled gateways are not found
+    :return: GatewayEntry or None when all gateways are in maintenance
+    """
+    if gateway_registry.get(gateway_code) is None:
+        raise Http404
+    return gateway_availability.available_gateway(gateway_code)
+
+
+def queued_response(payment, gateway_code):
+    """Queue payment start until gateways maintenance ends"""
+    release_time = gateway_availability.release_time()
+    QueuedPaymentStart.queue(payment, gateway_code, release_time)
+    return Response({
+        'message': _("Gateways are in maintenance, payment link would be sent to you after {}").format(
+            release_time.strftime('%H:%M')
+        ),
+        'release_time': release_time,
+    }, status=status.HTTP_202_ACCEPTED)
 
 
 class InstantPayment(APIView):
     def get(self, request, invoice_number, gateway, *args, **kwargs):
         payment_query = dict(invoice_number=invoice_number)
-        gateway_query = dict(gateway_code=gateway)
         payment = get_object_or_404(Payment.objects.all(), **payment_query)
         if payment.is_paid:
             payment = payment.clone()
@@ -38,12 +64,10 @@ class InstantPayment(APIView):
             cannot do it again. This issue should be fixed later"""
         #    return Response(status=status.HTTP_204_NO_CONTENT)
 
-        now = datetime.datetime.now()
-        if now.hour == 23 and now.minute >= 45 or now.hour == 0 and now.minute < 30:
-            raise ValidationError("Please try again after 00:30")
-
-        gateway = get_object_or_404(Gateway.objects.filter(is_enable=True), **gateway_query)
-        payment.gateway = gateway
+        entry = route_payment(gateway)
+        if entry is None:
+            return queued_response(payment, gateway)
+        payment.gateway_id = entry.pk
         payment.save()
 
         bank_page = payment.bank_page
@@ -74,27 +98,24 @@ class PaymentViewSet(APIView):
 
     def get(self, request, invoice_number, gateway, *args, **kwargs):
         payment_query = dict(invoice_number=invoice_number)
-        payment = get_object_or_404(Payment.objects.all(), **payment_query)
+        payment = get_object_or_404(Payment.objects.select_related('gateway'), **payment_query)
 
-        now = datetime.datetime.now()
-        if now.hour == 23 and now.minute >= 45 or now.hour == 0 and now.minute < 30:
-            raise ValidationError("Please try again after 00:30")
+        closes_at = gateway_availability.closes_at(payment.gateway.gateway_code if payment.gateway else None)
+        if closes_at is not None:
+            raise ValidationError(_("Please try again after {}").format(closes_at.strftime('%H:%M')))
 
-        payment.verify()
+        payment.verify(request.data)
         serializer = PaymentInlineSerializer(payment, context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def post(self, request, invoice_number, gateway, *args, **kwargs):
         payment_query = dict(invoice_number=invoice_number)
-        gateway_query = dict(gateway_code=gateway)
         payment = get_object_or_404(Payment.objects.all(), **payment_query)
-        gateway = get_object_or_404(Gateway.objects.filter(is_enable=True), **gateway_query)
-
-        now = datetime.datetime.now()
-        if now.hour == 23 and now.minute >= 45 or now.hour == 0 and now.minute < 30:
-            raise ValidationError("Please try again after 00:30")
+        entry = route_payment(gateway)
+        if entry is None:
+            return queued_response(payment, gateway)
 
-        payment.gateway = gateway
+        payment.gateway_id = entry.pk
         payment.save()
         bank_page = payment.bank_page
         if bank_page is None:
@@ -157,15 +178,19 @@ class PaymentVerification(View):
             filter_data['id'] = data.get('OrderId')
         else:
             raise Http404
-        payment = Payment.objects.select_related('transaction').filter(**filter_data).first()
+        payment = Payment.objects.select_related('transaction', 'gateway').filter(**filter_data).first()
         return payment
 
     def default_handler(self, request, *args, **kwargs):
         data = self.get_data(request)
         payment = self.get_payment(data)
+        PaymentCallback.objects.create(
+            payment=payment, payload=json.dumps(data.dict() if hasattr(data, 'dict') else dict(data)),
+            is_duplicate=payment is not None and payment.is_paid
+        )
         if payment is None:
             raise Http404
-        payment.verify(data)
+        verify_callback(payment, data)
         if hasattr(payment.transaction, 'subscription_transaction'):
             template = "GreetingPaymentVerificationTemplate.html"
         elif hasattr(payment.transaction, 'target_transaction'):
@@ -175,6 +200,21 @@ class PaymentVerification(View):
         return render(request, template, {'payment': payment, 'user': request.user})
 
 
+class PaymentSettlementStatusAPIView(APIView):
+    """Settlement state of a payment which is polled by payment result page
+    until its deferred settlement is done"""
+
+    def get(self, request, invoice_number, *args, **kwargs):
+        payment = get_object_or_404(
+            Payment.objects.only('invoice_number', 'is_paid', 'settlement_status'), invoice_number=invoice_number
+        )
+        return Response({
+            'invoice_number': payment.invoice_number,
+            'is_paid': payment.is_paid,
+            'settlement': payment.settlement_state,
+        }, status=status.HTTP_200_OK)
+
+
 class WalletViewSet(mixins.ListModelMixin, mixins.CreateModelMixin, mixins.RetrieveModelMixin, GenericViewSet):
     """
     Return list of all wallet charge requests on GET request
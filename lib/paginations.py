@@ -1,4 +1,4 @@
-from rest_framework.pagination import LimitOffsetPagination, PageNumberPagination
+from rest_framework.pagination import LimitOffsetPagination, PageNumberPagination, CursorPagination
 
 
 class PostLimitPagination(LimitOffsetPagination):
@@ -63,3 +63,12 @@ class DefaultPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     page_size = 10
     max_page_size = 30
+
+
+class DonorHistoryPagination(CursorPagination):
+    """
+    Cursor pagination of a donor transactions history in business panel,
+    pages stay cheap for donors with long histories
+    """
+    page_size = 12
+    ordering = '-created_time'
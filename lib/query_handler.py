@@ -1,5 +1,6 @@
 from lib.date_mapper import jalali_date_mapper
-from django.db.models import Case, IntegerField, Value, When
+from django.db.models import Case, IntegerField, Value, When, Subquery
+from django.db.models.functions import Coalesce
 
 
 def generate_date_conditions(months_ago=6, key='created_time'):
@@ -32,3 +33,10 @@ def generate_date_cases(months_ago=6, key='created_time'):
     """Fetch conditions and init case to be used inside the query manager"""
     conditions = generate_date_conditions(months_ago, key)
     return Case(*conditions, output_field=IntegerField())
+
+
+def grouped_subquery(queryset, group_by, aggregate):
+    """Aggregate given queryset, which is filtered by OuterRef, per group_by
+    field and use it as an integer subquery, missing groups are 0"""
+    queryset = queryset.values(group_by).annotate(value=aggregate).values('value').order_by()
+    return Coalesce(Subquery(queryset, output_field=IntegerField()), 0)
@@ -1,3 +1,25 @@
 from django.contrib import admin
 
-# Register your models here.
+from messenger.models import SMSOutbox, ShortLink
+
+
+class SMSOutboxAdmin(admin.ModelAdmin):
+    list_display = [
+        "phone_number", "template", "status", "attempts", "created_time", "sent_time", "delivery_status"
+    ]
+    list_filter = ("status", "template", "delivery_status")
+    search_fields = ["phone_number", "provider_message_id"]
+    date_hierarchy = "created_time"
+    ordering = ('-created_time',)
+
+
+admin.site.register(SMSOutbox, SMSOutboxAdmin)
+
+
+class ShortLinkAdmin(admin.ModelAdmin):
+    list_display = ["code", "url", "created_time"]
+    search_fields = ["url"]
+    ordering = ('-created_time',)
+
+
+admin.site.register(ShortLink, ShortLinkAdmin)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from messenger.sms_stub import StubSMSServer
+
+
+class Command(BaseCommand):
+    help = "Run local stub server of Kavenegar send, lookup and status APIs, set SMS_PROVIDER_URL to the " \
+           "printed url"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', dest='host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, dest='port', default=8071)
+        parser.add_argument('--latency', type=float, dest='latency', default=0, help="seconds per response")
+
+    def handle(self, *args, **options):
+        server = StubSMSServer((options['host'], options['port']), options['latency'])
+        print('-' * 80)
+        print("Provider url:\t", server.location)
+        print('-' * 80)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
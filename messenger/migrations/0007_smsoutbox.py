@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0006_auto_20190930_0828'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SMSOutbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_time', models.DateTimeField(auto_now_add=True, verbose_name='created time')),
+                ('modified_time', models.DateTimeField(auto_now=True, verbose_name='modified time')),
+                ('deleted_time', models.DateTimeField(blank=True, editable=False, null=True, verbose_name='deleted time')),
+                ('deleted', models.BooleanField(default=False, editable=False, verbose_name='deleted')),
+                ('phone_number', models.CharField(max_length=20, verbose_name='phone number')),
+                ('template', models.CharField(blank=True, max_length=100, verbose_name='template')),
+                ('tokens', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict, verbose_name='tokens')),
+                ('text', models.TextField(blank=True, verbose_name='text')),
+                ('status', models.PositiveSmallIntegerField(choices=[(0, 'queued'), (5, 'sending'), (10, 'sent'), (15, 'failed')], db_index=True, default=0, verbose_name='status')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='attempts')),
+                ('next_attempt_time', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='next attempt time')),
+                ('sent_time', models.DateTimeField(blank=True, null=True, verbose_name='sent time')),
+                ('provider_message_id', models.CharField(blank=True, max_length=32, verbose_name='provider message id')),
+                ('delivery_status', models.SmallIntegerField(blank=True, null=True, verbose_name='delivery status')),
+                ('last_error', models.TextField(blank=True, verbose_name='last error')),
+            ],
+            options={
+                'verbose_name': 'SMSOutbox',
+                'verbose_name_plural': 'SMSOutboxes',
+            },
+        ),
+    ]
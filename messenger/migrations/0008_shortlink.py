@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0007_smsoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShortLink',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_time', models.DateTimeField(auto_now_add=True, verbose_name='created time')),
+                ('modified_time', models.DateTimeField(auto_now=True, verbose_name='modified time')),
+                ('deleted_time', models.DateTimeField(blank=True, editable=False, null=True, verbose_name='deleted time')),
+                ('deleted', models.BooleanField(default=False, editable=False, verbose_name='deleted')),
+                ('url', models.CharField(db_index=True, max_length=500, verbose_name='url')),
+            ],
+            options={
+                'verbose_name': 'ShortLink',
+                'verbose_name_plural': 'ShortLinks',
+            },
+        ),
+    ]
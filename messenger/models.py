@@ -1,10 +1,13 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.fields import JSONField
 from django.core.validators import FileExtensionValidator
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 from lib.common_model import BaseModel
 from lib.fields import FarsiTextField
+from utils.encoder import IDEncoder, EncoderError
 
 User = get_user_model()
 
@@ -47,3 +50,96 @@ class MessageBody(BaseModel):
         self.is_read = True
         self.save()
         return self.is_read
+
+
+class SMSOutbox(BaseModel):
+    """
+    SMS which is queued to be sent by SMSDispatcher, template messages are
+    sent by Kavenegar lookup API with tokens and others by send API with text
+    """
+    QUEUED = 0
+    SENDING = 5
+    SENT = 10
+    FAILED = 15
+    STATUS_CHOICES = (
+        (QUEUED, _("queued")),
+        (SENDING, _("sending")),
+        (SENT, _("sent")),
+        (FAILED, _("failed")),
+    )
+    phone_number = models.CharField(max_length=20, verbose_name=_("phone number"))
+    template = models.CharField(max_length=100, verbose_name=_("template"), blank=True)
+    tokens = JSONField(verbose_name=_("tokens"), default=dict, blank=True)
+    text = models.TextField(verbose_name=_("text"), blank=True)
+    status = models.PositiveSmallIntegerField(
+        verbose_name=_("status"), choices=STATUS_CHOICES, default=QUEUED, db_index=True
+    )
+    attempts = models.PositiveSmallIntegerField(verbose_name=_("attempts"), default=0)
+    next_attempt_time = models.DateTimeField(verbose_name=_("next attempt time"), default=timezone.now, db_index=True)
+    sent_time = models.DateTimeField(verbose_name=_("sent time"), null=True, blank=True)
+    provider_message_id = models.CharField(max_length=32, verbose_name=_("provider message id"), blank=True)
+    delivery_status = models.SmallIntegerField(verbose_name=_("delivery status"), null=True, blank=True)
+    last_error = models.TextField(verbose_name=_("last error"), blank=True)
+
+    class Meta:
+        verbose_name = _("SMSOutbox")
+        verbose_name_plural = _("SMSOutboxes")
+
+    def __str__(self):
+        return '{}: {}'.format(self.phone_number, self.template or self.text[:20])
+
+    @classmethod
+    def template_message(cls, phone_number, template, tokens):
+        """Unsaved template message, str values of tokens are sent"""
+        return cls(
+            phone_number=phone_number, template=template,
+            tokens={key: str(value) for key, value in tokens.items() if value is not None}
+        )
+
+    @classmethod
+    def text_message(cls, phone_number, text):
+        return cls(phone_number=phone_number, text=text)
+
+    @classmethod
+    def enqueue(cls, messages):
+        """Queue unsaved messages with one insert"""
+        return cls.objects.bulk_create([message for message in messages if message.phone_number])
+
+
+class ShortLink(BaseModel):
+    """Short link of a long url, the code of the link is the encoded pk so it
+    is created with one insert"""
+    url = models.CharField(max_length=500, verbose_name=_("url"), db_index=True)
+
+    class Meta:
+        verbose_name = _("ShortLink")
+        verbose_name_plural = _("ShortLinks")
+
+    def __str__(self):
+        return self.code
+
+    @property
+    def code(self):
+        return IDEncoder().encode_id(self.pk)
+
+    @classmethod
+    def get_pk(cls, code):
+        """:return: pk of given code or None when it is not a valid code"""
+        try:
+            return IDEncoder().decode_id(code)
+        except EncoderError:
+            return None
+
+    @classmethod
+    def shorten_bulk(cls, urls):
+        """
+        Links of given urls with one select and one insert, existing links of
+        the urls are reused
+        :return: dict of url and ShortLink
+        """
+        urls = set(urls)
+        links = {link.url: link for link in cls.objects.filter(url__in=urls).order_by('pk')}
+        links.update((link.url, link) for link in cls.objects.bulk_create([
+            cls(url=url) for url in urls if url not in links
+        ]))
+        return links
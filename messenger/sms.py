@@ -0,0 +1,212 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, When, Value, CharField, TextField, DateTimeField, F, Q
+from django.utils import timezone
+
+from messenger.models import SMSOutbox
+
+logger = logging.getLogger(__file__)
+
+
+class ProviderError(Exception):
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class KavenegarProvider:
+    """
+    Kavenegar REST API over one pooled requests session. HTTP statuses which
+    are worth retrying are server errors, 418 (credit) and 429 (too many
+    requests), other errors are permanent for the message
+    """
+    RETRYABLE_STATUSES = (418, 429)
+    # delivery statuses which are not changed later: failed, delivered, undelivered, blocked, invalid id
+    FINAL_DELIVERY_STATUSES = (6, 10, 11, 14, 100)
+    TOKEN_KEYS = ('token', 'token2', 'token3', 'token10', 'token20')
+
+    def __init__(self, api_key=None, base_url=None, timeout=None):
+        self.api_key = api_key or getattr(settings, 'KAVENEGAR_API_KEY', '')
+        self.base_url = base_url or getattr(settings, 'SMS_PROVIDER_URL', 'https://api.kavenegar.com/v1/')
+        self.timeout = timeout or getattr(settings, 'SMS_PROVIDER_TIMEOUT', (5, 30))
+        self.session = requests.Session()
+
+    def call(self, action, data):
+        url = '{}{}/{}.json'.format(self.base_url, self.api_key, action)
+        try:
+            response = self.session.post(url, data=data, timeout=self.timeout)
+        except requests.RequestException as error:
+            raise ProviderError(str(error))
+        try:
+            result = response.json()
+        except ValueError:
+            result = {}
+        status = result.get('return', {}).get('status', response.status_code)
+        if status != 200:
+            message = result.get('return', {}).get('message', response.reason)
+            raise ProviderError(
+                '{}: {}'.format(status, message), retryable=status >= 500 or status in self.RETRYABLE_STATUSES
+            )
+        return result.get('entries') or []
+
+    def send(self, message):
+        """
+        :param message: SMSOutbox instance
+        :return: provider message id
+        """
+        if message.template:
+            data = dict(receptor=message.phone_number, template=message.template)
+            data.update((key, value) for key, value in message.tokens.items() if key in self.TOKEN_KEYS)
+            entries = self.call('verify/lookup', data)
+        else:
+            entries = self.call('sms/send', dict(receptor=message.phone_number, message=message.text))
+        return str(entries[0]['messageid']) if entries else ''
+
+    def statuses(self, message_ids):
+        """Delivery statuses of given provider message ids"""
+        entries = self.call('sms/status', dict(messageid=','.join(message_ids)))
+        return {str(entry['messageid']): entry['status'] for entry in entries}
+
+
+class RateLimiter:
+    """Allow at most rate calls per second across threads of the process"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class SMSDispatcher:
+    """
+    Drain SMSOutbox in batches. Due messages are claimed with
+    select_for_update(skip_locked) so workers never send one message twice,
+    sent within SMS_RATE_LIMIT messages per second, and their results are
+    saved with one update per batch. Failed attempts are retried after
+    exponential backoff until max_attempts
+    """
+
+    def __init__(self, provider=None, batch_size=100, rate=None, max_attempts=5, backoff=30):
+        self.provider = provider or KavenegarProvider()
+        self.batch_size = batch_size
+        self.rate = rate or getattr(settings, 'SMS_RATE_LIMIT', 10)
+        self.limiter = RateLimiter(self.rate)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    def claim(self):
+        """Due messages of the next batch, messages which are left in sending
+        state by a stopped worker are claimed again after ten minutes"""
+        now = timezone.now()
+        with transaction.atomic():
+            messages = list(SMSOutbox.objects.select_for_update(skip_locked=True).filter(
+                Q(status=SMSOutbox.QUEUED, next_attempt_time__lte=now) |
+                Q(status=SMSOutbox.SENDING, modified_time__lt=now - timedelta(minutes=10))
+            ).order_by('next_attempt_time', 'pk')[:self.batch_size])
+            SMSOutbox.objects.filter(pk__in=[message.pk for message in messages]).update(
+                status=SMSOutbox.SENDING, attempts=F('attempts') + 1, modified_time=now
+            )
+        return messages
+
+    def send(self, message):
+        """:return: (provider message id, error)"""
+        self.limiter.wait()
+        try:
+            return self.provider.send(message), None
+        except ProviderError as error:
+            return None, error
+
+    def retry_time(self, message, now):
+        return now + timedelta(seconds=self.backoff * 2 ** message.attempts)
+
+    def save_results(self, results):
+        """
+        :param results: list of (message, provider message id, error)
+        """
+        now = timezone.now()
+        sent = [(message, message_id) for message, message_id, error in results if error is None]
+        retried = [
+            (message, error) for message, message_id, error in results
+            if error is not None and error.retryable and message.attempts + 1 < self.max_attempts
+        ]
+        retried_ids = {message.pk for message, _error in retried}
+        failed = [
+            (message, error) for message, message_id, error in results
+            if error is not None and message.pk not in retried_ids
+        ]
+        if sent:
+            SMSOutbox.objects.filter(pk__in=[message.pk for message, _message_id in sent]).update(
+                status=SMSOutbox.SENT, sent_time=now, last_error='', provider_message_id=Case(*[
+                    When(pk=message.pk, then=Value(message_id)) for message, message_id in sent
+                ], output_field=CharField())
+            )
+        if retried:
+            SMSOutbox.objects.filter(pk__in=[message.pk for message, _error in retried]).update(
+                status=SMSOutbox.QUEUED,
+                next_attempt_time=Case(*[
+                    When(pk=message.pk, then=Value(self.retry_time(message, now))) for message, _error in retried
+                ], output_field=DateTimeField()),
+                last_error=Case(*[
+                    When(pk=message.pk, then=Value(str(error))) for message, error in retried
+                ], output_field=TextField()),
+            )
+        if failed:
+            SMSOutbox.objects.filter(pk__in=[message.pk for message, _error in failed]).update(
+                status=SMSOutbox.FAILED, last_error=Case(*[
+                    When(pk=message.pk, then=Value(str(error))) for message, error in failed
+                ], output_field=TextField())
+            )
+        return len(sent)
+
+    def batches_within(self, seconds):
+        """Number of batches which are sent within given seconds at the rate
+        limit, at least one"""
+        return max(1, int(self.rate * seconds) // self.batch_size)
+
+    def drain(self, max_batches=None):
+        """
+        Send due messages batch by batch until the outbox is empty
+        :return: number of sent messages
+        """
+        sent, batches = 0, 0
+        while max_batches is None or batches < max_batches:
+            messages = self.claim()
+            if not messages:
+                break
+            sent += self.save_results([(message,) + self.send(message) for message in messages])
+            batches += 1
+        return sent
+
+    def refresh_delivery(self, since, chunk_size=500):
+        """Read delivery statuses of messages which are sent since given time"""
+        messages = SMSOutbox.objects.filter(status=SMSOutbox.SENT, sent_time__gte=since).exclude(
+            provider_message_id=''
+        ).exclude(delivery_status__in=KavenegarProvider.FINAL_DELIVERY_STATUSES).values_list(
+            'provider_message_id', flat=True
+        )
+        message_ids, updated = list(messages), 0
+        for index in range(0, len(message_ids), chunk_size):
+            try:
+                statuses = self.provider.statuses(message_ids[index:index + chunk_size])
+            except ProviderError as error:
+                logger.warning('sms delivery statuses failed: {}'.format(error))
+                continue
+            for delivery_status in set(statuses.values()):
+                updated += SMSOutbox.objects.filter(provider_message_id__in=[
+                    message_id for message_id, value in statuses.items() if value == delivery_status
+                ]).update(delivery_status=delivery_status)
+        return updated
@@ -0,0 +1,65 @@
+import itertools
+import json
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+
+
+class StubSMSHandler(BaseHTTPRequestHandler):
+    """Answer Kavenegar send, lookup and status calls after the latency of
+    the server, receptors of server errors get their error status"""
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, status, message, entries=None):
+        body = json.dumps({'return': {'status': status, 'message': message}, 'entries': entries}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        time.sleep(self.server.latency)
+        data = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+        action = self.path.rsplit('/', 2)
+        action = '{}/{}'.format(action[-2], action[-1].replace('.json', ''))
+        with self.server.lock:
+            self.server.requests.append((action, data))
+        if action == 'sms/status':
+            message_ids = data.get('messageid', [''])[0].split(',')
+            self.send_json(200, 'OK', [{'messageid': int(message_id), 'status': 10} for message_id in message_ids])
+            return
+        receptor = data.get('receptor', [''])[0]
+        status = self.server.errors.get(receptor)
+        if status is not None:
+            self.send_json(status, 'stub error')
+            return
+        self.send_json(200, 'OK', [{'messageid': next(self.server.message_ids), 'receptor': receptor, 'status': 1}])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubSMSServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0, errors=None):
+        super().__init__(address, StubSMSHandler)
+        self.latency = latency
+        self.errors = dict(errors or {})
+        self.requests = list()
+        self.lock = threading.Lock()
+        self.message_ids = itertools.count(1000)
+        self.location = 'http://{}:{}/'.format(*self.server_address[:2])
+
+
+def start_stub_server(address=('127.0.0.1', 0), latency=0, errors=None):
+    """Start stub Kavenegar server in a daemon thread, call shutdown and
+    server_close of the result to stop it
+    :param errors: dict of receptor and HTTP status which is returned for it
+    """
+    server = StubSMSServer(address, latency, errors)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
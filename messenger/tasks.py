@@ -0,0 +1,37 @@
+import logging
+from datetime import timedelta
+
+from celery.schedules import crontab
+from celery.task import periodic_task
+from django.core.cache import cache
+from django.utils import timezone
+
+from messenger.sms import SMSDispatcher
+
+logger = logging.getLogger(__file__)
+
+DRAIN_LOCK_KEY = 'messenger:drain_sms_outbox'
+# a run which is stopped without releasing the lock blocks the next runs up to this many seconds
+DRAIN_LOCK_TIMEOUT = 5 * 60
+
+
+@periodic_task(name='Send queued SMS', run_every=crontab(minute='*'))
+def drain_sms_outbox(max_batches=None):
+    """Send due SMSOutbox messages, runs every minute. Only one run sends at a
+    time so workers do not exceed SMS_RATE_LIMIT together, and a run stops
+    after the batches which are sent within a minute at that rate"""
+    if not cache.add(DRAIN_LOCK_KEY, True, DRAIN_LOCK_TIMEOUT):
+        logger.info('previous sms outbox run is not finished')
+        return 0
+    try:
+        dispatcher = SMSDispatcher()
+        sent = dispatcher.drain(max_batches=max_batches or dispatcher.batches_within(60))
+    finally:
+        cache.delete(DRAIN_LOCK_KEY)
+    logger.info('sent {} queued sms'.format(sent))
+    return sent
+
+
+@periodic_task(name='Refresh SMS delivery statuses', run_every=crontab(minute=30))
+def refresh_sms_delivery():
+    return SMSDispatcher().refresh_delivery(timezone.now() - timedelta(days=1))
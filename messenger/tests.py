@@ -1,3 +1,81 @@
-from django.test import TestCase
+from urllib.parse import urlparse
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import resolve
+
+from messenger.models import SMSOutbox, ShortLink
+from messenger.sms import SMSDispatcher, KavenegarProvider
+from messenger.sms_stub import start_stub_server
+from messenger.tasks import drain_sms_outbox, DRAIN_LOCK_KEY, DRAIN_LOCK_TIMEOUT
+from messenger.views import ShortLinkRedirectView
+from utils.links import make_short_bulk, make_short, display_link, resolve_short_link
+
+
+class SMSDispatcherTestCase(TestCase):
+
+    def test_drain_outbox(self):
+        server = start_stub_server(errors={'09120000001': 500, '09120000002': 411})
+        try:
+            SMSOutbox.enqueue(
+                [SMSOutbox.template_message('0912000001{}'.format(i), 'ABREAST-A4', {'token': i}) for i in range(5)] +
+                [SMSOutbox.template_message('09120000001', 'ABREAST-A4', {}),
+                 SMSOutbox.template_message('09120000002', 'ABREAST-A4', {})]
+            )
+            dispatcher = SMSDispatcher(
+                provider=KavenegarProvider(api_key='key', base_url=server.location), batch_size=3, rate=1000
+            )
+            sent = dispatcher.drain()
+            updated = dispatcher.refresh_delivery(SMSOutbox.objects.order_by('created_time').first().created_time)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(sent, 5)
+        self.assertEqual(updated, 5)
+        self.assertEqual(SMSOutbox.objects.filter(status=SMSOutbox.SENT, delivery_status=10).count(), 5)
+        retried = SMSOutbox.objects.get(phone_number='09120000001')
+        self.assertEqual((retried.status, retried.attempts), (SMSOutbox.QUEUED, 1), "Server error is not retried")
+        self.assertEqual(SMSOutbox.objects.get(phone_number='09120000002').status, SMSOutbox.FAILED)
+        self.assertEqual(len([action for action, data in server.requests if action == 'verify/lookup']), 7)
+
+    def test_drain_lock(self):
+        SMSOutbox.enqueue([SMSOutbox.template_message('09120000010', 'ABREAST-A4', {})])
+        self.assertEqual(SMSDispatcher(rate=10, batch_size=100).batches_within(60), 6)
+        cache.add(DRAIN_LOCK_KEY, True, DRAIN_LOCK_TIMEOUT)
+        try:
+            self.assertEqual(drain_sms_outbox(), 0, "Outbox is drained by concurrent runs")
+        finally:
+            cache.delete(DRAIN_LOCK_KEY)
+        self.assertEqual(SMSOutbox.objects.get().status, SMSOutbox.QUEUED)
+
+
+class ShortLinkTestCase(TestCase):
+
+    @override_settings(SHORT_LINK_BASE='https://ham3.ir/')
+    def test_short_links(self):
+        urls = ['https://website.com/finance/pay/{}/zarrinpal/'.format(i) for i in range(3)]
+        with self.assertNumQueries(2):
+            links = make_short_bulk(urls + ['https://example.com/'])
+        self.assertEqual(links['https://example.com/'], 'https://example.com/')
+        with self.assertNumQueries(1):
+            self.assertEqual(make_short(urls[0]), links[urls[0]], "Existing link is not reused")
+        self.assertEqual(ShortLink.objects.count(), 3)
+
+        code = display_link(links[urls[1]]).split('/')[-1]
+        request = RequestFactory().get('/')
+        response = ShortLinkRedirectView.as_view()(request, code=code)
+        self.assertEqual(response['Location'], urls[1])
+        with self.assertNumQueries(0):
+            ShortLinkRedirectView.as_view()(request, code=code)
+
+    def test_default_short_link(self):
+        url = 'https://website.com/finance/pay/1/zarrinpal/'
+        with self.settings(BASE_PATH='https://website.com'):
+            del settings.SHORT_LINK_BASE
+            link = make_short(url)
+        self.assertTrue(link.startswith('https://website.com/'), "Short link is not served by the website")
+        path = urlparse(link).path
+        self.assertEqual(resolve(path).func.view_class, ShortLinkRedirectView)
+        resolve_short_link.cache_clear()
+        self.assertRedirects(self.client.get(path), url, fetch_redirect_response=False)
@@ -1,7 +1,7 @@
 from django.conf.urls import url
 
 from messenger.views import MessageAttachmentListCreateAPIView, MessageListCreateAPIView, ContactListAPIView, \
-    MessageUpdateAPIView, MessageUnreadAPIView
+    MessageUpdateAPIView, MessageUnreadAPIView, ShortLinkRedirectView
 
 urlpatterns = [
     url(r'attachment/$', MessageAttachmentListCreateAPIView.as_view(), name='create_attachment'),
@@ -10,4 +10,5 @@ urlpatterns = [
     url(r'messages/(?P<contact_id>[0-9].+)/$', MessageListCreateAPIView.as_view(), name='message_room'),
     url(r'messages/read/(?P<pk>[0-9].*)/$', MessageUpdateAPIView.as_view(), name='read_messages'),
     url(r'messages/count/$', MessageUnreadAPIView.as_view(), name='messages_count'),
+    url(r'^s/(?P<code>[a-z0-9]+)/$', ShortLinkRedirectView.as_view(), name='short-link'),
 ]
@@ -1,5 +1,8 @@
 from django.contrib.auth import get_user_model
 from django.db.models import Q
+from django.http import Http404
+from django.shortcuts import redirect
+from django.views import View
 from rest_framework import status
 from rest_framework.authentication import SessionAuthentication
 from rest_framework.exceptions import PermissionDenied
@@ -10,12 +13,13 @@ from rest_framework.views import APIView
 from rest_framework_jwt.authentication import JSONWebTokenAuthentication
 
 from lib.paginations import MessagesPagination
-from messenger.models import MessageBody, MessageAttachment
+from messenger.models import MessageBody, MessageAttachment, ShortLink
 from messenger.serializers import MessageAttachmentCompleteSerializer, MessageBodyListSerializer, \
     MessageBodyCreateSerializer
 from subscription.models import Relation
 from user.models import UserProfile
 from user.serializers import ProfileLightSerializer
+from utils.links import resolve_short_link
 
 User = get_user_model()
 
@@ -103,3 +107,17 @@ class MessageUnreadAPIView(APIView):
     def get(self, request, *args, **kwargs):
         count = MessageBody.objects.filter(receiver=request.user, is_read=False).count()
         return Response({"count": count}, status=status.HTTP_200_OK)
+
+
+class ShortLinkRedirectView(View):
+    """Redirect short links to their urls, urls are cached in process"""
+
+    def get(self, request, code, *args, **kwargs):
+        pk = ShortLink.get_pk(code)
+        if pk is None:
+            raise Http404
+        try:
+            url = resolve_short_link(pk)
+        except ShortLink.DoesNotExist:
+            raise Http404
+        return redirect(url)
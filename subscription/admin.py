@@ -5,14 +5,14 @@ from import_export.admin import ExportMixin
 from import_export.fields import Field
 from django.utils import timezone
 from datetime import timedelta
-from django.db.models import Q, Case, When
+from django.db.models import Case, When
 from itertools import chain
 from django.db.models.functions import Trunc
 from django.db.models import DateTimeField, Subquery
-import pytz
 from finance.models import Payment
 from lib.common_admin import BaseAdmin
-from subscription.models import Subscription, DiscountCode, BaseTransaction, Relation
+from subscription.models import Subscription, DiscountCode, BaseTransaction, Relation, WalletBalance, WalletEntry, \
+    JobRun, JobChunk, BusinessDailyIncome, DonorCounter
 from subscription.models.transactions import SubscriptionTransaction, TargetTransaction, SubscriptionPeymanTransaction
 from utils.time import convert_to_jalali
 
@@ -76,70 +76,12 @@ class SubscriptionAdmin(admin.ModelAdmin):
         return obj.user.get_full_name()
 
 
-class WrongTransactionsFilter(SimpleListFilter):
-    title = 'Wrong repeated transactions'
-    parameter_name = 'wrong'
-
-    def lookups(self, request, model_admin):
-        return (
-            ('true', 'wrong'),
-        )
-
-    def queryset(self, request, queryset):
-        if self.value() == 'true':
-            all_transactions = queryset.filter(
-                Q(created_time__hour__lte=0,
-                    created_time__minute__lte=30,) |
-                Q(created_time__hour__gte=23,
-                    created_time__minute__gte=45)
-                )
-            transactions_list = list(all_transactions.values_list('id', flat=True))
-            for transaction in all_transactions:
-                user = transaction.transaction.user
-                local_dt = transaction.created_time.astimezone(pytz.timezone('Asia/Tehran'))
-                if local_dt.hour == 23:
-                    tomorrow_transactions = queryset.filter(
-                        created_time__year=local_dt.year,
-                        created_time__month=local_dt.month,
-                        transaction__user=user,
-                        created_time__day=local_dt.day + 1,
-                    )
-                    if tomorrow_transactions.count() <= 0:
-                        obj_index_id = transactions_list.index(transaction.id)
-                        del transactions_list[obj_index_id]
-                        all_transactions = all_transactions.filter(
-                            pk__in=transactions_list
-                        )
-                    a, b = list(all_transactions.values_list('id', flat=True)),\
-                        list(tomorrow_transactions.values_list('id', flat=True))
-                    all_transactions = queryset.filter(id__in=a + b)
-
-                if local_dt.hour == 0:
-                    tomorrow_transactions = queryset.filter(
-                        created_time__year=local_dt.year,
-                        created_time__month=local_dt.month,
-                        transaction__user=user,
-                        created_time__day=local_dt.day,
-                    )
-                    if tomorrow_transactions.count() <= 1:
-                        tomorrow_transactions_list = list(tomorrow_transactions.values_list('id', flat=True))
-                        obj_index_id_tommorow = tomorrow_transactions_list.index(transaction.id)
-                        obj_index_id = transactions_list.index(transaction.id)
-                        del transactions_list[obj_index_id]
-                        del tomorrow_transactions_list[obj_index_id_tommorow]
-                        all_transactions = all_transactions.filter(pk__in=transactions_list)
-                        tomorrow_transactions = tomorrow_transactions.filter(pk__in=tomorrow_transactions_list)
-                    a, b = list(all_transactions.values_list('id', flat=True)), \
-                        list(tomorrow_transactions.values_list('id', flat=True))
-                    all_transactions = queryset.filter(id__in=a + b)
-            return all_transactions
-
-
 class SubscriptionTransactionAdmin(ExportMixin, BaseAdmin):
     extra_list_display = [
-        'transaction', 'user', 'subscription', 'subscription_purpose', 'due_date', 'is_paid', 'paid_date', 'status'
+        'transaction', 'user', 'subscription', 'subscription_purpose', 'due_date', 'billing_period', 'is_paid',
+        'paid_date', 'status'
     ]
-    list_filter = ['status', WrongTransactionsFilter]
+    list_filter = ['status', 'billing_period']
     search_fields = ['subscription__user__username', 'subscription__user__first_name', 'subscription__user__last_name',
                      'created_time']
     date_hierarchy = 'created_time'  # DateField
@@ -287,6 +229,47 @@ class SubscriptionPeymanTransactionAdmin(admin.ModelAdmin):
     list_filter = ('status',)
 
 
+class WalletBalanceAdmin(BaseAdmin):
+    extra_list_display = ['user', 'balance', 'modified_time']
+    search_fields = ['user__username', 'user__first_name', 'user__last_name', 'user__phone_number']
+    readonly_fields = ['user', 'balance']
+
+
+class WalletEntryAdmin(BaseAdmin):
+    extra_list_display = ['user', 'transaction', 'source', 'amount']
+    list_filter = ['source']
+    search_fields = ['user__username', 'user__phone_number']
+    readonly_fields = ['user', 'transaction', 'source', 'amount']
+
+
+class JobChunkInlineAdmin(admin.TabularInline):
+    model = JobChunk
+    extra = 0
+    fields = ['first_pk', 'last_pk', 'size', 'duration', 'throughput', 'created_time']
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+
+class JobRunAdmin(BaseAdmin):
+    extra_list_display = ['name', 'run_key', 'status', 'checkpoint', 'processed', 'duration']
+    list_filter = ['name', 'status']
+    inlines = [JobChunkInlineAdmin]
+
+
+class BusinessDailyIncomeAdmin(BaseAdmin):
+    extra_list_display = ['business', 'date', 'kind', 'purpose', 'tier', 'amount', 'count']
+    list_filter = ['kind', 'jalali_year', 'jalali_month']
+    date_hierarchy = 'date'
+
+
+class DonorCounterAdmin(BaseAdmin):
+    extra_list_display = ['user', 'paid_count', 'first_transaction']
+    search_fields = ['user__username', 'user__phone_number']
+    raw_id_fields = ['user', 'first_transaction']
+
+
 admin.site.register(Subscription, SubscriptionAdmin)
 admin.site.register(DiscountCode, DiscountCodeAdmin)
 admin.site.register(BaseTransaction, TransactionAdmin)
@@ -294,3 +277,8 @@ admin.site.register(SubscriptionTransaction, SubscriptionTransactionAdmin)
 admin.site.register(TargetTransaction, TargetTransactionAdmin)
 admin.site.register(Relation, RelationAdmin)
 admin.site.register(SubscriptionPeymanTransaction, SubscriptionPeymanTransactionAdmin)
+admin.site.register(WalletBalance, WalletBalanceAdmin)
+admin.site.register(WalletEntry, WalletEntryAdmin)
+admin.site.register(JobRun, JobRunAdmin)
+admin.site.register(BusinessDailyIncome, BusinessDailyIncomeAdmin)
+admin.site.register(DonorCounter, DonorCounterAdmin)
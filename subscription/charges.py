@@ -0,0 +1,212 @@
+import logging
+from datetime import timedelta
+
+from django.db import transaction, IntegrityError
+from django.db.models import Exists, OuterRef, Subquery, IntegerField
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from finance.gateways import gateway_registry
+from finance.models import Payment
+from subscription.jobs import run_chunked
+from subscription.models import Subscription, BaseTransaction, WalletBalance, WalletEntry, BusinessDailyIncome, \
+    DonorCounter
+from subscription.models.transactions import SubscriptionTransaction
+from subscription.notifications import SubscriptionNotificationBuilder
+from subscription.reports import invalidate_business_reports
+from utils.time import get_related_jalali_day_of_month, get_jalali_billing_period
+
+logger = logging.getLogger(__file__)
+
+
+class SubscriptionChargeEngine:
+    """
+    Set-based daily charge of bank approach subscriptions, due subscriptions
+    are selected with their "already charged in this billing period" flag and
+    wallet balance, then transactions and payments of each chunk are created
+    with bulk_create inside one database transaction. Only notifications are
+    fanned out.
+    """
+    chunk_size = 500
+
+    def __init__(self, date=None, dry_run=False, chunk_size=None, notify=None):
+        """
+        :param date: charge date, datetime instance or iso formatted string
+        :param dry_run: only report counts and totals without any write
+        :param chunk_size: number of subscriptions which are charged together
+        :param notify: callable(payloads) to send payloads of a chunk which are
+        built by SubscriptionNotificationBuilder
+        """
+        if date is None:
+            date = timezone.now()
+        elif isinstance(date, str):
+            date = parse_datetime(date)
+        self.date = date
+        self.billing_period = get_jalali_billing_period(date)
+        self.dry_run = dry_run
+        self.chunk_size = chunk_size or self.chunk_size
+        self.notify = notify
+        self.report = dict(
+            subscriptions=0, already_charged=0, paid=0, owed=0, paid_amount=0, owed_amount=0,
+        )
+
+    def get_day_range(self):
+        start = timezone.localtime(self.date).replace(hour=0, minute=0, second=0, microsecond=0)
+        return start, start + timedelta(days=1)
+
+    def get_queryset(self):
+        jalali_days, jalali_month = get_related_jalali_day_of_month(self.date)
+        charged = SubscriptionTransaction.objects.filter(
+            subscription=OuterRef('pk'), billing_period=self.billing_period
+        )
+        wallet = WalletBalance.objects.filter(user=OuterRef('user')).values('balance')[:1]
+        return Subscription.objects.filter(
+            is_enable=True, jalali_due_day_of_month__in=jalali_days, sub_type=Subscription.BANK_APPROACH
+        ).annotate(
+            already_charged=Exists(charged),
+            wallet=Subquery(wallet, output_field=IntegerField()),
+        ).select_related('tier').order_by('pk')
+
+    def get_gateway_code(self):
+        if not hasattr(self, '_gateway_code'):
+            gateway = gateway_registry.default()
+            self._gateway_code = gateway.code if gateway is not None else None
+        return self._gateway_code
+
+    def iterate_chunks(self, queryset):
+        last_pk = 0
+        while True:
+            chunk = list(queryset.filter(pk__gt=last_pk)[:self.chunk_size])
+            if not chunk:
+                return
+            last_pk = chunk[-1].pk
+            yield chunk
+
+    def split(self, subscriptions, wallets):
+        """Decide paid or owed status of each subscription according to the
+        remaining wallet of its user, wallets dict is changed in place"""
+        paid, owed = list(), list()
+        for subscription in subscriptions:
+            if wallets[subscription.user_id] >= subscription.tier.amount:
+                wallets[subscription.user_id] -= subscription.tier.amount
+                paid.append(subscription)
+            else:
+                owed.append(subscription)
+        return paid, owed
+
+    def charge_chunk(self, subscriptions):
+        """Create BaseTransaction, SubscriptionTransaction and Payment rows of
+        given subscriptions and return notifications which should be sent.
+        Subscriptions which are charged for the billing period by another
+        worker in the meantime are skipped"""
+        try:
+            return self.insert_chunk(subscriptions)
+        except IntegrityError:
+            charged = set(SubscriptionTransaction.objects.filter(
+                subscription__in=subscriptions, billing_period=self.billing_period
+            ).values_list('subscription_id', flat=True))
+            logger.warning('{} subscriptions are already charged for {}'.format(len(charged), self.billing_period))
+            self.report['already_charged'] += len(charged)
+            return self.insert_chunk([subscription for subscription in subscriptions if subscription.pk not in charged])
+
+    def insert_chunk(self, subscriptions):
+        now = timezone.now()
+        with transaction.atomic():
+            user_ids = {subscription.user_id for subscription in subscriptions}
+            wallets = dict.fromkeys(user_ids, 0)
+            wallets.update(WalletBalance.lock(user_ids))
+            paid, owed = self.split(subscriptions, wallets)
+
+            base_transactions = BaseTransaction.objects.bulk_create([
+                BaseTransaction(
+                    user_id=subscription.user_id, amount=subscription.tier.amount,
+                    transaction_type=BaseTransaction.SUBSCRIPTION
+                ) for subscription in paid + owed
+            ])
+            subscription_transactions = SubscriptionTransaction.objects.bulk_create([
+                SubscriptionTransaction(
+                    transaction=base_transaction, subscription=subscription,
+                    subscription_purpose_id=subscription.subscription_purpose_id, due_date=self.date,
+                    billing_period=self.billing_period,
+                    status=SubscriptionTransaction.PAID if is_paid else SubscriptionTransaction.OWED,
+                    is_paid=is_paid, paid_date=now if is_paid else None,
+                ) for subscription, base_transaction, is_paid in zip(
+                    paid + owed, base_transactions, [True] * len(paid) + [False] * len(owed)
+                )
+            ])
+            payments = Payment.objects.bulk_create([
+                Payment(amount=base_transaction.amount, user_id=base_transaction.user_id, transaction=base_transaction)
+                for base_transaction in base_transactions[len(paid):]
+            ])
+            WalletEntry.post_bulk([
+                WalletEntry(
+                    user_id=base_transaction.user_id, transaction=base_transaction,
+                    source=WalletEntry.SUBSCRIPTION_TRANSACTION, amount=-base_transaction.amount
+                ) for base_transaction in base_transactions[:len(paid)]
+            ])
+            BusinessDailyIncome.add(
+                BusinessDailyIncome.row(
+                    subscription.business_id, now, BusinessDailyIncome.SUBSCRIPTION, subscription.tier.amount,
+                    subscription.subscription_purpose_id, subscription.tier_id
+                ) for subscription in paid
+            )
+            DonorCounter.add(
+                (subscription.user_id, subscription_transaction.pk, 1)
+                for subscription, subscription_transaction in zip(paid, subscription_transactions)
+            )
+            owed_business_ids = [subscription.business_id for subscription in owed]
+            transaction.on_commit(lambda: invalidate_business_reports(owed_business_ids))
+
+        self.update_report(paid, owed)
+        gateway_code = self.get_gateway_code()
+        notifications = [(subscription.id, 'greeting', None) for subscription in paid]
+        notifications.extend(
+            (subscription.id, 'due_date_notify', payment.get_instant_link(gateway_code))
+            for subscription, payment in zip(owed, payments)
+        )
+        return notifications
+
+    def update_report(self, paid, owed):
+        self.report['paid'] += len(paid)
+        self.report['owed'] += len(owed)
+        self.report['paid_amount'] += sum(subscription.tier.amount for subscription in paid)
+        self.report['owed_amount'] += sum(subscription.tier.amount for subscription in owed)
+
+    def send_notifications(self, notifications):
+        if self.notify is None:
+            return
+        payloads = SubscriptionNotificationBuilder().build(notifications)
+        if payloads:
+            self.notify(payloads)
+
+    def process_chunk(self, subscriptions):
+        """Charge one chunk and send its notifications after commit"""
+        self.report['subscriptions'] += len(subscriptions)
+        notifications = self.charge_chunk(subscriptions)
+        transaction.on_commit(lambda: self.send_notifications(notifications))
+
+    def run(self):
+        """
+        Charge all due subscriptions of the date chunk by chunk, charges are
+        checkpointed as "subscription_charges" JobRun of the date and a
+        restarted run resumes after the last committed chunk
+        :return: report dict of counts and totals
+        """
+        queryset = self.get_queryset()
+        self.report['already_charged'] = queryset.filter(already_charged=True).count()
+        queryset = queryset.filter(already_charged=False)
+        if self.dry_run:
+            wallets = dict()
+            for chunk in self.iterate_chunks(queryset):
+                self.report['subscriptions'] += len(chunk)
+                for subscription in chunk:
+                    if subscription.user_id not in wallets:
+                        # wallets which are not opened yet are calculated from history
+                        wallets[subscription.user_id] = subscription.wallet if subscription.wallet is not None else \
+                            WalletBalance.balance_of(subscription.user_id)
+                self.update_report(*self.split(chunk, wallets))
+        else:
+            run_key = self.get_day_range()[0].date().isoformat()
+            run_chunked('subscription_charges', run_key, queryset, self.process_chunk, self.chunk_size)
+        logger.warning('subscription charges of {}: {}'.format(self.date, self.report))
+        return self.report
@@ -2,7 +2,7 @@ import django_filters
 
 from django.db.models import Q
 
-from subscription.models import Relation
+from subscription.models import Relation, Subscription
 from subscription.models.transactions import SubscriptionTransaction, TargetTransaction, SubscriptionPeymanTransaction,\
     BaseTransaction
 
@@ -80,3 +80,23 @@ class RelationFilter(django_filters.FilterSet):
     class Meta:
         model = Relation
         fields = ['start_time', 'end_time']
+
+
+class SubscriberFilter(django_filters.FilterSet):
+    """Filters of subscribers table, computed fields are annotated by
+    SubscriberList.setup_queryset"""
+    start_time = django_filters.DateFilter(field_name="created_time", lookup_expr='gte')
+    end_time = django_filters.DateFilter(field_name="created_time", lookup_expr='lte')
+    min_total_paid = django_filters.NumberFilter(field_name="total_paid_amount", lookup_expr='gte')
+    max_total_paid = django_filters.NumberFilter(field_name="total_paid_amount", lookup_expr='lte')
+    last_paid_start = django_filters.DateFilter(field_name="last_paid_date", lookup_expr='gte')
+    last_paid_end = django_filters.DateFilter(field_name="last_paid_date", lookup_expr='lte')
+    is_active = django_filters.BooleanFilter(field_name="oldest_owed_time", method='is_active_filter')
+
+    class Meta:
+        model = Subscription
+        fields = ['tier', 'subscription_purpose']
+
+    def is_active_filter(self, queryset, name, value):
+        active = Q(oldest_owed_time=None) | Q(oldest_owed_time__gt=Subscription.active_owed_from())
+        return queryset.filter(active) if value else queryset.exclude(active)
@@ -0,0 +1,62 @@
+import logging
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from subscription.models import JobRun, JobChunk
+
+logger = logging.getLogger(__file__)
+
+
+def run_chunked(name, run_key, queryset, handler, chunk_size=500):
+    """
+    Process queryset in primary key ordered chunks, each chunk is committed
+    together with the run checkpoint. The run row is locked during each chunk,
+    so a restarted or concurrent worker continues after the last committed
+    chunk instead of doing it again.
+    :param name: job name, e.g. task name
+    :param run_key: identity of this run, e.g. iso formatted date
+    :param queryset: rows to be processed, will be ordered by pk
+    :param handler: callable which receives list of rows of one chunk, side
+    effects like celery tasks should be sent with transaction.on_commit
+    :param chunk_size: number of rows in each chunk
+    :return: JobRun instance
+    """
+    run, created = JobRun.objects.get_or_create(name=name, run_key=run_key)
+    if run.status == JobRun.DONE:
+        logger.info('{} is already done'.format(run))
+        return run
+    if not created:
+        logger.warning('{} resumes from checkpoint {}'.format(run, run.checkpoint))
+
+    queryset = queryset.order_by('pk')
+    try:
+        while True:
+            started = time.time()
+            with transaction.atomic():
+                run = JobRun.objects.select_for_update().get(pk=run.pk)
+                chunk = list(queryset.filter(pk__gt=run.checkpoint)[:chunk_size])
+                if not chunk:
+                    break
+                handler(chunk)
+                duration = time.time() - started
+                JobChunk.objects.create(
+                    run=run, first_pk=chunk[0].pk, last_pk=chunk[-1].pk, size=len(chunk), duration=duration
+                )
+                run.checkpoint = chunk[-1].pk
+                run.processed += len(chunk)
+                run.status = JobRun.RUNNING
+                run.save(update_fields=['checkpoint', 'processed', 'status', 'modified_time'])
+            logger.info('{} chunk {}-{}: {} rows in {:.3f}s ({:.1f} rows/s)'.format(
+                name, chunk[0].pk, chunk[-1].pk, len(chunk), duration, len(chunk) / duration if duration else 0
+            ))
+    except Exception:
+        JobRun.objects.filter(pk=run.pk).update(status=JobRun.FAILED, modified_time=timezone.now())
+        raise
+
+    run.status = JobRun.DONE
+    run.finished_time = timezone.now()
+    run.save(update_fields=['status', 'finished_time', 'modified_time'])
+    logger.info('{} processed {} rows in {}s'.format(run, run.processed, run.duration))
+    return run
@@ -0,0 +1,65 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from subscription.models.transactions import SubscriptionTransaction, SubscriptionPeymanTransaction
+from utils.time import get_jalali_billing_period
+
+
+class Command(BaseCommand):
+    help = "Set billing_period of subscription transactions which are created before it from their due date, " \
+           "the first transaction of each subscription and period takes it and duplicates are left empty"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=1000)
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run', default=False)
+
+    @staticmethod
+    def get_periods(model, queryset):
+        """
+        :param model: SubscriptionTransaction or SubscriptionPeymanTransaction
+        :param queryset: transactions which charge their period, periods of
+        all rows are taken because the unique index includes deleted ones
+        :return: (dict of period and transaction ids, number of duplicates)
+        """
+        taken = set(model.private_manager.filter(billing_period__isnull=False).values_list(
+            'subscription_id', 'billing_period'
+        ))
+        periods, duplicates = defaultdict(list), 0
+        for pk, subscription_id, due_date, created_time in queryset.filter(billing_period__isnull=True).values_list(
+                'pk', 'subscription_id', 'due_date', 'created_time').order_by('pk').iterator():
+            period = get_jalali_billing_period(due_date or created_time)
+            if (subscription_id, period) in taken:
+                duplicates += 1
+                continue
+            taken.add((subscription_id, period))
+            periods[period].append(pk)
+        return periods, duplicates
+
+    def backfill(self, model, queryset, batch_size, dry_run):
+        periods, duplicates = self.get_periods(model, queryset)
+        updated = 0
+        with transaction.atomic():
+            for period, ids in periods.items():
+                for index in range(0, len(ids), batch_size):
+                    chunk = ids[index:index + batch_size]
+                    if not dry_run:
+                        model.private_manager.filter(pk__in=chunk).update(billing_period=period)
+                    updated += len(chunk)
+        print('{}:'.format(model.__name__))
+        print("Updated transactions:\t", updated)
+        print("Duplicate transactions:\t", duplicates)
+
+    def handle(self, *args, **options):
+        print('-' * 80)
+        # deleted transactions and failed direct debit attempts do not charge their month
+        self.backfill(
+            SubscriptionTransaction, SubscriptionTransaction.objects.all(), options['batch_size'],
+            options['dry_run']
+        )
+        self.backfill(
+            SubscriptionPeymanTransaction, SubscriptionPeymanTransaction.objects.filter(is_paid=True),
+            options['batch_size'], options['dry_run']
+        )
+        print('-' * 80)
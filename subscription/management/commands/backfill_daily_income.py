@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from subscription.models import BusinessDailyIncome
+from subscription.reports import daily_incomes
+
+
+class Command(BaseCommand):
+    help = "Rebuild BusinessDailyIncome rollup from paid transactions history, run it when periodic charges " \
+           "are not running"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=1000)
+
+    def handle(self, *args, **options):
+        print('-' * 80)
+        incomes = list(daily_incomes())
+        with transaction.atomic():
+            deleted, deleted_per_model = BusinessDailyIncome.private_manager.all().delete()
+            BusinessDailyIncome.objects.bulk_create(incomes, batch_size=options['batch_size'])
+        print("Removed rollup rows:\t", deleted)
+        print("Created rollup rows:\t", len(incomes))
+        print("Total income:\t\t", sum(income.amount for income in incomes))
+        print('-' * 80)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Min
+
+from subscription.models import DonorCounter
+from subscription.models.transactions import SubscriptionTransaction
+
+
+class Command(BaseCommand):
+    help = "Rebuild DonorCounter of all users from paid subscription transactions history"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=1000)
+
+    def handle(self, *args, **options):
+        print('-' * 80)
+        counters = [
+            DonorCounter(user_id=user_id, paid_count=paid_count, first_transaction_id=first_transaction_id)
+            for user_id, paid_count, first_transaction_id in SubscriptionTransaction.objects.filter(
+                is_paid=True
+            ).values_list('transaction__user').annotate(Count('id'), Min('id')).order_by().iterator()
+        ]
+        with transaction.atomic():
+            deleted, deleted_per_model = DonorCounter.private_manager.all().delete()
+            DonorCounter.objects.bulk_create(counters, batch_size=options['batch_size'])
+        print("Removed counters:\t", deleted)
+        print("Created counters:\t", len(counters))
+        print("First donors:\t\t", sum(counter.is_first_donate for counter in counters))
+        print('-' * 80)
@@ -0,0 +1,127 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Sum, Count
+from django.db.models.functions import Coalesce
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from business.models import Business, Target, Tier
+from subscription.models import BaseTransaction, Subscription, BusinessDailyIncome
+from subscription.models.transactions import SubscriptionTransaction, SubscriptionPeymanTransaction, \
+    TargetTransaction
+from subscription.reports import business_transactions_report, daily_incomes
+from user.models import User
+from utils.time import get_start_day_of_month
+
+
+def legacy_business_transactions_report(business):
+    """Business transactions report as it was calculated before the rollup,
+    only kept to compare with business_transactions_report"""
+    start_day_of_month = get_start_day_of_month(timezone.now())
+    all_transactions = SubscriptionTransaction.objects.filter(subscription__business=business)
+    all_direct_debit_transactions = SubscriptionPeymanTransaction.objects.filter(subscription__business=business)
+    transactions = all_transactions.filter(paid_date__gte=start_day_of_month)
+    direct_debit_transactions = all_direct_debit_transactions.filter(paid_date__gte=start_day_of_month)
+    subscriptions = Subscription.objects.filter(business=business, is_enable=True)
+    targets = Target.objects.filter(business=business)
+    target_transaction = TargetTransaction.objects.filter(target__business=business, is_paid=True)
+    data = {
+        'total_income': all_transactions.filter(status=10).aggregate(
+            t=Coalesce(Sum('transaction__amount'), 0))['t'] + all_direct_debit_transactions.filter(
+            status=10).aggregate(t=Coalesce(Sum('transaction__amount'), 0))['t'],
+        'month_income': transactions.filter(status=10).aggregate(t=Coalesce(Sum('transaction__amount'), 0))['t'] +
+        direct_debit_transactions.filter(status=10).aggregate(t=Coalesce(Sum('transaction__amount'), 0))['t'],
+        'total_owed': all_transactions.filter(status=5).aggregate(t=Coalesce(Sum('transaction__amount'), 0))['t'],
+        'paid_ratio': 0,
+        'projects_count': targets.count(),
+        'projects_income_count': target_transaction.count(),
+        'total_project_income': target_transaction.aggregate(t=Coalesce(Sum('transaction__amount'), 0))['t'],
+        'projet_paid_ratio': 0,
+    }
+    if subscriptions.count():
+        data['paid_ratio'] = subscriptions.values('user').aggregate(
+            t=Coalesce(Sum('tier__amount'), 0) / Coalesce(Count('user', distinct=True), 1))['t']
+    if targets.count():
+        data['projet_paid_ratio'] = target_transaction.aggregate(
+            t=Coalesce(Sum('transaction__amount'), 0) / Coalesce(Count('id'), 1))['t']
+    return data
+
+
+class Command(BaseCommand):
+    help = "Compare query count and latency of legacy and rollup based business transactions report on a " \
+           "synthetic business, all synthetic rows are rolled back at the end"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transactions', type=int, dest='transactions', default=100000)
+        parser.add_argument('--subscribers', type=int, dest='subscribers', default=1000)
+        parser.add_argument('--repeat', type=int, dest='repeat', default=5)
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=5000)
+
+    def create_business(self, options):
+        """Clone an existing business for a new owner and give it subscribers
+        with paid and owed transactions spread over the last year"""
+        now = timezone.now()
+        batch_size = options['batch_size']
+        users = User.objects.bulk_create([
+            User(username='benchmark{}'.format(i), phone_number=979900000000 + i, date_joined=now)
+            for i in range(options['subscribers'] + 1)
+        ], batch_size=batch_size)
+        business = Business.objects.first()
+        business.pk = None
+        business.user = users[0]
+        business.url_path = 'benchmark-{}'.format(int(now.timestamp()))
+        business.save()
+        tier = Tier.objects.first()
+
+        subscriptions = Subscription.objects.bulk_create([
+            Subscription(user=user, business=business, tier=tier, jalali_due_day_of_month=1, is_enable=True)
+            for user in users[1:]
+        ], batch_size=batch_size)
+        base_transactions = BaseTransaction.objects.bulk_create([
+            BaseTransaction(
+                user_id=subscriptions[i % len(subscriptions)].user_id, amount=tier.amount,
+                transaction_type=BaseTransaction.SUBSCRIPTION
+            ) for i in range(options['transactions'])
+        ], batch_size=batch_size)
+        SubscriptionTransaction.objects.bulk_create([
+            SubscriptionTransaction(
+                transaction=base_transaction, subscription=subscriptions[i % len(subscriptions)],
+                due_date=now - timedelta(days=i % 365), is_paid=bool(i % 10),
+                status=SubscriptionTransaction.PAID if i % 10 else SubscriptionTransaction.OWED,
+                paid_date=now - timedelta(days=i % 365) if i % 10 else None,
+            ) for i, base_transaction in enumerate(base_transactions)
+        ], batch_size=batch_size)
+        BusinessDailyIncome.objects.bulk_create(daily_incomes([business.pk]), batch_size=batch_size)
+        return business
+
+    def measure(self, report, business, repeat):
+        durations = list()
+        for i in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                data = report(business)
+                durations.append(time.perf_counter() - started)
+        return data, len(queries), min(durations), sum(durations) / len(durations)
+
+    def handle(self, *args, **options):
+        print('-' * 80)
+        with transaction.atomic():
+            business = self.create_business(options)
+            print("Synthetic business:\t", business.pk, "transactions:", options['transactions'])
+            results = (
+                ('legacy', self.measure(legacy_business_transactions_report, business, options['repeat'])),
+                ('rollup', self.measure(business_transactions_report, business, options['repeat'])),
+            )
+            for name, (data, queries, best, average) in results:
+                print("{}:\tqueries: {}\tbest: {:.2f}ms\taverage: {:.2f}ms".format(
+                    name, queries, best * 1000, average * 1000
+                ))
+            legacy, rollup = results[0][1][0], results[1][1][0]
+            for key, value in legacy.items():
+                if rollup.get(key) != value:
+                    print("mismatch {}:\tlegacy: {}\trollup: {}".format(key, value, rollup.get(key)))
+            transaction.set_rollback(True)
+        print('-' * 80)
@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from subscription.charges import SubscriptionChargeEngine
+from subscription.tasks import send_notification_payloads
+
+
+class Command(BaseCommand):
+    help = "Charge due subscriptions of today or given days ago, use --dry-run to only see the report"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days-ago', type=int, dest='days_ago', default=0)
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run', default=False)
+
+    def handle(self, *args, **options):
+        print('-' * 80)
+        date = timezone.now() - timedelta(days=options['days_ago'])
+        engine = SubscriptionChargeEngine(
+            date, dry_run=options['dry_run'], notify=send_notification_payloads.delay
+        )
+        for key, value in engine.run().items():
+            print("{}:\t{}".format(key, value))
+        print('-' * 80)
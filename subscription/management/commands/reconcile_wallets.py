@@ -0,0 +1,64 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from subscription.models import WalletBalance, WalletEntry
+
+
+class Command(BaseCommand):
+    help = "Rebuild wallet ledger and balances from transactions history and report drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix', action='store_true', dest='fix', default=False,
+            help="Append missing ledger entries and correct drifted balances",
+        )
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=1000)
+
+    def handle(self, *args, **options):
+        print('-' * 80)
+        expected = WalletEntry.expected_entries()
+        posted = WalletEntry.posted_entries()
+
+        missing_entries = list()
+        for key in set(expected) | set(posted):
+            user_id, amount = expected.get(key) or (posted[key][0], 0)
+            delta = amount - posted.get(key, (user_id, 0))[1]
+            if delta != 0:
+                missing_entries.append(
+                    WalletEntry(user_id=user_id, transaction_id=key[0], source=key[1], amount=delta)
+                )
+        print("Paid wallet sources:\t", len(expected))
+        print("Ledger sources:\t\t", len(posted))
+        print("Drifted sources:\t", len(missing_entries))
+
+        balances = defaultdict(int)
+        for user_id, amount in expected.values():
+            balances[user_id] += amount
+        stored = dict(WalletBalance.objects.values_list('user_id', 'balance'))
+
+        drifted = [
+            (user_id, stored.get(user_id, 0), balance) for user_id, balance in balances.items()
+            if stored.get(user_id, 0) != balance
+        ]
+        drifted.extend((user_id, balance, 0) for user_id, balance in stored.items()
+                       if user_id not in balances and balance != 0)
+        for user_id, balance, expected_balance in drifted:
+            print("user: {}\tbalance: {}\texpected: {}\tdrift: {}".format(
+                user_id, balance, expected_balance, balance - expected_balance
+            ))
+        print("Drifted balances:\t", len(drifted))
+
+        if options['fix'] and (missing_entries or drifted):
+            with transaction.atomic():
+                WalletEntry.objects.bulk_create(missing_entries, batch_size=options['batch_size'])
+                for user_id, balance, expected_balance in drifted:
+                    wallet, created = WalletBalance.objects.select_for_update().get_or_create(user_id=user_id)
+                    wallet.balance = WalletEntry.objects.filter(user_id=user_id).aggregate(
+                        total=Sum('amount')
+                    )['total'] or 0
+                    wallet.save(update_fields=['balance', 'modified_time'])
+            print("Ledger and balances are rebuilt")
+        print('-' * 80)
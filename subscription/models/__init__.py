@@ -2,5 +2,10 @@ from subscription.models.transactions import BaseTransaction
 from subscription.models.subscription import Subscription
 from subscription.models.relation import Relation
 from subscription.models.discount import DiscountCode
+from subscription.models.wallet import WalletBalance, WalletEntry
+from subscription.models.jobs import JobRun, JobChunk
+from subscription.models.income import BusinessDailyIncome
+from subscription.models.donor import DonorCounter
 
-__all__ = ['BaseTransaction', 'Subscription', 'Relation', 'DiscountCode']
+__all__ = ['BaseTransaction', 'Subscription', 'Relation', 'DiscountCode', 'WalletBalance', 'WalletEntry', 'JobRun',
+           'JobChunk', 'BusinessDailyIncome', 'DonorCounter']
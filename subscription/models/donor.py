@@ -0,0 +1,68 @@
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import models, transaction as db_transaction
+from django.db.models import F, Subquery
+from django.utils.translation import ugettext_lazy as _
+
+from lib.common_model import BaseModel
+from .transactions import SubscriptionTransaction
+
+User = get_user_model()
+
+
+class DonorCounter(BaseModel):
+    """Paid subscription transactions count and the first paid transaction
+    of each donor, it is changed in the same database transaction which pays
+    or reverts subscription transactions of the user"""
+    user = models.OneToOneField(User, related_name='donor_counter', verbose_name=_("user"))
+    first_transaction = models.ForeignKey(
+        SubscriptionTransaction, related_name='+', verbose_name=_("first transaction"), null=True, blank=True
+    )
+    paid_count = models.IntegerField(verbose_name=_("paid count"), default=0)
+
+    class Meta:
+        verbose_name = _("DonorCounter")
+        verbose_name_plural = _("DonorCounters")
+
+    def __str__(self):
+        return '{}: {}'.format(self.user_id, self.paid_count)
+
+    @property
+    def is_first_donate(self):
+        return self.paid_count == 1
+
+    @classmethod
+    def paid_count_of(cls, user):
+        """Return paid subscription transactions count of given user with one
+        indexed row lookup"""
+        return cls.objects.filter(user=user).values_list('paid_count', flat=True).first() or 0
+
+    @classmethod
+    def add(cls, transactions):
+        """
+        Count paid and reverted subscription transactions of the users, should
+        be called inside the database transaction which changed them
+        :param transactions: iterable of (user_id, transaction_id, sign) which
+        sign is 1 for paid and -1 for reverted subscription transactions
+        """
+        changes = defaultdict(list)
+        for user_id, transaction_id, sign in transactions:
+            changes[user_id].append((transaction_id, sign))
+        with db_transaction.atomic():
+            for user_id, items in changes.items():
+                counter, created = cls.objects.select_for_update().get_or_create(user_id=user_id)
+                paid_ids = [transaction_id for transaction_id, sign in items if sign > 0]
+                reverted_ids = [transaction_id for transaction_id, sign in items if sign < 0]
+                counter_rows = cls.objects.filter(pk=counter.pk)
+                counter_rows.update(paid_count=F('paid_count') + sum(sign for transaction_id, sign in items))
+                if reverted_ids:
+                    # same as backfill_donor_counters, the first is the paid transaction with the lowest id
+                    first_transaction = SubscriptionTransaction.objects.filter(
+                        transaction__user_id=user_id, is_paid=True
+                    ).order_by('id').values('id')[:1]
+                    counter_rows.update(first_transaction=Subquery(first_transaction))
+                elif paid_ids and (counter.first_transaction_id is None or
+                                   min(paid_ids) < counter.first_transaction_id):
+                    # older owed transactions may be paid after newer ones
+                    counter_rows.update(first_transaction_id=min(paid_ids))
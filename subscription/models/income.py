@@ -0,0 +1,97 @@
+from collections import defaultdict
+
+from django.db import models, transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+from khayyam import JalaliDate
+
+from business.models import Business, Tier, SubscriptionPurpose
+from lib.common_model import BaseModel
+from .transactions import SubscriptionTransaction, TargetTransaction
+
+
+class BusinessDailyIncome(BaseModel):
+    """Rollup of paid transactions of each business per local day, kind,
+    purpose and tier. Rows are changed incrementally when a transaction is
+    paid or reverted, so readers should always Sum them"""
+    SUBSCRIPTION = 5
+    DIRECT_DEBIT = 10
+    TARGET = 15
+    KIND_CHOICES = (
+        (SUBSCRIPTION, _("Subscription")),
+        (DIRECT_DEBIT, _("Direct debit")),
+        (TARGET, _("Target")),
+    )
+    SUBSCRIPTION_KINDS = (SUBSCRIPTION, DIRECT_DEBIT)
+
+    business = models.ForeignKey(Business, related_name='daily_incomes', verbose_name=_("business"))
+    date = models.DateField(verbose_name=_("date"))
+    jalali_year = models.PositiveSmallIntegerField(verbose_name=_("jalali year"))
+    jalali_month = models.PositiveSmallIntegerField(verbose_name=_("jalali month"))
+    jalali_day = models.PositiveSmallIntegerField(verbose_name=_("jalali day"))
+    kind = models.PositiveSmallIntegerField(verbose_name=_("kind"), choices=KIND_CHOICES)
+    purpose = models.ForeignKey(
+        SubscriptionPurpose, related_name='daily_incomes', verbose_name=_("purpose"), null=True, blank=True
+    )
+    tier = models.ForeignKey(Tier, related_name='daily_incomes', verbose_name=_("tier"), null=True, blank=True)
+    amount = models.BigIntegerField(verbose_name=_("amount"), default=0)
+    count = models.IntegerField(verbose_name=_("count"), default=0)
+
+    class Meta:
+        verbose_name = _("BusinessDailyIncome")
+        verbose_name_plural = _("BusinessDailyIncomes")
+        index_together = (('business', 'date', 'kind'), ('business', 'jalali_year', 'jalali_month'))
+
+    def __str__(self):
+        return '{}({}, {}): {}'.format(self.business_id, self.date, self.get_kind_display(), self.amount)
+
+    @staticmethod
+    def row(business_id, paid_date, kind, amount, purpose_id=None, tier_id=None, count=1):
+        """Build rollup key and values of one paid transaction, pass negative
+        amount and count to revert it"""
+        date = timezone.localtime(paid_date or timezone.now()).date()
+        return (business_id, date, kind, purpose_id, tier_id), amount, count
+
+    @classmethod
+    def row_of(cls, instance, sign=1):
+        """Rollup row of a SubscriptionTransaction, SubscriptionPeymanTransaction
+        or TargetTransaction instance"""
+        amount = sign * instance.transaction.amount
+        if isinstance(instance, TargetTransaction):
+            return cls.row(
+                instance.target.business_id, instance.modified_time, cls.TARGET, amount, count=sign
+            )
+        kind = cls.SUBSCRIPTION if isinstance(instance, SubscriptionTransaction) else cls.DIRECT_DEBIT
+        return cls.row(
+            instance.subscription.business_id, instance.paid_date, kind, amount,
+            instance.subscription_purpose_id, instance.subscription.tier_id, count=sign
+        )
+
+    @classmethod
+    def add(cls, rows):
+        """
+        Apply rows of paid or reverted transactions on the rollup, should be
+        called inside the database transaction which changed them. Cached
+        reports of the businesses are invalidated after commit
+        :param rows: iterable of cls.row results
+        """
+        from subscription.reports import invalidate_business_reports
+        totals = defaultdict(lambda: [0, 0])
+        for key, amount, count in rows:
+            totals[key][0] += amount
+            totals[key][1] += count
+        with db_transaction.atomic():
+            for (business_id, date, kind, purpose_id, tier_id), (amount, count) in totals.items():
+                updated = cls.objects.filter(
+                    business_id=business_id, date=date, kind=kind, purpose_id=purpose_id, tier_id=tier_id
+                ).update(amount=F('amount') + amount, count=F('count') + count, modified_time=timezone.now())
+                if not updated:
+                    jalali_date = JalaliDate(date)
+                    cls.objects.create(
+                        business_id=business_id, date=date, kind=kind, purpose_id=purpose_id, tier_id=tier_id,
+                        jalali_year=jalali_date.year, jalali_month=jalali_date.month, jalali_day=jalali_date.day,
+                        amount=amount, count=count,
+                    )
+            business_ids = [key[0] for key in totals]
+            db_transaction.on_commit(lambda: invalidate_business_reports(business_ids))
@@ -0,0 +1,58 @@
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+from lib.common_model import BaseModel
+
+
+class JobRun(BaseModel):
+    """Persisted state of each run of chunked periodic tasks, checkpoint is
+    the last processed primary key so a restarted run resumes from there"""
+    RUNNING = 5
+    DONE = 10
+    FAILED = 15
+    STATUS_CHOICES = (
+        (RUNNING, _("Running")),
+        (DONE, _("Done")),
+        (FAILED, _("Failed")),
+    )
+    name = models.CharField(max_length=100, verbose_name=_("name"))
+    run_key = models.CharField(max_length=50, verbose_name=_("run key"))
+    status = models.PositiveSmallIntegerField(verbose_name=_("status"), choices=STATUS_CHOICES, default=RUNNING)
+    checkpoint = models.BigIntegerField(verbose_name=_("checkpoint"), default=0)
+    processed = models.PositiveIntegerField(verbose_name=_("processed"), default=0)
+    finished_time = models.DateTimeField(verbose_name=_("finished time"), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("JobRun")
+        verbose_name_plural = _("JobRuns")
+        unique_together = (('name', 'run_key'),)
+
+    def __str__(self):
+        return '{}({}): {}'.format(self.name, self.run_key, self.get_status_display())
+
+    @property
+    def duration(self):
+        if self.finished_time is None:
+            return None
+        return (self.finished_time - self.created_time).total_seconds()
+
+
+class JobChunk(BaseModel):
+    """Timing of each committed chunk of a JobRun"""
+    run = models.ForeignKey(JobRun, related_name='chunks', verbose_name=_("run"))
+    first_pk = models.BigIntegerField(verbose_name=_("first pk"))
+    last_pk = models.BigIntegerField(verbose_name=_("last pk"))
+    size = models.PositiveIntegerField(verbose_name=_("size"))
+    duration = models.FloatField(verbose_name=_("duration"), help_text=_("seconds"))
+
+    class Meta:
+        verbose_name = _("JobChunk")
+        verbose_name_plural = _("JobChunks")
+
+    def __str__(self):
+        return '{}: {}-{}'.format(self.run_id, self.first_pk, self.last_pk)
+
+    @property
+    def throughput(self):
+        """Processed rows per second"""
+        return self.size / self.duration if self.duration else None
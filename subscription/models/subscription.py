@@ -1,3 +1,5 @@
+from datetime import timedelta
+
 from django.contrib.auth import get_user_model
 from django.db import models
 from django.utils import timezone
@@ -19,6 +21,7 @@ class Subscription(BaseModel):
         (PEYMAN_DIRECT_DEBIT, _("peyman direct debit")),
         (BANK_APPROACH, _("bank approach")),
     )
+    ACTIVE_OWED_DAYS = 4
     user = models.ForeignKey(User, related_name='subscriptions', verbose_name=_("user"))
     business = models.ForeignKey(Business, related_name='subscribers', verbose_name=_("business"))
     tier = models.ForeignKey(Tier, related_name='subscribers', verbose_name=_("tier"))
@@ -45,17 +48,29 @@ class Subscription(BaseModel):
     @property
     def is_active(self):
         """
-        Check if user has paid the last transaction of this subscription or not
-        subscriptions which has not payment for 2 month will be changed to
-        disable but user cannot see provided contents from day 3 of first month
+        Check if user has paid the owed transactions of this subscription or
+        not, subscriptions which has not payment for 2 month will be changed
+        to disable but user cannot see provided contents from day 3 of the
+        oldest owed transaction. oldest_owed_time is read from annotation of
+        setup_queryset of SubscriberList when it exists
         :return: Boolean
         """
-        transaction = self.transactions.filter(status=5, is_paid=False).order_by('created_time').last()
-        if transaction is not None:
-            passed_day = timezone.now() - transaction.created_time
-            return passed_day.days < 4
+        if hasattr(self, 'oldest_owed_time'):
+            oldest_owed_time = self.oldest_owed_time
+        else:
+            oldest_owed_time = self.transactions.filter(status=5, is_paid=False).order_by(
+                'created_time'
+            ).values_list('created_time', flat=True).first()
+        if oldest_owed_time is not None:
+            return oldest_owed_time > self.active_owed_from()
         return True
 
+    @classmethod
+    def active_owed_from(cls):
+        """Owed transactions created before this time make the subscription
+        inactive"""
+        return timezone.now() - timedelta(days=cls.ACTIVE_OWED_DAYS)
+
     @property
     def status_changed(self):
         return self.is_enable != self._b_is_enable
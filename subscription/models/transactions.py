@@ -1,12 +1,13 @@
 from django.contrib.auth import get_user_model
-from django.db import models
-from django.db.models import Sum, Q, Count
+from django.db import models, transaction as db_transaction
+from django.db.models import Sum, Q, Count, Exists, OuterRef
 from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 from business.models import Target, SubscriptionPurpose, SMSPackage
 from lib.common_model import BaseModel
+from .relation import Relation
 from .subscription import Subscription
 
 User = get_user_model()
@@ -32,6 +33,8 @@ class BaseTransaction(BaseModel):
         (SMS_PACKAGE, _("SMS package")),
         (FOLLOWER_WALLET_CHARGE, _("Follower wallet charge")),
     )
+    # Transaction types which their paid payment charges the user wallet
+    WALLET_CREDIT_TYPES = (WALLET_CHARGE, FOLLOWER_WALLET_CHARGE, SUBSCRIPTION)
 
     user = models.ForeignKey(User, related_name='transactions', verbose_name=_("user"))
     amount = models.IntegerField(verbose_name=_("amount"))
@@ -70,8 +73,15 @@ class BaseTransaction(BaseModel):
 
     @classmethod
     def wallet(cls, user):
+        """Return materialized wallet value of the user, see WalletBalance"""
+        from .wallet import WalletBalance
+        return WalletBalance.balance_of(user)
+
+    @classmethod
+    def calculate_wallet(cls, user):
         """Get user and calculate wallet value of user by subtracting bank
-        payments from other transactions and return inter as response"""
+        payments from other transactions and return inter as response, it is
+        the source of truth which wallet ledger is reconciled against"""
         user_transactions = cls.objects.filter(user=user)
         positive_amount = user_transactions.filter(
             Q(transaction_type=cls.WALLET_CHARGE, payment__is_paid=True) |
@@ -94,15 +104,7 @@ class BaseTransaction(BaseModel):
         :param user: user instance
         :return: None
         """
-        owed_transactions = SubscriptionTransaction.objects.select_related('subscription').filter(
-            subscription__user=user, subscription__is_enable=True, status=SubscriptionTransaction.OWED
-        )
-        for owed in owed_transactions:
-            if cls.wallet(user) >= owed.transaction.amount:
-                owed.is_paid = True
-                owed.status = SubscriptionTransaction.PAID
-                owed.paid_date = timezone.now()
-                owed.save()
+        SubscriptionTransaction.settle_owed(user)
         return
 
 
@@ -147,6 +149,9 @@ class SMSPackageTransaction(BaseModel):
         super().__init__(*args, **kwargs)
         self._b_is_paid = self.is_paid
 
+    def status_changed(self):
+        return self._b_is_paid != self.is_paid
+
     def set_paid(self):
         """Set transaction is_paid =>> True"""
         if not self.is_paid:
@@ -224,7 +229,9 @@ class TargetTransaction(BaseModel):
 
 class SubscriptionTransaction(BaseModel):
     """Save all subscription related transactions here. For each subscription
-    we store due_date and paid_date to not how to react financial terms"""
+    we store due_date and paid_date to not how to react financial terms.
+    billing_period is the jalali month which is charged by the transaction and
+    is unique per subscription, so a month can not be charged twice"""
     CREATED = 0
     OWED = 5
     PAID = 10
@@ -244,10 +251,14 @@ class SubscriptionTransaction(BaseModel):
     is_paid = models.BooleanField(default=True, verbose_name=_("is paid"))
     paid_date = models.DateTimeField(null=True, blank=True)
     status = models.PositiveSmallIntegerField(verbose_name=_("status"), choices=STATUS_CHOICES, default=CREATED)
+    billing_period = models.CharField(
+        verbose_name=_("billing period"), max_length=7, null=True, blank=True, editable=False
+    )
 
     class Meta:
         verbose_name = _("SubscriptionTransaction")
         verbose_name_plural = _("SubscriptionTransactions")
+        unique_together = (('subscription', 'billing_period'),)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -274,8 +285,128 @@ class SubscriptionTransaction(BaseModel):
             self.subscription.is_enable = True
             self.subscription.save()
 
+    @classmethod
+    def set_paid_bulk(cls, transaction_ids):
+        """
+        Bulk mode of set_paid for transactions of verified payments. Rows are
+        changed with bulk updates, so side effects of post_save signals of
+        transactions and subscriptions are applied here
+        :param transaction_ids: SubscriptionTransaction ids
+        :return: list of paid SubscriptionTransaction ids
+        """
+        from .donor import DonorCounter
+        from .income import BusinessDailyIncome
+        from .wallet import WalletEntry
+        now = timezone.now()
+        with db_transaction.atomic():
+            rows = list(cls.objects.select_for_update().filter(pk__in=transaction_ids, is_paid=False).values_list(
+                'id', 'transaction_id', 'transaction__amount', 'transaction__transaction_type', 'transaction__user',
+                'subscription', 'subscription__business', 'subscription__tier', 'subscription_purpose'
+            ))
+            if not rows:
+                return list()
+            paid_ids = [row[0] for row in rows]
+            cls.objects.filter(pk__in=paid_ids).update(
+                is_paid=True, status=cls.PAID, paid_date=now, modified_time=now
+            )
+
+            entries, incomes, donors = list(), list(), list()
+            for pk, transaction_id, amount, transaction_type, user_id, subscription_id, business_id, tier_id, \
+                    purpose_id in rows:
+                if transaction_type == BaseTransaction.SUBSCRIPTION:
+                    entries.append(WalletEntry(
+                        user_id=user_id, transaction_id=transaction_id,
+                        source=WalletEntry.SUBSCRIPTION_TRANSACTION, amount=-amount
+                    ))
+                incomes.append(BusinessDailyIncome.row(
+                    business_id, now, BusinessDailyIncome.SUBSCRIPTION, amount, purpose_id, tier_id
+                ))
+                donors.append((user_id, pk, 1))
+            WalletEntry.post_bulk(entries)
+            BusinessDailyIncome.add(incomes)
+            DonorCounter.add(donors)
+
+            subscriptions = Subscription.objects.filter(pk__in={row[5] for row in rows}, is_enable=False)
+            enabled = list(subscriptions.values_list('user', 'business'))
+            subscriptions.update(is_enable=True, modified_time=now)
+            for user_id, business_id in enabled:
+                Relation.objects.get_or_create(follower_id=user_id, following_id=business_id)
+        return paid_ids
+
+    @classmethod
+    def settle_owed(cls, user):
+        """
+        Take one snapshot of user wallet and pay owed transactions of enabled
+        subscriptions in due date order. The largest prefix which the wallet
+        covers is flagged as paid with one bulk update while the wallet and
+        owed rows are locked, so post_save signals are not sent for them
+        :param user: user instance or id
+        :return: list of paid SubscriptionTransaction ids
+        """
+        from .donor import DonorCounter
+        from .income import BusinessDailyIncome
+        from .wallet import WalletBalance, WalletEntry
+        user_id = getattr(user, 'pk', user)
+        with db_transaction.atomic():
+            balance = WalletBalance.lock([user_id]).get(user_id, 0)
+            owed_transactions = cls.objects.select_for_update().filter(
+                subscription__user_id=user_id, subscription__is_enable=True, status=cls.OWED
+            ).order_by('due_date', 'id').values_list(
+                'id', 'transaction_id', 'transaction__amount', 'transaction__transaction_type',
+                'subscription__business', 'subscription__tier', 'subscription_purpose'
+            )
+
+            now = timezone.now()
+            paid_ids, entries, incomes, total = list(), list(), list(), 0
+            for pk, transaction_id, amount, transaction_type, business_id, tier_id, purpose_id in owed_transactions:
+                if total + amount > balance:
+                    break
+                total += amount
+                paid_ids.append(pk)
+                incomes.append(BusinessDailyIncome.row(
+                    business_id, now, BusinessDailyIncome.SUBSCRIPTION, amount, purpose_id, tier_id
+                ))
+                if transaction_type == BaseTransaction.SUBSCRIPTION:
+                    entries.append(WalletEntry(
+                        user_id=user_id, transaction_id=transaction_id,
+                        source=WalletEntry.SUBSCRIPTION_TRANSACTION, amount=-amount
+                    ))
+
+            if paid_ids:
+                cls.objects.filter(pk__in=paid_ids).update(
+                    is_paid=True, status=cls.PAID, paid_date=now, modified_time=now
+                )
+                WalletEntry.post_bulk(entries)
+                BusinessDailyIncome.add(incomes)
+                DonorCounter.add((user_id, pk, 1) for pk in paid_ids)
+        return paid_ids
+
+    @classmethod
+    def settle_owed_users(cls, charged_from):
+        """
+        Batch mode of settle_owed for all users which their wallet is charged
+        since given time and still have owed transactions
+        :param charged_from: datetime instance
+        :return: dict of paid transaction ids per user id
+        """
+        from .wallet import WalletEntry
+        owed = cls.objects.filter(subscription__user=OuterRef('user'), subscription__is_enable=True, status=cls.OWED)
+        user_ids = WalletEntry.objects.filter(
+            source=WalletEntry.PAYMENT, amount__gt=0, created_time__gte=charged_from
+        ).annotate(has_owed=Exists(owed)).filter(has_owed=True).values_list('user_id', flat=True).distinct()
+
+        settled = dict()
+        for user_id in user_ids:
+            paid_ids = cls.settle_owed(user_id)
+            if paid_ids:
+                settled[user_id] = paid_ids
+        return settled
+
 
 class SubscriptionPeymanTransaction(BaseModel):
+    """Direct debit transactions of subscriptions, billing_period is only kept
+    by the attempt which has reserved or paid the month, failed attempts of
+    the same month have null billing_period"""
     CREATED = 0
     PAID = 10
     FAILED = 20
@@ -301,14 +432,26 @@ class SubscriptionPeymanTransaction(BaseModel):
     status = models.PositiveSmallIntegerField(verbose_name=_("status"), choices=STATUS_CHOICES, default=CREATED)
     paid_date = models.DateTimeField(null=True, blank=True)
     due_date = models.DateTimeField(verbose_name=_("due date"), blank=True, null=True)
+    billing_period = models.CharField(
+        verbose_name=_("billing period"), max_length=7, null=True, blank=True, editable=False
+    )
 
     class Meta:
         verbose_name = _("SubscriptionPeymanTransaction")
         verbose_name_plural = _("SubscriptionsPeymansTransactions")
+        unique_together = (('subscription', 'billing_period'),)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._b_is_paid = self.is_paid
 
     def __str__(self):
         return "{}: {}".format(self.subscription.business.name, self.transaction.amount)
 
+    def status_changed(self):
+        """Check weather status is changed during actions or not"""
+        return self._b_is_paid != self.is_paid
+
     def set_paid(self):
         """Set transaction is_paid =>> True and status  =>> PAID"""
         if not self.is_paid:
@@ -318,3 +461,17 @@ class SubscriptionPeymanTransaction(BaseModel):
             self.save()
             self.subscription.is_enable = True
             self.subscription.save()
+
+    @classmethod
+    def release_stale_reservations(cls, before):
+        """
+        Release billing periods which are reserved before given time by
+        attempts which have not finished, e.g. their worker has stopped during
+        the bank call, so the month can be charged again
+        :param before: datetime instance
+        :return: number of released periods
+        """
+        return cls.objects.filter(
+            status=cls.CREATED, is_paid=False, peyman_transaction__isnull=True, billing_period__isnull=False,
+            created_time__lt=before
+        ).update(billing_period=None, modified_time=timezone.now())
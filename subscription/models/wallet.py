@@ -0,0 +1,207 @@
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import models, transaction as db_transaction, IntegrityError
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.utils.translation import ugettext_lazy as _
+
+from lib.common_model import BaseModel
+from .transactions import BaseTransaction
+
+User = get_user_model()
+
+
+class WalletBalance(BaseModel):
+    """Materialized wallet value of each user, the balance is sum of all
+    WalletEntry rows of the user and is updated in the same database
+    transaction which appends the entries"""
+    user = models.OneToOneField(User, related_name='wallet_balance', verbose_name=_("user"))
+    balance = models.IntegerField(verbose_name=_("balance"), default=0)
+
+    class Meta:
+        verbose_name = _("WalletBalance")
+        verbose_name_plural = _("WalletBalances")
+
+    def __str__(self):
+        return '{}: {}'.format(self.user, self.balance)
+
+    @classmethod
+    def balance_of(cls, user):
+        """Return wallet value of given user with one indexed row lookup,
+        negative balances are shown as 0 same as old aggregation approach.
+        Wallets which are not opened yet are calculated from history"""
+        balance = cls.objects.filter(user=user).values_list('balance', flat=True).first()
+        if balance is None:
+            return BaseTransaction.calculate_wallet(user)
+        return balance if balance > 0 else 0
+
+    @classmethod
+    def open(cls, user_ids):
+        """
+        Create balances of given users which have none. Paid sources of their
+        history which are not posted to the ledger are appended first, so
+        wallets which existed before the ledger keep their value
+        :param user_ids: iterable of user ids
+        """
+        user_ids = set(user_ids)
+        user_ids -= set(cls.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True))
+        if not user_ids:
+            return
+        expected = WalletEntry.expected_entries(user_ids)
+        posted = WalletEntry.posted_entries(user_ids)
+        try:
+            with db_transaction.atomic():
+                WalletEntry.objects.bulk_create([
+                    WalletEntry(
+                        user_id=user_id, transaction_id=key[0], source=key[1],
+                        amount=amount - posted.get(key, (user_id, 0))[1]
+                    ) for key, (user_id, amount) in expected.items() if amount != posted.get(key, (user_id, 0))[1]
+                ])
+                balances = dict(WalletEntry.objects.filter(user_id__in=user_ids).values_list('user_id').annotate(
+                    Sum('amount')
+                ).order_by())
+                cls.objects.bulk_create([cls(user_id=user_id, balance=balances.get(user_id, 0)) for user_id in user_ids])
+        except IntegrityError:
+            # opened by a concurrent transaction, its entries are kept
+            pass
+
+    @classmethod
+    def lock(cls, user_ids):
+        """
+        Lock balances of given users, should be called inside a database
+        transaction. Wallets which are not opened yet are opened first
+        :param user_ids: iterable of user ids
+        :return: dict of balance per user id
+        """
+        user_ids = set(user_ids)
+        cls.open(user_ids)
+        return dict(cls.objects.select_for_update().filter(user_id__in=user_ids).values_list('user_id', 'balance'))
+
+
+class WalletEntry(BaseModel):
+    """Append-only ledger of wallet changes, each entry points to the source
+    row (payment or paid transaction) which changed the wallet value. Entries
+    are never updated, reverting a source appends a negative entry"""
+    PAYMENT = 5
+    SUBSCRIPTION_TRANSACTION = 10
+    SMS_PACKAGE_TRANSACTION = 15
+    SOURCE_CHOICES = (
+        (PAYMENT, _("Payment")),
+        (SUBSCRIPTION_TRANSACTION, _("Subscription transaction")),
+        (SMS_PACKAGE_TRANSACTION, _("SMS package transaction")),
+    )
+
+    user = models.ForeignKey(User, related_name='wallet_entries', verbose_name=_("user"))
+    transaction = models.ForeignKey(BaseTransaction, related_name='wallet_entries', verbose_name=_("transaction"))
+    source = models.PositiveSmallIntegerField(verbose_name=_("source"), choices=SOURCE_CHOICES)
+    amount = models.IntegerField(verbose_name=_("amount"))
+
+    class Meta:
+        verbose_name = _("WalletEntry")
+        verbose_name_plural = _("WalletEntries")
+        index_together = (('transaction', 'source'),)
+
+    def __str__(self):
+        return '{}({}): {}'.format(self.user_id, self.get_source_display(), self.amount)
+
+    @staticmethod
+    def expected_amount(transaction, source, is_paid):
+        """Return the value which given source should have on the wallet
+        according to BaseTransaction.calculate_wallet rules"""
+        if not is_paid:
+            return 0
+        if source == WalletEntry.PAYMENT and transaction.transaction_type in BaseTransaction.WALLET_CREDIT_TYPES:
+            return transaction.amount
+        if source == WalletEntry.SUBSCRIPTION_TRANSACTION and \
+                transaction.transaction_type == BaseTransaction.SUBSCRIPTION:
+            return -transaction.amount
+        if source == WalletEntry.SMS_PACKAGE_TRANSACTION and \
+                transaction.transaction_type == BaseTransaction.SMS_PACKAGE:
+            return -transaction.amount
+        return 0
+
+    @staticmethod
+    def expected_entries(user_ids=None):
+        """
+        Map (transaction, source) of all paid wallet sources to the (user,
+        amount) pair which they should have posted to the ledger
+        :param user_ids: limit the result to given users, default is all
+        """
+        sources = (
+            (WalletEntry.PAYMENT, 1, dict(
+                transaction_type__in=BaseTransaction.WALLET_CREDIT_TYPES, payment__is_paid=True
+            )),
+            (WalletEntry.SUBSCRIPTION_TRANSACTION, -1, dict(
+                transaction_type=BaseTransaction.SUBSCRIPTION, subscription_transaction__is_paid=True
+            )),
+            (WalletEntry.SMS_PACKAGE_TRANSACTION, -1, dict(
+                transaction_type=BaseTransaction.SMS_PACKAGE, sms_package_transaction__is_paid=True
+            )),
+        )
+        expected = dict()
+        for source, sign, query in sources:
+            rows = BaseTransaction.objects.filter(**query)
+            if user_ids is not None:
+                rows = rows.filter(user_id__in=user_ids)
+            for tid, uid, amount in rows.values_list('id', 'user_id', 'amount').iterator():
+                expected[(tid, source)] = (uid, sign * amount)
+        return expected
+
+    @classmethod
+    def posted_entries(cls, user_ids=None):
+        """Map (transaction, source) of posted entries to their (user, sum
+        of amounts) pair"""
+        rows = cls.objects.all()
+        if user_ids is not None:
+            rows = rows.filter(user_id__in=user_ids)
+        posted = dict()
+        for row in rows.values('transaction_id', 'source', 'user_id').annotate(total=Sum('amount')).iterator():
+            posted[(row['transaction_id'], row['source'])] = (row['user_id'], row['total'])
+        return posted
+
+    @classmethod
+    def sync(cls, transaction, source, is_paid):
+        """
+        Append the difference between expected and already posted value of
+        the source to the ledger and apply it on user balance. Calling it more
+        than once for the same state is harmless
+        :param transaction: BaseTransaction instance of the source
+        :param source: one of SOURCE_CHOICES
+        :param is_paid: current paid status of the source
+        :return: posted amount
+        """
+        expected = cls.expected_amount(transaction, source, is_paid)
+        with db_transaction.atomic():
+            WalletBalance.lock([transaction.user_id])
+            posted = cls.objects.filter(transaction=transaction, source=source).aggregate(
+                total=Coalesce(Sum('amount'), 0)
+            )['total']
+            delta = expected - posted
+            if delta == 0:
+                return 0
+            cls.objects.create(user_id=transaction.user_id, transaction=transaction, source=source, amount=delta)
+            WalletBalance.objects.filter(user_id=transaction.user_id).update(balance=F('balance') + delta)
+        return delta
+
+    @classmethod
+    def post_bulk(cls, entries):
+        """
+        Append unsaved entries of bulk source changes and apply them on the
+        balances, should be called inside the database transaction which has
+        changed the sources
+        :param entries: list of unsaved WalletEntry instances
+        :return: dict of posted amount per user id
+        """
+        deltas = defaultdict(int)
+        for entry in entries:
+            deltas[entry.user_id] += entry.amount
+        with db_transaction.atomic():
+            cls.objects.bulk_create(entries)
+            opened = list()
+            for user_id, delta in deltas.items():
+                if not WalletBalance.objects.filter(user_id=user_id).update(balance=F('balance') + delta):
+                    opened.append(user_id)
+            # balances of new wallets are summed from the ledger after the entries are appended
+            WalletBalance.open(opened)
+        return deltas
@@ -0,0 +1,94 @@
+from functools import lru_cache
+
+from django.template import loader
+
+from subscription.models import Subscription
+from utils.links import make_short_bulk, display_link
+
+DEFAULT_LINK = 'ham3.ir'
+
+
+@lru_cache(maxsize=None)
+def get_text_template(name):
+    """Compiled template of text notifications, compiled once per process"""
+    return loader.get_template(name)
+
+
+class SubscriptionNotificationBuilder:
+    """
+    Build ready to send payloads of subscription notifications in batches.
+    Subscriptions with their user, business and tier are loaded with one
+    query, links are shortened together and constant tokens of each business
+    are built once, so workers which send the payloads do not query again.
+    A payload is a dict of user id, phone number, Kavenegar template and
+    tokens, and the rendered text when texts are requested
+    """
+    SMS_TEMPLATES = dict(
+        early_notify='ABREAST-A2',
+        due_date_notify='ABREAST-A3',
+        greeting='ABREAST-A4',
+        late_notify='ABREAST-A1',
+    )
+    TEXT_TEMPLATES = dict(
+        early_notify='subscription/early_notify.txt',
+        due_date_notify='subscription/due_date_notify.txt',
+        greeting='subscription/charge_greeting_notify.txt',
+        late_notify='subscription/late_notify.txt',
+    )
+
+    def __init__(self, with_text=False):
+        self.with_text = with_text
+        self._business_tokens = dict()
+
+    @staticmethod
+    def get_subscriptions(subscription_ids):
+        return {
+            subscription.pk: subscription for subscription in Subscription.objects.filter(
+                pk__in=set(subscription_ids)
+            ).select_related('user', 'business', 'tier')
+        }
+
+    def business_tokens(self, business):
+        if business.pk not in self._business_tokens:
+            self._business_tokens[business.pk] = dict(token20=business.name)
+        return self._business_tokens[business.pk]
+
+    def build(self, notifications, subscriptions=None):
+        """
+        :param notifications: iterable of (subscription id, notif_type, link,
+        days), link and days may be omitted
+        :param subscriptions: optional dict of loaded subscriptions by id with
+        their user, business and tier
+        :return: list of payloads, unknown subscriptions and types are skipped
+        """
+        notifications = [(tuple(notification) + (None, 0))[:4] for notification in notifications]
+        notifications = [
+            (sid, notif_type, link or DEFAULT_LINK, days or 0) for sid, notif_type, link, days in notifications
+            if notif_type in self.SMS_TEMPLATES
+        ]
+        if subscriptions is None:
+            subscriptions = self.get_subscriptions(sid for sid, notif_type, link, days in notifications)
+        links = make_short_bulk(link for sid, notif_type, link, days in notifications)
+        payloads = list()
+        for sid, notif_type, link, days in notifications:
+            subscription = subscriptions.get(sid)
+            if subscription is None:
+                continue
+            payloads.append(self.build_payload(subscription, notif_type, display_link(links[link]), days))
+        return payloads
+
+    def build_payload(self, subscription, notif_type, link, days):
+        full_name = subscription.user.get_full_name()
+        tokens = dict(self.business_tokens(subscription.business), token10=full_name, token=link)
+        if notif_type == 'greeting':
+            tokens['token'] = subscription.tier.amount
+        payload = dict(
+            user=subscription.user_id, phone_number=subscription.user.phone_number,
+            template=self.SMS_TEMPLATES[notif_type], tokens=tokens,
+        )
+        if self.with_text:
+            payload['text'] = get_text_template(self.TEXT_TEMPLATES[notif_type]).render(dict(
+                user=full_name, days=days, business=subscription.business.name,
+                amount=subscription.tier.amount, tier=subscription.tier.title, link=link,
+            ))
+        return payload
@@ -0,0 +1,126 @@
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from finance.gateways import gateway_registry
+from finance.models import Payment
+from subscription.jobs import run_chunked
+from subscription.models.transactions import SubscriptionTransaction
+from subscription.notifications import SubscriptionNotificationBuilder
+from utils.links import make_short_bulk, display_link
+
+logger = logging.getLogger(__file__)
+
+User = get_user_model()
+
+
+class LateReminderEngine:
+    """
+    Remind owed subscription transactions which are exactly one of
+    LATE_REMINDER_DAYS days late. Users with owed transactions are processed
+    in checkpointed chunks, owed transactions of a chunk are read with their
+    payment, subscription, user, business and tier in one query, missing
+    payments are created with one insert and each user gets one message for
+    all of its owed transactions. Payloads of a chunk are sent with one task
+    after commit.
+    """
+    DASHBOARD_LINK = 'https://website.com/dashboards#wallet'
+
+    def __init__(self, date=None, days=None, chunk_size=500, notify=None):
+        """
+        :param date: reminder date, datetime instance or iso formatted string
+        :param days: iterable of late days which are reminded
+        :param chunk_size: number of users which are reminded together
+        :param notify: callable(payloads) to send payloads of a chunk
+        """
+        if date is None:
+            date = timezone.now()
+        elif isinstance(date, str):
+            date = parse_datetime(date)
+        self.today = timezone.localtime(date).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.days = sorted(set(days or getattr(settings, 'LATE_REMINDER_DAYS', (3,))))
+        self.chunk_size = chunk_size
+        self.notify = notify
+        self.report = dict(users=0, transactions=0, created_payments=0)
+
+    def late_days(self, due_date):
+        return (self.today.date() - timezone.localtime(due_date).date()).days
+
+    def get_transactions(self):
+        due_dates = Q()
+        for days in self.days:
+            start = self.today - timedelta(days=days)
+            due_dates |= Q(due_date__gte=start, due_date__lt=start + timedelta(days=1))
+        return SubscriptionTransaction.objects.filter(
+            due_dates, is_paid=False, status=SubscriptionTransaction.OWED
+        )
+
+    def get_users(self):
+        return User.objects.filter(pk__in=self.get_transactions().values('subscription__user_id'))
+
+    def create_payments(self, subscription_transactions):
+        """Payments of given transactions, missing ones are bulk created"""
+        payments, missing = dict(), list()
+        for subscription_transaction in subscription_transactions:
+            base_transaction = subscription_transaction.transaction
+            if hasattr(base_transaction, 'payment'):
+                payments[base_transaction.pk] = base_transaction.payment
+            else:
+                missing.append(Payment(
+                    amount=base_transaction.amount, user_id=base_transaction.user_id, transaction=base_transaction
+                ))
+        for payment in Payment.objects.bulk_create(missing):
+            payments[payment.transaction_id] = payment
+        self.report['created_payments'] += len(missing)
+        return payments
+
+    def build_payloads(self, subscription_transactions, payments):
+        gateway = gateway_registry.default()
+        gateway_code = gateway.code if gateway is not None else None
+        grouped = OrderedDict()
+        for subscription_transaction in subscription_transactions:
+            grouped.setdefault(subscription_transaction.subscription.user_id, list()).append(subscription_transaction)
+        links = {
+            user_id: payments[owed[0].transaction_id].get_instant_link(gateway_code)
+            if len(owed) == 1 else self.DASHBOARD_LINK for user_id, owed in grouped.items()
+        }
+        short_links = make_short_bulk(links.values())
+        builder = SubscriptionNotificationBuilder()
+        payloads = list()
+        for user_id, owed in grouped.items():
+            payload = builder.build_payload(
+                owed[0].subscription, 'late_notify', display_link(short_links[links[user_id]]),
+                self.late_days(owed[0].due_date)
+            )
+            businesses = OrderedDict.fromkeys(item.subscription.business.name for item in owed)
+            payload['tokens']['token20'] = '، '.join(businesses)
+            payloads.append(payload)
+        return payloads
+
+    def process_chunk(self, users):
+        subscription_transactions = list(self.get_transactions().filter(
+            subscription__user__in=users
+        ).select_related(
+            'transaction__payment', 'subscription__user', 'subscription__business', 'subscription__tier'
+        ).order_by('due_date', 'pk'))
+        payments = self.create_payments(subscription_transactions)
+        payloads = self.build_payloads(subscription_transactions, payments)
+        self.report['users'] += len(payloads)
+        self.report['transactions'] += len(subscription_transactions)
+        if self.notify is not None and payloads:
+            transaction.on_commit(lambda: self.notify(payloads))
+
+    def run(self):
+        run_chunked(
+            'late_payment_reminders', self.today.date().isoformat(), self.get_users(), self.process_chunk,
+            chunk_size=self.chunk_size
+        )
+        logger.info('late payment reminders: {}'.format(self.report))
+        return self.report
@@ -0,0 +1,154 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q, Sum, Count, Case, When, IntegerField, OuterRef
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from khayyam import JalaliDate
+
+from business.models import Business, Target
+from lib.query_handler import grouped_subquery
+from subscription.models import BaseTransaction, Subscription, BusinessDailyIncome
+from subscription.models.transactions import SubscriptionTransaction, SubscriptionPeymanTransaction, TargetTransaction
+from utils.time import get_start_day_of_month
+
+BUSINESS_REPORT_CACHE_KEY = 'business-transactions-report-{}'
+
+
+def business_income_report(date=None):
+    """
+    Income of all businesses in one grouped query over bank and direct debit
+    subscription transactions, only businesses with paid transactions in the
+    last 24 hours and an owner phone number are returned
+    :param date: end of the report, default is now
+    :return: values queryset of dicts with business, phone_number,
+    last_day_amount, last_day_count and month_amount keys
+    """
+    if date is None:
+        date = timezone.now()
+    last_day_date = date - timedelta(hours=24)
+    start_day_of_month = get_start_day_of_month(date)
+
+    paid_transactions = BaseTransaction.objects.filter(
+        Q(subscription_transaction__status=SubscriptionTransaction.PAID) |
+        Q(subscription_peyman_transaction__status=SubscriptionPeymanTransaction.PAID)
+    ).annotate(
+        paid_at=Coalesce('subscription_transaction__paid_date', 'subscription_peyman_transaction__paid_date'),
+    ).filter(Q(paid_at__gt=last_day_date) | Q(paid_at__gte=start_day_of_month))
+
+    return paid_transactions.values(
+        business=Coalesce(
+            'subscription_transaction__subscription__business',
+            'subscription_peyman_transaction__subscription__business',
+        ),
+        phone_number=Coalesce(
+            'subscription_transaction__subscription__business__user__phone_number',
+            'subscription_peyman_transaction__subscription__business__user__phone_number',
+        ),
+    ).exclude(phone_number=None).annotate(
+        last_day_amount=Sum(Case(
+            When(paid_at__gt=last_day_date, then='amount'), default=0, output_field=IntegerField()
+        )),
+        last_day_count=Sum(Case(
+            When(paid_at__gt=last_day_date, then=1), default=0, output_field=IntegerField()
+        )),
+        month_amount=Sum(Case(
+            When(paid_at__gte=start_day_of_month, then='amount'), default=0, output_field=IntegerField()
+        )),
+    ).filter(last_day_amount__gt=0).order_by()
+
+
+def conditional_sum(field, condition):
+    return Coalesce(Sum(Case(When(condition, then=field), default=0, output_field=IntegerField())), 0)
+
+
+def business_transactions_report(business, date=None):
+    """
+    Totals of business panel transactions report in two queries, paid incomes
+    are read from BusinessDailyIncome rollup and the rest are annotated on
+    the business row
+    :param business: Business instance or id
+    :param date: month_income is calculated from start of the month of date
+    :return: dict
+    """
+    business_id = getattr(business, 'pk', business)
+    start_day_of_month = get_start_day_of_month(date or timezone.now())
+    subscription_kinds = Q(kind__in=BusinessDailyIncome.SUBSCRIPTION_KINDS)
+    target_kind = Q(kind=BusinessDailyIncome.TARGET)
+    data = BusinessDailyIncome.objects.filter(business_id=business_id).aggregate(
+        total_income=conditional_sum('amount', subscription_kinds),
+        month_income=conditional_sum('amount', subscription_kinds & Q(date__gte=start_day_of_month)),
+        total_project_income=conditional_sum('amount', target_kind),
+        projects_income_count=conditional_sum('count', target_kind),
+    )
+
+    subscriptions = Subscription.objects.filter(business=OuterRef('pk'), is_enable=True)
+    data.update(Business.objects.filter(pk=business_id).annotate(
+        total_owed=grouped_subquery(SubscriptionTransaction.objects.filter(
+            subscription__business=OuterRef('pk'), status=SubscriptionTransaction.OWED
+        ), 'subscription__business', Sum('transaction__amount')),
+        projects_count=grouped_subquery(
+            Target.objects.filter(business=OuterRef('pk')), 'business', Count('id')
+        ),
+        subscriptions_amount=grouped_subquery(subscriptions, 'business', Sum('tier__amount')),
+        subscribers_count=grouped_subquery(subscriptions, 'business', Count('user', distinct=True)),
+    ).values('total_owed', 'projects_count', 'subscriptions_amount', 'subscribers_count').first() or dict(
+        total_owed=0, projects_count=0, subscriptions_amount=0, subscribers_count=0
+    ))
+
+    subscriptions_amount, subscribers_count = data.pop('subscriptions_amount'), data.pop('subscribers_count')
+    data['paid_ratio'] = subscriptions_amount // subscribers_count if subscribers_count else 0
+    data['projet_paid_ratio'] = 0
+    if data['projects_count']:
+        data['projet_paid_ratio'] = data['total_project_income'] // (data['projects_income_count'] or 1)
+    return data
+
+
+def get_business_transactions_report(business):
+    """Cached business_transactions_report, cache is invalidated when
+    transactions of the business are paid or owed and when its targets or
+    subscriptions are changed"""
+    key = BUSINESS_REPORT_CACHE_KEY.format(business.pk)
+    data = cache.get(key)
+    if data is None:
+        data = business_transactions_report(business)
+        cache.set(key, data, getattr(settings, 'BUSINESS_REPORT_CACHE_TIMEOUT', 60 * 60))
+    return data
+
+
+def invalidate_business_reports(business_ids):
+    cache.delete_many([BUSINESS_REPORT_CACHE_KEY.format(business_id) for business_id in set(business_ids)])
+
+
+def daily_incomes(business_ids=None):
+    """
+    Group paid transactions history by BusinessDailyIncome key
+    :param business_ids: limit the result to given businesses, default is all
+    :return: generator of unsaved BusinessDailyIncome instances
+    """
+    sources = (
+        (BusinessDailyIncome.SUBSCRIPTION, SubscriptionTransaction.objects.filter(is_paid=True), True),
+        (BusinessDailyIncome.DIRECT_DEBIT, SubscriptionPeymanTransaction.objects.filter(is_paid=True), True),
+        (BusinessDailyIncome.TARGET, TargetTransaction.objects.filter(is_paid=True), False),
+    )
+    for kind, queryset, is_subscription in sources:
+        if is_subscription:
+            if business_ids is not None:
+                queryset = queryset.filter(subscription__business__in=business_ids)
+            rows = queryset.annotate(day=TruncDate(Coalesce('paid_date', 'created_time'))).values_list(
+                'subscription__business', 'day', 'subscription_purpose', 'subscription__tier'
+            )
+        else:
+            if business_ids is not None:
+                queryset = queryset.filter(target__business__in=business_ids)
+            rows = queryset.annotate(day=TruncDate('modified_time')).values_list('target__business', 'day')
+        rows = rows.annotate(amount=Sum('transaction__amount'), count=Count('id')).order_by()
+        for row in rows.iterator():
+            business_id, day, purpose_id, tier_id = row[:-2] if is_subscription else row[:-2] + (None, None)
+            jalali_date = JalaliDate(day)
+            yield BusinessDailyIncome(
+                business_id=business_id, date=day, kind=kind, purpose_id=purpose_id, tier_id=tier_id,
+                jalali_year=jalali_date.year, jalali_month=jalali_date.month, jalali_day=jalali_date.day,
+                amount=row[-2], count=row[-1]
+            )
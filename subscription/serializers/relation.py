@@ -1,6 +1,5 @@
 from django.contrib.auth import get_user_model
-from django.db.models import Sum, Q
-from django.db.models.functions import Coalesce
+from django.db.models import Sum, Count, Exists, OuterRef, Prefetch, Subquery
 from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
@@ -9,6 +8,8 @@ from django.utils.translation import ugettext_lazy as _
 
 from business.models import Business
 from content.models import Comment
+from lib.paginations import DonorHistoryPagination
+from lib.query_handler import grouped_subquery
 from subscription.models import Relation, Subscription
 from subscription.models.transactions import SubscriptionTransaction, SubscriptionPeymanTransaction
 from subscription.serializers.subscriptions import SubscriptionLightSerializer
@@ -34,12 +35,14 @@ class RelationCreateSerializer(serializers.ModelSerializer):
 
 
 class FollowerListSerializer(serializers.ModelSerializer):
+    """Followers of a business with their paid amount and active
+    subscriptions, queryset should be prepared with setup_queryset"""
     follower = serializers.CharField(source='follower.get_full_name')
     id = serializers.IntegerField(source='follower.id')
     phone_number = serializers.IntegerField(source='follower.phone_number')
-    total_paid = serializers.SerializerMethodField()
+    total_paid = serializers.IntegerField(read_only=True)
     subscriptions = serializers.SerializerMethodField()
-    is_enable = serializers.SerializerMethodField()
+    is_enable = serializers.BooleanField(read_only=True)
 
     class Meta:
         model = Relation
@@ -47,21 +50,39 @@ class FollowerListSerializer(serializers.ModelSerializer):
             'id', 'follower', 'created_time', 'subscriptions', 'phone_number', 'total_paid', 'is_enable'
         )
 
-    def get_total_paid(self, obj):
-        total_paid = SubscriptionTransaction.objects.select_related('transaction', 'subscription').filter(
-            transaction__user=obj.follower, subscription__business=obj.following, is_paid=True, status=10
-        ).aggregate(total=Coalesce(Sum('transaction__amount'), 0))['total']
-        return total_paid
+    @staticmethod
+    def setup_queryset(queryset, business):
+        """Annotate total paid amount and active subscription existence of
+        each follower and prefetch the active subscriptions of the business"""
+        paid_transactions = SubscriptionTransaction.objects.filter(
+            transaction__user=OuterRef('follower'), subscription__business=OuterRef('following'),
+            is_paid=True, status=SubscriptionTransaction.PAID
+        )
+        subscriptions = Subscription.objects.filter(
+            user=OuterRef('follower'), business=OuterRef('following'), is_enable=True
+        )
+        active_subscriptions = SubscriptionLightSerializer.setup_queryset(
+            Subscription.objects.filter(business=business, is_enable=True)
+        )
+        return queryset.select_related('follower').annotate(
+            total_paid=grouped_subquery(paid_transactions, 'transaction__user', Sum('transaction__amount')),
+            is_enable=Exists(subscriptions),
+        ).prefetch_related(
+            Prefetch('follower__subscriptions', queryset=active_subscriptions, to_attr='active_subscriptions')
+        )
 
     def get_subscriptions(self, obj):
-        subscriptions = Subscription.objects.filter(user=obj.follower, business=obj.following, is_enable=True)
+        subscriptions = getattr(obj.follower, 'active_subscriptions', None)
+        if subscriptions is None:
+            subscriptions = Subscription.objects.filter(user=obj.follower, business=obj.following, is_enable=True)
         return SubscriptionLightSerializer(subscriptions, many=True).data
 
-    def get_is_enable(self, obj):
-        return bool(self.get_subscriptions(obj))
-
 
 class RelationDetailSerializer(serializers.ModelSerializer):
+    """Donor profile in business panel, queryset should be prepared with
+    setup_queryset which annotates report metrics of the donor in the user
+    row. Only the latest page of transactions histories is returned, older
+    pages are served by cursor paginated history APIs"""
     user = serializers.CharField(source='get_full_name')
     avatar = serializers.ImageField(source='profile.avatar')
     subscriptions = serializers.SerializerMethodField()
@@ -70,7 +91,7 @@ class RelationDetailSerializer(serializers.ModelSerializer):
     created_time = serializers.DateTimeField(source='date_joined')
     description = serializers.SerializerMethodField()
     subscription_peyman_transaction = serializers.SerializerMethodField()
-    total_owed = serializers.SerializerMethodField()
+    total_owed = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
@@ -82,54 +103,90 @@ class RelationDetailSerializer(serializers.ModelSerializer):
 
     @property
     def business(self):
-        request = self.context.get('request')
         if not hasattr(self, '_business'):
-            setattr(self, '_business', request.user.business if request is not None else None)
+            business = self.context.get('business')
+            if business is None:
+                business = self.context['request'].user.business
+            setattr(self, '_business', business)
         return self._business
 
-    def get_total_owed(self, obj):
-        return SubscriptionTransaction.objects.filter(transaction__user=obj, status=SubscriptionTransaction.OWED)\
-            .aggregate(total=Coalesce(Sum('transaction__amount'), 0))['total']
+    @staticmethod
+    def setup_queryset(queryset, business):
+        """Annotate paid, owed and comments totals and relation description
+        of each user with given business and prefetch enabled subscriptions"""
+        subscription_transactions = SubscriptionTransaction.objects.filter(
+            subscription__user=OuterRef('pk'), subscription__business=business
+        )
+        direct_debit_transactions = SubscriptionPeymanTransaction.objects.filter(
+            subscription__user=OuterRef('pk'), subscription__business=business, is_paid=True
+        )
+        subscriptions = SubscriptionLightSerializer.setup_queryset(
+            Subscription.objects.filter(business=business, is_enable=True)
+        )
+        return queryset.select_related('profile').annotate(
+            subscriptions_paid=grouped_subquery(
+                subscription_transactions.filter(is_paid=True), 'subscription__user', Sum('transaction__amount')
+            ),
+            direct_debits_paid=grouped_subquery(
+                direct_debit_transactions, 'subscription__user', Sum('transaction__amount')
+            ),
+            total_owed=grouped_subquery(
+                subscription_transactions.filter(status=SubscriptionTransaction.OWED),
+                'subscription__user', Sum('transaction__amount')
+            ),
+            total_comments=grouped_subquery(
+                Comment.objects.filter(post__business=business, user=OuterRef('pk')), 'user', Count('id')
+            ),
+            relation_description=Subquery(Relation.objects.filter(
+                follower=OuterRef('pk'), following=business
+            ).values('description')[:1]),
+        ).prefetch_related(
+            Prefetch('subscriptions', queryset=subscriptions, to_attr='business_subscriptions')
+        )
+
+    @staticmethod
+    def subscription_transactions_of(user, business):
+        return SubscriptionInlineTransactionSerializer.setup_queryset(SubscriptionTransaction.objects.filter(
+            subscription__user=user, subscription__business=business,
+            status__in=[SubscriptionTransaction.OWED, SubscriptionTransaction.PAID]
+        ))
+
+    @staticmethod
+    def direct_debit_transactions_of(user, business):
+        return SubscriptionInlinePeymanTransactionSerializer.setup_queryset(
+            SubscriptionPeymanTransaction.objects.filter(
+                subscription__user=user, subscription__business=business, status=SubscriptionPeymanTransaction.PAID
+            )
+        )
 
     def get_subscriptions(self, obj):
-        subscriptions = Subscription.objects.filter(user=obj, business=self.business, is_enable=True)
-        return SubscriptionLightSerializer(subscriptions, many=True).data
+        return SubscriptionLightSerializer(obj.business_subscriptions, many=True).data
 
     def get_subscription_transactions(self, obj):
-        subscription_transactions = SubscriptionTransaction.objects.filter(
-            subscription__user=obj, subscription__business=self.business
-        ).filter(Q(status__in=[5, 10]) | Q(status=10)).order_by('-created_time')
-        # ).filter(Q(subscription__is_enable=True, status__in=[5, 10]) | Q(status=10))
-        return SubscriptionInlineTransactionSerializer(subscription_transactions, many=True).data
+        subscription_transactions = self.subscription_transactions_of(obj, self.business)\
+            .order_by('-created_time')[:DonorHistoryPagination.page_size]
+        return SubscriptionInlineTransactionSerializer(
+            subscription_transactions, many=True, context=self.context
+        ).data
 
     def get_subscription_peyman_transaction(self, obj):
-        subscription_peyman_transaction = SubscriptionPeymanTransaction.objects.filter(
-            subscription__user=obj, subscription__business=self.business
-        ).filter(Q(status__in=[5, 10]) | Q(status=10)).order_by('-created_time')
-        return SubscriptionInlinePeymanTransactionSerializer(subscription_peyman_transaction, many=True).data
+        direct_debit_transactions = self.direct_debit_transactions_of(obj, self.business)\
+            .order_by('-created_time')[:DonorHistoryPagination.page_size]
+        return SubscriptionInlinePeymanTransactionSerializer(
+            direct_debit_transactions, many=True, context=self.context
+        ).data
 
     def get_report(self, obj):
-        subscription_transactions = SubscriptionTransaction.objects.filter(
-            subscription__user=obj, subscription__business=self.business, is_paid=True
+        first_subscription = min(
+            obj.business_subscriptions, key=lambda subscription: subscription.created_time, default=None
         )
-        subscription_peyman_transactions = SubscriptionPeymanTransaction.objects.filter(
-            subscription__user=obj, subscription__business=self.business, is_paid=True
-        )
-        subscriptions = Subscription.objects.filter(user=obj, business=self.business, is_enable=True)
-        comments = Comment.objects.filter(post__business=self.business, user=obj)
-        data = {
-            'total_paid': subscription_transactions.aggregate(t=Coalesce(Sum('transaction__amount'), 0))['t'] +
-                          subscription_peyman_transactions.aggregate(t=Coalesce(Sum('transaction__amount'), 0))['t'],
-            'total_comments': comments.count(),
-            'subscription_duration': (timezone.now() - subscriptions.first().created_time).days if subscriptions.first() else 0,
+        return {
+            'total_paid': obj.subscriptions_paid + obj.direct_debits_paid,
+            'total_comments': obj.total_comments,
+            'subscription_duration': (timezone.now() - first_subscription.created_time).days
+            if first_subscription is not None else 0,
             'platforms': []
-
         }
-        return data
 
     def get_description(self, obj):
-        try:
-            business = Business.objects.get(url_path=self.context.get('slug'))
-            return obj.followings.get(following=business).description
-        except:
-            return ''
\ No newline at end of file
+        return obj.relation_description or ''
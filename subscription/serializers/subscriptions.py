@@ -1,4 +1,4 @@
-from django.db.models import Sum
+from django.db.models import Sum, F, OuterRef, Subquery
 from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.db import transaction
@@ -9,13 +9,13 @@ from django.utils.translation import ugettext_lazy as _
 from django.core import validators
 
 from business.serializers import BusinessLightSerializer, TierLightSerializer
+from finance.availability import gateway_availability
+from lib.query_handler import grouped_subquery
 
 from peyman.utils import call_peyman_service
-from subscription.models import Subscription, BaseTransaction
+from subscription.models import Subscription, BaseTransaction, DonorCounter
 from subscription.models.transactions import SubscriptionPeymanTransaction, SubscriptionTransaction
 
-import datetime
-
 from django.contrib.auth import get_user_model, authenticate
 
 User = get_user_model()
@@ -47,10 +47,20 @@ class SubscriptionLightSerializer(serializers.ModelSerializer):
         return None
 
     def get_is_first_donate(self, obj):
-        count = SubscriptionTransaction.objects.select_related('transaction')\
-                   .filter(transaction__user=obj.user, is_paid=True).count()
+        count = getattr(obj, 'user_paid_count', None)
+        if count is None:
+            count = DonorCounter.paid_count_of(obj.user_id)
         return count == 1
 
+    @staticmethod
+    def setup_queryset(queryset):
+        """Select related rows and join paid transactions count of the
+        subscriber from DonorCounter, so a list of subscriptions is serialized
+        in one query"""
+        return queryset.select_related('user', 'business', 'tier', 'subscription_purpose').annotate(
+            user_paid_count=Coalesce(F('user__donor_counter__paid_count'), 0)
+        )
+
 
 class SubscriptionCreateSerializer(serializers.ModelSerializer):
     """Serializer which used when a user request to subscribe in specific
@@ -107,9 +117,9 @@ class SubscriptionCreateSerializer(serializers.ModelSerializer):
         peyman_data = self.context['request'].data.pop("peyman_data", None)
         if peyman_data is not None:
 
-            now = datetime.datetime.now()
-            if now.hour == 23 and now.minute >= 45 or now.hour == 0 and now.minute < 30:
-                raise ValidationError("Please try again after 00:30")
+            closes_at = gateway_availability.closes_at()
+            if closes_at is not None:
+                raise ValidationError(_("Please try again after {}").format(closes_at.strftime('%H:%M')))
 
             national_code = self.context['request'].user.profile.national_code
             peyman_data['national_code'] = national_code if national_code is not None else peyman_data['national_code']
@@ -165,20 +175,23 @@ class SubscriptionDetailSerializer(serializers.ModelSerializer):
         fields = ('business', 'tier', 'created_time', 'is_enable', 'message')
 
     def get_message(self, obj):
-        message = obj.business.messages.first()
-        if message is not None:
-            return message.description
-        return ''
+        if not hasattr(self, '_messages'):
+            setattr(self, '_messages', dict())
+        if obj.business_id not in self._messages:
+            message = obj.business.messages.first()
+            self._messages[obj.business_id] = message.description if message is not None else ''
+        return self._messages[obj.business_id]
 
 
 class SubscriberList(serializers.ModelSerializer):
-    """Readonly serializer which calculate and aggregate subscriber data for
-    each business and return to be shown in table"""
+    """Readonly serializer of subscribers table of each business, queryset
+    should be prepared with setup_queryset which annotates the computed
+    columns, so they can be sorted and filtered in database too"""
     fullname = serializers.CharField(source='user.get_full_name')
     tier = serializers.CharField(source='tier.title')
-    total_paid_amount = serializers.SerializerMethodField(source='get_total')
+    total_paid_amount = serializers.IntegerField(read_only=True)
     subscription_date = serializers.DateTimeField(source='created_time')
-    last_paid_date = serializers.SerializerMethodField(source='get_last_paid')
+    last_paid_date = serializers.DateTimeField(read_only=True)
 
     class Meta:
         model = Subscription
@@ -186,21 +199,21 @@ class SubscriberList(serializers.ModelSerializer):
             'fullname', 'tier', 'total_paid_amount', 'subscription_date', 'last_paid_date', 'is_enable', 'is_active'
         )
 
-    def get_total_paid_amount(self, obj):
-        """aggregate total paid amount of current user on this tier"""
-        all_transactions = obj.transactions.filter(is_paid=True).aggregate(
-            total=Coalesce(Sum('transaction__amount'), 0)
+    @staticmethod
+    def setup_queryset(queryset):
+        """Annotate total paid amount, last paid date and created time of the
+        oldest owed transaction of each subscription"""
+        paid_transactions = SubscriptionTransaction.objects.filter(subscription=OuterRef('pk'), is_paid=True)
+        owed_transactions = SubscriptionTransaction.objects.filter(
+            subscription=OuterRef('pk'), status=SubscriptionTransaction.OWED, is_paid=False
+        )
+        return queryset.select_related('user', 'tier').annotate(
+            total_paid_amount=grouped_subquery(paid_transactions, 'subscription', Sum('transaction__amount')),
+            last_paid_date=Subquery(paid_transactions.annotate(
+                paid_at=Coalesce('paid_date', 'modified_time')
+            ).order_by('-paid_at').values('paid_at')[:1]),
+            oldest_owed_time=Subquery(owed_transactions.order_by('created_time').values('created_time')[:1]),
         )
-        return all_transactions['total']
-
-    def get_last_paid_date(self, obj):
-        """find last payment date of current user on this tier"""
-        last_paid = obj.transactions.filter(is_paid=True).last()
-        if last_paid:
-            # TODO: Checkout to paid_date later
-            # return last_paid.paid_date
-            return last_paid.modified_time
-        return None
 
 
 class RegisterUserWithTierSerializer(serializers.Serializer):
@@ -1,3 +1,5 @@
+from django.db.models import Case, When, Value, CharField, BooleanField
+from django.db.models.functions import Coalesce
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
@@ -6,6 +8,7 @@ from django.utils.translation import ugettext_lazy as _
 from business.serializers import TierLightSerializer, SubscriptionPurposeSerializer, TargetLightSerializer, BusinessLightSerializer
 from finance.models import Payment
 from finance.serializers import PaymentInlineSerializer
+from subscription.models import DonorCounter
 from subscription.models.transactions import SubscriptionTransaction, BaseTransaction, TargetTransaction, \
     SubscriptionPeymanTransaction
 from subscription.serializers.subscriptions import SubscriptionDetailSerializer
@@ -53,6 +56,13 @@ class SubscriptionInlineTransactionSerializer(serializers.ModelSerializer):
            'subscription_purpose', 'created_time'
         )
 
+    @staticmethod
+    def setup_queryset(queryset):
+        return queryset.select_related(
+            'transaction__user__profile', 'transaction__payment', 'subscription__business', 'subscription__tier',
+            'subscription_purpose'
+        )
+
     def get_transaction_id(self, obj):
         return obj.id
 
@@ -76,6 +86,12 @@ class SubscriptionInlinePeymanTransactionSerializer(serializers.ModelSerializer)
             'subscription', 'user', 'due_date', 'is_paid', 'paid_date', 'status', 'subscription_purpose', 'created_time'
         )
 
+    @staticmethod
+    def setup_queryset(queryset):
+        return queryset.select_related(
+            'transaction__user__profile', 'subscription__business', 'subscription__tier', 'subscription_purpose'
+        )
+
 
 class SubscriptionTransactionSerializer(serializers.ModelSerializer):
     """
@@ -125,9 +141,22 @@ class BusinessTransactionSerializer(serializers.ModelSerializer):
 
 
 class BusinessAllTransactionsSerializer(serializers.ModelSerializer):
+    """
+    Serialize subscription and direct debit transactions of the business
+    together, it only reads preloaded rows so queryset should select related
+    fields of BusinessAllTransactionsSerializer.related_fields
+    """
+    related_fields = (
+        'user', 'payment',
+        'subscription_transaction__subscription__tier',
+        'subscription_transaction__subscription__subscription_purpose',
+        'subscription_peyman_transaction__subscription__tier',
+        'subscription_peyman_transaction__subscription__subscription_purpose',
+    )
+
     id = serializers.SerializerMethodField()
     fullname = serializers.CharField(source='user.get_full_name')
-    relation_id = serializers.SerializerMethodField()
+    relation_id = serializers.IntegerField(source='user_id')
     tier = serializers.SerializerMethodField()
     subscription_purpose = serializers.SerializerMethodField()
     status = serializers.SerializerMethodField()
@@ -140,48 +169,46 @@ class BusinessAllTransactionsSerializer(serializers.ModelSerializer):
             'created_time', 'transaction_type', 'status', 'owed_payment_link'
         )
 
-    def get_id(self, obj):
+    @staticmethod
+    def get_related(obj):
         if obj.transaction_type == obj.SUBSCRIPTION:
-            return obj.subscription_transaction.id
+            return obj.subscription_transaction
         if obj.transaction_type == obj.DIRECT_DEBIT:
-            return obj.subscription_peyman_transaction.id
+            return obj.subscription_peyman_transaction
+        return None
 
-    def get_status(self, obj):
-        if obj.transaction_type == obj.SUBSCRIPTION:
-            return obj.subscription_transaction.status
-        if obj.transaction_type == obj.DIRECT_DEBIT:
-            return obj.subscription_peyman_transaction.status
+    def get_id(self, obj):
+        related = self.get_related(obj)
+        return related.id if related is not None else None
 
-    def get_relation_id(self, obj):
-        return obj.user.id
+    def get_status(self, obj):
+        related = self.get_related(obj)
+        return related.status if related is not None else None
 
     def get_tier(self, obj):
-        if obj.transaction_type == obj.SUBSCRIPTION:
-            return TierLightSerializer(obj.subscription_transaction.subscription.tier).data
-        if obj.transaction_type == obj.DIRECT_DEBIT:
-            return TierLightSerializer(obj.subscription_peyman_transaction.subscription.tier).data
+        related = self.get_related(obj)
+        if related is None:
+            return None
+        # same tiers are repeated on the page, serialize each of them once
+        if not hasattr(self, '_tiers'):
+            setattr(self, '_tiers', dict())
+        tier = related.subscription.tier
+        if tier.pk not in self._tiers:
+            self._tiers[tier.pk] = TierLightSerializer(tier).data
+        return self._tiers[tier.pk]
 
     def get_subscription_purpose(self, obj):
-        # return obj.related.subscription_purpose if obj.related.subscription_purpose is not None else \
-        #     obj.related.subscription.subscription_purpose
-        if obj.transaction_type == BaseTransaction.SUBSCRIPTION and getattr(obj.subscription_transaction,
-                                                                            'subscription_purpose', None) is not None:
-            return obj.subscription_transaction.subscription.subscription_purpose.title
-
-        if obj.transaction_type == BaseTransaction.DIRECT_DEBIT and getattr(obj.subscription_peyman_transaction,
-                                                                            'subscription_purpose', None) is not None:
-            return obj.subscription_peyman_transaction.subscription.subscription_purpose.title
-
+        related = self.get_related(obj)
+        if related is not None and related.subscription_purpose_id is not None and \
+                related.subscription.subscription_purpose is not None:
+            return related.subscription.subscription_purpose.title
         return None
 
     def get_owed_payment_link(self, obj):
-        if obj.transaction_type == obj.SUBSCRIPTION:
-            if not obj.subscription_transaction.is_paid:
-                return obj.subscription_transaction.transaction.payment.get_instant_link()
-        if obj.transaction_type == obj.DIRECT_DEBIT:
-            if not obj.subscription_peyman_transaction.is_paid:
-                return obj.subscription_peyman_transaction.transaction.payment.get_instant_link()
-        return None
+        related = self.get_related(obj)
+        if related is None or related.is_paid:
+            return None
+        return obj.payment.get_instant_link()
 
 
 class BusinessPeymanTransactionSerializer(serializers.ModelSerializer):
@@ -211,12 +238,18 @@ class BusinessPeymanTransactionSerializer(serializers.ModelSerializer):
         return obj.subscription.user.id
 
 class BaseTransactionSerializer(serializers.ModelSerializer):
+    """
+    Flat serializer of user transactions feed, title, paid status, paid date
+    and direct debit flag are calculated in SQL so the queryset should be
+    prepared with BaseTransactionSerializer.setup_queryset
+    """
     user = serializers.CharField(source='user.username')
-    title = serializers.SerializerMethodField()
+    title = serializers.ReadOnlyField(source='feed_title')
+    is_paid = serializers.ReadOnlyField(source='feed_is_paid')
+    paid_date = serializers.ReadOnlyField(source='feed_paid_date')
     payment = serializers.UUIDField(source='payment.invoice_number')
     subscription_purpose = serializers.SerializerMethodField()
-    paid_date = serializers.SerializerMethodField()
-    direct_debit = serializers.SerializerMethodField()
+    direct_debit = serializers.ReadOnlyField(source='feed_direct_debit')
 
     class Meta:
         model = BaseTransaction
@@ -225,42 +258,45 @@ class BaseTransactionSerializer(serializers.ModelSerializer):
             'direct_debit'
         )
 
-    def get_direct_debit(self, obj):
-        if hasattr(obj, 'subscription_peyman_transaction'):
-            return obj.subscription_peyman_transaction.is_paid
-        return False
-
-    def get_title(self, obj):
-        if hasattr(obj, 'subscription_transaction'):
-            return obj.subscription_transaction.subscription.business.name
-
-        if hasattr(obj, 'subscription_peyman_transaction'):
-            return obj.subscription_peyman_transaction.subscription.business.name
-
-        if hasattr(obj, 'target_transaction'):
-            return obj.target_transaction.target.title
-
-        return ''
+    @staticmethod
+    def setup_queryset(queryset):
+        """Select related rows and annotate flat fields of the serializer"""
+        return queryset.select_related(
+            'user', 'payment', 'subscription_transaction__subscription_purpose',
+            'subscription_peyman_transaction__subscription_purpose',
+        ).annotate(
+            feed_title=Coalesce(
+                'subscription_transaction__subscription__business__name',
+                'subscription_peyman_transaction__subscription__business__name',
+                'target_transaction__target__title', Value(''), output_field=CharField()
+            ),
+            feed_is_paid=Case(
+                When(transaction_type=BaseTransaction.WALLET_CHARGE, then='payment__is_paid'),
+                When(transaction_type=BaseTransaction.TARGET, then='target_transaction__is_paid'),
+                When(transaction_type__in=(BaseTransaction.SUBSCRIPTION, BaseTransaction.INSTANT),
+                     then='subscription_transaction__is_paid'),
+                When(transaction_type=BaseTransaction.DIRECT_DEBIT, then='subscription_peyman_transaction__is_paid'),
+                When(transaction_type=BaseTransaction.SMS_PACKAGE, then='sms_package_transaction__is_paid'),
+                When(transaction_type=BaseTransaction.FOLLOWER_WALLET_CHARGE,
+                     then='follower_wallet_charge_transaction__is_paid'),
+                default=Value(False), output_field=BooleanField()
+            ),
+            feed_paid_date=Coalesce(
+                'subscription_transaction__paid_date', 'subscription_peyman_transaction__paid_date'
+            ),
+            feed_direct_debit=Coalesce(
+                'subscription_peyman_transaction__is_paid', Value(False), output_field=BooleanField()
+            ),
+        )
 
     def get_subscription_purpose(self, obj):
-        if obj.transaction_type == BaseTransaction.SUBSCRIPTION and getattr(obj.subscription_transaction,
-                                                                            'subscription_purpose', None) is not None:
-            return SubscriptionPurposeSerializer(obj.subscription_transaction.subscription_purpose).data
-
-        if obj.transaction_type == BaseTransaction.DIRECT_DEBIT and getattr(obj.subscription_peyman_transaction,
-                                                                            'subscription_purpose', None) is not None:
-            return SubscriptionPurposeSerializer(obj.subscription_peyman_transaction.subscription_purpose).data
-
-        return None
-
-    def get_paid_date(self, obj):
-        if hasattr(obj, 'subscription_transaction'):
-            return obj.subscription_transaction.paid_date
-
-        if hasattr(obj, 'subscription_peyman_transaction'):
-            return obj.subscription_peyman_transaction.paid_date
-
-        return None
+        if obj.transaction_type == BaseTransaction.SUBSCRIPTION:
+            purpose = obj.subscription_transaction.subscription_purpose
+        elif obj.transaction_type == BaseTransaction.DIRECT_DEBIT:
+            purpose = obj.subscription_peyman_transaction.subscription_purpose
+        else:
+            purpose = None
+        return SubscriptionPurposeSerializer(purpose).data if purpose is not None else None
 
 
 class BaseTransactionPanelSerializer(serializers.ModelSerializer):
@@ -362,6 +398,7 @@ class BaseTransactionLightSerializer(serializers.ModelSerializer):
         return TierLightSerializer(obj.related.subscription.tier).data
 
     def get_is_first_donate(self, obj):
-        count = SubscriptionTransaction.objects.select_related('transaction')\
-                   .filter(transaction__user=obj.user, is_paid=True).count()
+        count = getattr(obj, 'user_paid_count', None)
+        if count is None:
+            count = DonorCounter.paid_count_of(obj.user_id)
         return count == 1
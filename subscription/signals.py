@@ -1,10 +1,16 @@
-from django.db.models.signals import post_save, pre_save
+from django.db import transaction as db_transaction
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
 
+from business.models import Target
 from finance.models import Payment
-from subscription.models import Subscription, BaseTransaction, Relation
-from subscription.models.transactions import SubscriptionTransaction, TargetTransaction, SMSPackageTransaction
+from subscription.models import Subscription, BaseTransaction, Relation, WalletEntry, BusinessDailyIncome, \
+    DonorCounter
+from subscription.models.transactions import SubscriptionTransaction, TargetTransaction, SMSPackageTransaction, \
+    SubscriptionPeymanTransaction
+from subscription.reports import invalidate_business_reports
+from utils.time import get_jalali_billing_period
 
 
 @receiver(post_save, sender=Subscription)
@@ -30,7 +36,8 @@ def set_first_transaction(sender, instance, created, **kwargs):
 
     transaction = BaseTransaction(user=instance.user, amount=instance.tier.amount)
     subscription = SubscriptionTransaction(
-        subscription=instance, due_date=timezone.now(), subscription_purpose=instance.subscription_purpose
+        subscription=instance, due_date=timezone.now(), subscription_purpose=instance.subscription_purpose,
+        billing_period=get_jalali_billing_period(timezone.now())
     )
 
     wallet = BaseTransaction.wallet(instance.user)
@@ -60,6 +67,64 @@ def set_first_transaction(sender, instance, created, **kwargs):
         payment.save()
 
 
+@receiver(post_save, sender=SubscriptionTransaction)
+def post_subscription_transaction_to_wallet(sender, instance, created, **kwargs):
+    """Paid subscription transactions are settled from the wallet, keep the
+    wallet ledger in sync when one is created or its paid status changes"""
+    if instance.status_changed() or (created and instance.is_paid):
+        WalletEntry.sync(instance.transaction, WalletEntry.SUBSCRIPTION_TRANSACTION, instance.is_paid)
+
+
+@receiver(post_save, sender=SMSPackageTransaction)
+def post_sms_package_transaction_to_wallet(sender, instance, created, **kwargs):
+    """SMS packages are bought from the wallet, same as subscriptions"""
+    if instance.status_changed() or (created and instance.is_paid):
+        WalletEntry.sync(instance.transaction, WalletEntry.SMS_PACKAGE_TRANSACTION, instance.is_paid)
+
+
+@receiver(post_save, sender=SubscriptionTransaction)
+@receiver(post_save, sender=SubscriptionPeymanTransaction)
+@receiver(post_save, sender=TargetTransaction)
+def post_paid_transaction_to_income(sender, instance, created, **kwargs):
+    """Add paid transactions to the BusinessDailyIncome rollup and take back
+    reverted ones, the posted state is kept on the instance so saving it again
+    does not count it twice"""
+    posted = getattr(instance, '_b_income_paid', False if created else instance._b_is_paid)
+    if instance.is_paid != posted:
+        BusinessDailyIncome.add([BusinessDailyIncome.row_of(instance, 1 if instance.is_paid else -1)])
+        instance._b_income_paid = instance.is_paid
+
+
+@receiver(post_save, sender=SubscriptionTransaction)
+def count_donor_paid_transactions(sender, instance, created, **kwargs):
+    """Keep DonorCounter of the subscriber in sync with paid subscription
+    transactions, the counted state is kept on the instance same as income"""
+    counted = getattr(instance, '_b_donor_paid', False if created else instance._b_is_paid)
+    if instance.is_paid != counted:
+        DonorCounter.add([(instance.transaction.user_id, instance.pk, 1 if instance.is_paid else -1)])
+        instance._b_donor_paid = instance.is_paid
+
+
+@receiver(post_save, sender=SubscriptionTransaction)
+def invalidate_business_report(sender, instance, created, **kwargs):
+    """Owed amount of the business transactions report is changed by new
+    transactions, paid ones are invalidated by the income rollup"""
+    if created and not instance.is_paid:
+        business_ids = [instance.subscription.business_id]
+        db_transaction.on_commit(lambda: invalidate_business_reports(business_ids))
+
+
+@receiver(post_save, sender=Target)
+@receiver(post_delete, sender=Target)
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_business_report_of_owner(sender, instance, **kwargs):
+    """Projects count and subscriptions of the business transactions report
+    are changed by targets and subscriptions of the business"""
+    business_ids = [instance.business_id]
+    db_transaction.on_commit(lambda: invalidate_business_reports(business_ids))
+
+
 @receiver(post_save, sender=SubscriptionTransaction)
 def notify_user(sender, instance, created, **kwargs):
     """Decide what to do when a SubscriptionTransaction is creating or editing
@@ -1,10 +1,28 @@
-from django.test import TestCase
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
 
 from business.models import Business, Tier
-from finance.models import Payment
-from subscription.models import Subscription, Relation, BaseTransaction
+from finance.gateways import gateway_registry
+from finance.models import Payment, Gateway
+from lib.paginations import DonorHistoryPagination
+from subscription.jobs import run_chunked
+from subscription.models import Subscription, Relation, BaseTransaction, BusinessDailyIncome, DonorCounter, \
+    WalletBalance, WalletEntry, JobRun, JobChunk
 from subscription.models.transactions import SubscriptionTransaction
+from subscription.reports import business_transactions_report, get_business_transactions_report, \
+    invalidate_business_reports, BUSINESS_REPORT_CACHE_KEY
+from subscription.notifications import SubscriptionNotificationBuilder
+from subscription.reminders import LateReminderEngine
 from subscription.tasks import charge_subscription
+from subscription.views.relation import followers_list, RelationProtectedViewSet
+from subscription.views.subscriptions import SubscriptionTableListAPIView
+from subscription.views.transactions import DonorsTransactionListAPIViewV3, TransactionsListAPIView
 from user.models import User
 
 
@@ -16,6 +34,9 @@ class SubscriptionTestCase(TestCase):
         self.business = Business.objects.first()
         self.tier = Tier.objects.first()
         self.subscription = Subscription.objects.create(user=self.user, business=self.business, tier=self.tier)
+        # first transaction of the subscription is created in current billing period
+        self.next_month = timezone.now() + timedelta(days=32)
+        gateway_registry.invalidate()
 
     def test_subscription_process(self):
         self.assertFalse(self.subscription.is_enable, 'Subscription should not be enabled by default')
@@ -34,7 +55,7 @@ class SubscriptionTestCase(TestCase):
         self.assertEqual(BaseTransaction.wallet(self.user), self.tier.amount*6, "Wallet not charged yet")
         self.subscription.is_enable = True
         self.subscription.save()
-        result, message = charge_subscription(self.subscription.id)
+        result, message = charge_subscription(self.subscription.id, date=self.next_month)
         self.assertTrue(result, "Subscription charge was not successful, error: {}".format(message))
         self.assertEqual(self.subscription.transactions.filter(is_paid=True).count(), 1, "More than 1 transaction did for subscription")
         self.assertEqual(BaseTransaction.wallet(self.user), self.tier.amount*5, "User Charge wallet is not working in right way")
@@ -46,7 +67,7 @@ class SubscriptionTestCase(TestCase):
         self.subscription.is_enable = True
         self.subscription.save()
         self.assertEqual(self.subscription.transactions.count(), 1, 'More than 1 transaction did to current subscription')
-        result, message = charge_subscription(self.subscription.id)
+        result, message = charge_subscription(self.subscription.id, date=self.next_month)
         subscription_transaction = self.subscription.transactions.last()
         self.assertEqual(subscription_transaction.status, SubscriptionTransaction.OWED, "Created transaction status is not correct")
         self.assertFalse(subscription_transaction.is_paid, "Created transaction is paid !!")
@@ -59,3 +80,309 @@ class SubscriptionTestCase(TestCase):
         self.assertEqual(BaseTransaction.wallet(self.user), self.tier.amount * 5, 'User wallet amount is not correct')
         self.assertEqual(subscription_transaction.status, SubscriptionTransaction.PAID, "Owed transaction status not changed")
         self.assertTrue(subscription_transaction.is_paid, "Created transaction is paid !!")
+
+    def test_wallet_ledger(self):
+        self.assertEqual(BaseTransaction.wallet(self.user), BaseTransaction.calculate_wallet(self.user))
+        transaction = BaseTransaction.objects.create(user=self.user, transaction_type=5, amount=self.tier.amount * 2)
+        payment = Payment.objects.create(user=transaction.user, amount=transaction.amount, transaction=transaction)
+        payment.is_paid = True
+        payment.save()
+        payment.save()
+        self.assertEqual(BaseTransaction.wallet(self.user), self.tier.amount * 2, "Wallet is charged more than once")
+        payment.is_paid = False
+        payment.save()
+        self.assertEqual(BaseTransaction.wallet(self.user), BaseTransaction.calculate_wallet(self.user),
+                         "Wallet ledger is not synced with transactions history")
+
+    def test_wallet_opened_from_history(self):
+        transaction = BaseTransaction.objects.create(user=self.user, transaction_type=5, amount=self.tier.amount * 2)
+        Payment.objects.create(user=self.user, amount=transaction.amount, transaction=transaction, is_paid=True)
+        # wallet of a user which is charged before the ledger
+        WalletEntry.private_manager.all().delete()
+        WalletBalance.private_manager.all().delete()
+        self.assertEqual(BaseTransaction.wallet(self.user), self.tier.amount * 2, "Legacy wallet is not read")
+        transaction = BaseTransaction.objects.create(user=self.user, transaction_type=5, amount=self.tier.amount)
+        Payment.objects.create(user=self.user, amount=transaction.amount, transaction=transaction, is_paid=True)
+        self.assertEqual(WalletBalance.objects.get(user=self.user).balance, self.tier.amount * 3,
+                         "Legacy wallet value is lost when the wallet is opened")
+        self.assertEqual(BaseTransaction.wallet(self.user), BaseTransaction.calculate_wallet(self.user))
+
+    def test_owed_settlement_prefix(self):
+        self.subscription.is_enable = True
+        self.subscription.save()
+        for _ in range(3):
+            base_transaction = BaseTransaction.objects.create(
+                user=self.user, amount=self.tier.amount, transaction_type=BaseTransaction.SUBSCRIPTION
+            )
+            SubscriptionTransaction.objects.create(
+                transaction=base_transaction, subscription=self.subscription, due_date=timezone.now(),
+                is_paid=False, status=SubscriptionTransaction.OWED
+            )
+        transaction = BaseTransaction.objects.create(user=self.user, transaction_type=5, amount=self.tier.amount * 2)
+        Payment.objects.create(user=self.user, amount=transaction.amount, transaction=transaction, is_paid=True)
+        paid_ids = SubscriptionTransaction.settle_owed(self.user)
+        self.assertEqual(len(paid_ids), 2, "Settled transactions are not the covered prefix")
+        self.assertEqual(BaseTransaction.wallet(self.user), 0, "Settled transactions are not posted to the wallet")
+
+    def test_charge_once_per_billing_period(self):
+        self.subscription.is_enable = True
+        self.subscription.save()
+        result, message = charge_subscription(self.subscription.id)
+        self.assertFalse(result, "Subscription is charged twice in the first billing period")
+        result, message = charge_subscription(self.subscription.id, date=self.next_month)
+        self.assertTrue(result, "Subscription charge was not successful, error: {}".format(message))
+        result, message = charge_subscription(self.subscription.id, date=self.next_month)
+        self.assertFalse(result, "Subscription is charged twice in the same billing period")
+        self.assertEqual(self.subscription.transactions.count(), 2, "Duplicate subscription transaction is created")
+
+    def test_daily_income_rollup(self):
+        self.subscription.is_enable = True
+        self.subscription.save()
+        transaction = BaseTransaction.objects.create(user=self.user, transaction_type=5, amount=self.tier.amount)
+        Payment.objects.create(user=self.user, amount=transaction.amount, transaction=transaction, is_paid=True)
+        charge_subscription(self.subscription.id, date=self.next_month)
+        subscription_transaction = self.subscription.transactions.get(is_paid=True)
+        subscription_transaction.save()
+        incomes = BusinessDailyIncome.objects.filter(business=self.business, kind=BusinessDailyIncome.SUBSCRIPTION)
+        self.assertEqual(sum(incomes.values_list('amount', flat=True)), self.tier.amount, "Income is not rolled up once")
+
+    def test_donor_counter(self):
+        self.subscription.is_enable = True
+        self.subscription.save()
+        transaction = BaseTransaction.objects.create(user=self.user, transaction_type=5, amount=self.tier.amount)
+        Payment.objects.create(user=self.user, amount=transaction.amount, transaction=transaction, is_paid=True)
+        charge_subscription(self.subscription.id, date=self.next_month)
+        subscription_transaction = self.subscription.transactions.get(is_paid=True)
+        subscription_transaction.save()
+        counter = DonorCounter.objects.get(user=self.user)
+        self.assertEqual(counter.paid_count, 1, "Paid transaction is not counted once")
+        self.assertEqual(counter.first_transaction_id, subscription_transaction.pk)
+        subscription_transaction.is_paid = False
+        subscription_transaction.save()
+        self.assertEqual(DonorCounter.paid_count_of(self.user), 0, "Reverted transaction is not uncounted")
+
+    def test_donor_counter_out_of_order(self):
+        owed = list()
+        for _ in range(2):
+            base_transaction = BaseTransaction.objects.create(
+                user=self.user, amount=self.tier.amount, transaction_type=BaseTransaction.SUBSCRIPTION
+            )
+            owed.append(SubscriptionTransaction.objects.create(
+                transaction=base_transaction, subscription=self.subscription, due_date=timezone.now(),
+                is_paid=False, status=SubscriptionTransaction.OWED
+            ))
+        for subscription_transaction in reversed(owed):
+            subscription_transaction.is_paid = True
+            subscription_transaction.save()
+        counter = DonorCounter.objects.get(user=self.user)
+        self.assertEqual(counter.first_transaction_id, owed[0].pk, "Older paid transaction is not the first one")
+        owed[0].is_paid = False
+        owed[0].save()
+        counter.refresh_from_db()
+        self.assertEqual((counter.paid_count, counter.first_transaction_id), (1, owed[1].pk))
+
+    def test_chunked_run_resumes(self):
+        transactions = [
+            BaseTransaction.objects.create(user=self.user, transaction_type=5, amount=self.tier.amount)
+            for _ in range(5)
+        ]
+        queryset = BaseTransaction.objects.filter(pk__in=[transaction.pk for transaction in transactions])
+        processed = list()
+
+        def failing_handler(chunk):
+            if processed:
+                raise RuntimeError('second chunk failed')
+            processed.extend(row.pk for row in chunk)
+
+        with self.assertRaises(RuntimeError):
+            run_chunked('test_job', 'key', queryset, failing_handler, chunk_size=2)
+        run = JobRun.objects.get(name='test_job', run_key='key')
+        self.assertEqual((run.status, run.processed, run.checkpoint), (JobRun.FAILED, 2, transactions[1].pk))
+
+        processed = list()
+        run = run_chunked('test_job', 'key', queryset, lambda chunk: processed.extend(row.pk for row in chunk), 2)
+        self.assertEqual(processed, [transaction.pk for transaction in transactions[2:]], "Committed chunk is redone")
+        self.assertEqual((run.status, run.processed, run.checkpoint), (JobRun.DONE, 5, transactions[-1].pk))
+        self.assertEqual(JobChunk.objects.filter(run=run).count(), 3)
+
+        processed = list()
+        run_chunked('test_job', 'key', queryset, lambda chunk: processed.extend(row.pk for row in chunk), 2)
+        self.assertEqual(processed, list(), "Done run is processed again")
+
+    def test_business_transactions_report(self):
+        invalidate_business_reports([self.business.pk])
+        with self.assertNumQueries(2):
+            report = business_transactions_report(self.business)
+        self.assertEqual(get_business_transactions_report(self.business), report, "Report is not cached")
+        with self.assertNumQueries(0):
+            get_business_transactions_report(self.business)
+
+    def test_business_all_transactions_queries(self):
+        Gateway.objects.create(title='test', gateway_code=Gateway.FUNCTION_ZARRINPAL)
+        for i in range(6):
+            base_transaction = BaseTransaction.objects.create(
+                user=self.user, amount=self.tier.amount, transaction_type=BaseTransaction.SUBSCRIPTION
+            )
+            SubscriptionTransaction.objects.create(
+                transaction=base_transaction, subscription=self.subscription, due_date=timezone.now(),
+                is_paid=bool(i % 2), status=SubscriptionTransaction.PAID if i % 2 else SubscriptionTransaction.OWED
+            )
+            Payment.objects.create(user=self.user, amount=base_transaction.amount, transaction=base_transaction)
+        view = DonorsTransactionListAPIViewV3.as_view()
+        query_counts = list()
+        for limit in (2, 6):
+            request = APIRequestFactory().get('/', {'limit': limit})
+            force_authenticate(request, user=self.business.user)
+            with CaptureQueriesContext(connection) as queries:
+                response = view(request)
+            self.assertEqual(len(response.data['results']), limit, "Transactions of the business are not listed")
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1], "Query count depends on the page size")
+
+    def test_transactions_feed_queries(self):
+        for i in range(3):
+            transaction = BaseTransaction.objects.create(user=self.user, transaction_type=5, amount=self.tier.amount)
+            Payment.objects.create(user=self.user, amount=transaction.amount, transaction=transaction, is_paid=True)
+            base_transaction = BaseTransaction.objects.create(
+                user=self.user, amount=self.tier.amount, transaction_type=BaseTransaction.SUBSCRIPTION
+            )
+            SubscriptionTransaction.objects.create(
+                transaction=base_transaction, subscription=self.subscription, due_date=timezone.now(),
+                is_paid=True, status=SubscriptionTransaction.PAID, paid_date=timezone.now()
+            )
+        view = TransactionsListAPIView.as_view()
+        query_counts = list()
+        for limit in (2, 6):
+            request = APIRequestFactory().get('/', {'limit': limit})
+            force_authenticate(request, user=self.user)
+            with CaptureQueriesContext(connection) as queries:
+                response = view(request)
+            self.assertEqual(len(response.data['results']), limit, "Transactions of the user are not listed")
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1], "Query count depends on the page size")
+        self.assertEqual(response.data['results'][0]['title'], self.business.name, "Transaction title is not correct")
+
+    def test_followers_list_queries(self):
+        for i in range(4):
+            user = User.objects.create(username='follower{}'.format(i), phone_number=989120000000 + i,
+                                       date_joined=timezone.now())
+            subscription = Subscription.objects.create(user=user, business=self.business, tier=self.tier)
+            subscription.is_enable = True
+            subscription.save()
+        query_counts = list()
+        for limit in (2, 4):
+            request = APIRequestFactory().get('/', {'limit': limit, 'ordering': '-total_paid'})
+            force_authenticate(request, user=self.business.user)
+            with CaptureQueriesContext(connection) as queries:
+                response = followers_list(request)
+            self.assertEqual(len(response.data['results']), limit, "Followers of the business are not listed")
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1], "Query count depends on the page size")
+        self.assertTrue(response.data['results'][0]['is_enable'], "Active subscription is not annotated")
+
+    def test_donor_profile_queries(self):
+        Gateway.objects.create(title='test', gateway_code=Gateway.FUNCTION_ZARRINPAL)
+        view = RelationProtectedViewSet.as_view({'get': 'retrieve'})
+        query_counts = list()
+        for months in (2, DonorHistoryPagination.page_size + 2):
+            for i in range(months - self.subscription.transactions.count()):
+                base_transaction = BaseTransaction.objects.create(
+                    user=self.user, amount=self.tier.amount, transaction_type=BaseTransaction.SUBSCRIPTION
+                )
+                SubscriptionTransaction.objects.create(
+                    transaction=base_transaction, subscription=self.subscription, due_date=timezone.now(),
+                    status=SubscriptionTransaction.OWED
+                )
+                Payment.objects.create(user=self.user, amount=base_transaction.amount, transaction=base_transaction)
+            request = APIRequestFactory().get('/')
+            force_authenticate(request, user=self.business.user)
+            with CaptureQueriesContext(connection) as queries:
+                response = view(request, slug=self.business.url_path, pk=self.user.pk)
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1], "Query count depends on the donor history")
+        self.assertEqual(
+            len(response.data['subscription_transactions']), DonorHistoryPagination.page_size,
+            "Donor history is not bounded"
+        )
+        owed = SubscriptionTransaction.objects.filter(
+            subscription=self.subscription, status=SubscriptionTransaction.OWED
+        ).values_list('transaction__amount', flat=True)
+        self.assertEqual(response.data['total_owed'], sum(owed), "Total owed is not the sum of owed transactions")
+
+    def test_subscribers_table_queries(self):
+        for i in range(4):
+            user = User.objects.create(username='subscriber{}'.format(i), phone_number=989130000000 + i,
+                                       date_joined=timezone.now())
+            subscription = Subscription.objects.create(user=user, business=self.business, tier=self.tier)
+            subscription.is_enable = True
+            subscription.save()
+        view = SubscriptionTableListAPIView.as_view()
+        query_counts = list()
+        for limit in (2, 4):
+            request = APIRequestFactory().get('/', {'limit': limit, 'ordering': '-total_paid_amount'})
+            force_authenticate(request, user=self.business.user)
+            with CaptureQueriesContext(connection) as queries:
+                response = view(request)
+            self.assertEqual(len(response.data['results']), limit, "Subscribers of the business are not listed")
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1], "Query count depends on the page size")
+        self.assertTrue(response.data['results'][0]['is_active'], "New owed transaction made subscription inactive")
+
+    def test_notification_builder(self):
+        subscriptions = [self.subscription]
+        for i in range(2):
+            user = User.objects.create(username='notified{}'.format(i), phone_number=989130000100 + i,
+                                       date_joined=timezone.now())
+            subscriptions.append(Subscription.objects.create(user=user, business=self.business, tier=self.tier))
+        builder = SubscriptionNotificationBuilder(with_text=True)
+        with self.assertNumQueries(1):
+            payloads = builder.build(
+                [(subscription.pk, 'greeting') for subscription in subscriptions] + [(0, 'greeting')]
+            )
+        self.assertEqual(len(payloads), 3, "Unknown subscription is not skipped")
+        self.assertEqual(payloads[0]['tokens']['token'], self.tier.amount)
+        self.assertEqual(payloads[0]['tokens']['token20'], self.business.name)
+        self.assertIn(self.business.name, payloads[0]['text'])
+
+    def test_late_reminders(self):
+        other = User.objects.create(username='late', phone_number=989130000200, date_joined=timezone.now())
+        other_subscription = Subscription.objects.create(user=other, business=self.business, tier=self.tier)
+        second_subscription = Subscription.objects.create(user=self.user, business=self.business, tier=self.tier)
+        for subscription, days in ((self.subscription, 3), (second_subscription, 3), (self.subscription, 5),
+                                   (other_subscription, 7)):
+            base_transaction = BaseTransaction.objects.create(
+                user=subscription.user, amount=self.tier.amount, transaction_type=BaseTransaction.SUBSCRIPTION
+            )
+            SubscriptionTransaction.objects.create(
+                transaction=base_transaction, subscription=subscription, is_paid=False,
+                due_date=timezone.now() - timedelta(days=days), status=SubscriptionTransaction.OWED
+            )
+        engine = LateReminderEngine(days=(3, 7))
+        report = engine.run()
+        self.assertEqual((report['users'], report['transactions']), (2, 3))
+        reminded = engine.get_transactions()
+        self.assertEqual(Payment.objects.filter(transaction__subscription_transaction__in=reminded).count(), 3)
+        self.assertEqual(
+            LateReminderEngine(days=(3, 7)).run()['users'], 0, "Users are reminded twice in one day"
+        )
+
+
+class BusinessReportInvalidationTestCase(TransactionTestCase):
+    """Reports are invalidated after commit, so changes are committed here"""
+    fixtures = ['fixtures/business.json']
+
+    def test_subscription_changes(self):
+        business = Business.objects.first()
+        key = BUSINESS_REPORT_CACHE_KEY.format(business.pk)
+        get_business_transactions_report(business)
+        subscription = Subscription.objects.create(
+            user=User.objects.first(), business=business, tier=Tier.objects.first()
+        )
+        self.assertIsNone(cache.get(key), "Report is not invalidated by new subscription")
+        get_business_transactions_report(business)
+        subscription.is_enable = True
+        subscription.save()
+        self.assertIsNone(cache.get(key), "Report is not invalidated by enabled subscription")
+        get_business_transactions_report(business)
+        subscription.delete()
+        self.assertIsNone(cache.get(key), "Report is not invalidated by deleted subscription")
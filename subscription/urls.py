@@ -27,6 +27,8 @@ urlpatterns = [
     url(r'transactions/target/table/$', TargetTransactionListAPIView.as_view(), name='target-transactions'),
     url(r'relation/(?P<slug>.*)/follow/$', RelationProtectedViewSet.as_view({'post': 'create'}, name='follow')),
     url(r'relation/(?P<slug>.*)/unfollow/$', RelationProtectedViewSet.as_view({'delete': 'destroy'}, name='unfollow')),
+    url(r'relation/(?P<slug>.*)/(?P<pk>[0-9]+)/transactions/$', RelationProtectedViewSet.as_view({'get': 'subscription_transactions'}, name='donor-transactions')),
+    url(r'relation/(?P<slug>.*)/(?P<pk>[0-9]+)/direct-debit-transactions/$', RelationProtectedViewSet.as_view({'get': 'direct_debit_transactions'}, name='donor-direct-debit-transactions')),
     url(r'relation/(?P<slug>.*)/(?P<pk>[0-9].*)/$', RelationProtectedViewSet.as_view({'get': 'retrieve', 'patch': 'update'}, name='detail')),
     url(r'relation/(?P<slug>.*)/count/$', RelationNonProtectedViewSet.as_view({'get': 'count'}, name='followers-count')),
     url(r'discount/(?P<pk>[0-9].*)/$', DiscountCodeGeneratorAPIView.as_view(), name='discount-generator'),
@@ -11,11 +11,13 @@ from rest_framework.viewsets import GenericViewSet
 from rest_framework_jwt.authentication import JSONWebTokenAuthentication
 
 from business.models import Business
-from lib.paginations import PublicBusinessPagination
+from lib.paginations import PublicBusinessPagination, DonorHistoryPagination
 from subscription.filters import RelationFilter
 from subscription.models import Subscription
 from subscription.serializers.relation import RelationCreateSerializer, \
     FollowerListSerializer, RelationDetailSerializer
+from subscription.serializers.transactions import SubscriptionInlineTransactionSerializer, \
+    SubscriptionInlinePeymanTransactionSerializer
 from utils.filters import PersianFilterBackend
 
 User = get_user_model()
@@ -32,12 +34,24 @@ class RelationProtectedViewSet(
     pagination_class = PublicBusinessPagination
     filter_backends = (filters.OrderingFilter, DjangoFilterBackend, PersianFilterBackend,)
     filter_class = RelationFilter
-    ordering_fields = ('follower__last_name', 'follower__phone_number', 'created_time')
+    ordering_fields = ('follower__last_name', 'follower__phone_number', 'created_time', 'total_paid')
     search_fields = ('follower__last_name', 'follower__first_name')
 
+    donor_actions = ('retrieve', 'update', 'subscription_transactions', 'direct_debit_transactions')
+
+    @property
+    def business(self):
+        """Business of the panel, it is resolved once per request"""
+        if not hasattr(self, '_business'):
+            setattr(self, '_business', self.request.user.business)
+        return self._business
+
     def get_queryset(self):
-        business = self.request.user.business
-        return business.followers.all().order_by('-created_time')
+        business = self.business
+        queryset = business.followers.all().order_by('-created_time')
+        if self.action == 'list':
+            queryset = FollowerListSerializer.setup_queryset(queryset, business)
+        return queryset
 
     def get_serializer_class(self):
         if self.action == 'retrieve':
@@ -48,11 +62,16 @@ class RelationProtectedViewSet(
         context = super(RelationProtectedViewSet, self).get_serializer_context()
         if self.kwargs.get('slug'):
             context.update({'slug': self.kwargs['slug']})
+        if self.action in self.donor_actions:
+            context.update({'business': self.business})
         return context
 
     def get_object(self):
         filter_kwargs = {self.lookup_field: self.kwargs['pk']}
-        obj = get_object_or_404(User.objects.all(), **filter_kwargs)
+        queryset = User.objects.all()
+        if self.action in ('retrieve', 'update'):
+            queryset = RelationDetailSerializer.setup_queryset(queryset, self.business)
+        obj = get_object_or_404(queryset, **filter_kwargs)
         return obj
 
     def get_business(self):
@@ -60,6 +79,12 @@ class RelationProtectedViewSet(
         business = get_object_or_404(Business.objects.all(), **filter_kwargs)
         return business
 
+    def get_history_response(self, queryset, serializer_class):
+        paginator = DonorHistoryPagination()
+        page = paginator.paginate_queryset(queryset, self.request, view=self)
+        serializer = serializer_class(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
     def create(self, request, *args, **kwargs):
         serializer = RelationCreateSerializer(
             data={'following': self.kwargs['slug'], 'follower': request.user.pk}, context=self.get_serializer_context()
@@ -71,11 +96,10 @@ class RelationProtectedViewSet(
 
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
-        business = self.get_business()
-        relation = instance.followings.get(following=business)
+        relation = get_object_or_404(instance.followings.all(), following=self.business)
         relation.description = request.data.get('description', '')
         relation.save()
-        serializer = RelationDetailSerializer(instance, context={'slug': self.kwargs['slug']})
+        serializer = RelationDetailSerializer(self.get_object(), context=self.get_serializer_context())
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_200_OK, headers=headers)
 
@@ -90,10 +114,20 @@ class RelationProtectedViewSet(
             instance.set_delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(methods=['get'], detail=True, url_path='transactions')
+    def subscription_transactions(self, request, *args, **kwargs):
+        queryset = RelationDetailSerializer.subscription_transactions_of(self.kwargs['pk'], self.business)
+        return self.get_history_response(queryset, SubscriptionInlineTransactionSerializer)
+
+    @action(methods=['get'], detail=True, url_path='direct-debit-transactions')
+    def direct_debit_transactions(self, request, *args, **kwargs):
+        queryset = RelationDetailSerializer.direct_debit_transactions_of(self.kwargs['pk'], self.business)
+        return self.get_history_response(queryset, SubscriptionInlinePeymanTransactionSerializer)
+
     @action(methods=['get'], detail=False, url_path='report')
     def report(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
-        subscriptions = Subscription.objects.filter(business=request.user.business, is_enable=True)
+        subscriptions = Subscription.objects.filter(business=self.business, is_enable=True)
         data = dict(
             total_users=queryset.count(), total_followers=queryset.count(), subscribe_rate=0,
             total_subscribers=subscriptions.values('user').annotate(Count('user_id')).count(),
@@ -4,7 +4,8 @@ from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from django.http import Http404
 from django.shortcuts import redirect
-from rest_framework import status
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import status, filters
 from rest_framework.authentication import SessionAuthentication
 from rest_framework.generics import ListAPIView, ListCreateAPIView, get_object_or_404, CreateAPIView
 from rest_framework.permissions import IsAuthenticated
@@ -14,13 +15,13 @@ from rest_framework_jwt.authentication import JSONWebTokenAuthentication
 
 from lib.paginations import PublicBusinessPagination
 from lib.query_handler import generate_date_cases
+from subscription.filters import SubscriberFilter
 from subscription.models import Subscription, BaseTransaction
 from subscription.models.transactions import TargetTransaction
 from subscription.serializers import SubscriptionCreateSerializer
 from subscription.serializers.subscriptions import SubscriptionListSerializer, SubscriberList, \
     RegisterUserWithTierSerializer
 from subscription.serializers.transactions import TargetTransactionCreateSerializer
-from subscription.tasks import send_register_user_by_business_sms
 from user.models import User
 from user.serializers import UserLightSerializer
 from business.models import SubscriptionInvite
@@ -29,9 +30,10 @@ from business.permissions import HasBusiness
 
 from finance.utils.zarinpal import zpal_request_handler
 from finance.models import Gateway
+from messenger.models import SMSOutbox
 
 from utils.encoder import IDEncoder
-from utils.links import make_short
+from utils.links import make_short, display_link
 
 import requests
 
@@ -110,9 +112,15 @@ class SubscriptionTableListAPIView(ListAPIView):
     authentication_classes = (JSONWebTokenAuthentication, SessionAuthentication)
     serializer_class = SubscriberList
     pagination_class = PublicBusinessPagination
+    filter_backends = (filters.OrderingFilter, DjangoFilterBackend)
+    filter_class = SubscriberFilter
+    ordering_fields = ('created_time', 'total_paid_amount', 'last_paid_date', 'oldest_owed_time')
+    ordering = ('-created_time',)
 
     def get_queryset(self):
-        return Subscription.objects.filter(business=self.request.user.business, is_enable=True)
+        return SubscriberList.setup_queryset(
+            Subscription.objects.filter(business=self.request.user.business, is_enable=True)
+        )
 
 
 class TargetTransactionAPIView(ListCreateAPIView):
@@ -171,14 +179,14 @@ class RegisterUserWithTierCreateAPIView(CreateAPIView):
         serializer = RegisterUserWithTierSerializer(context={"request": request})
         data = serializer.create(request.data)
 
-        link = make_short(data.transactions.first().transaction.payment.get_instant_link())[8:]
+        link = display_link(make_short(data.transactions.first().transaction.payment.get_instant_link()))
         phone = data.transactions.first().transaction.user.phone_number
 
         params = {
             "token": data.transactions.first().transaction.user.first_name,
             "token2": data.tier.title,
-            "token3": link[8:],
+            "token3": link,
         }
 
-        send_register_user_by_business_sms.delay(phone, params)
+        SMSOutbox.enqueue([SMSOutbox.template_message(phone, "hamsooRegisterBySms", params)])
         return Response({"pay_link": link})
@@ -1,6 +1,4 @@
-from django.db.models import Sum, Count, Q, Case, When, F, OuterRef, Subquery
-from django.db.models.functions import Coalesce
-from django.utils import timezone
+from django.db.models import Sum, Q, F
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
 from rest_framework.authentication import SessionAuthentication
@@ -11,18 +9,17 @@ from rest_framework.views import APIView
 from rest_framework_jwt.authentication import JSONWebTokenAuthentication
 
 from lib.paginations import TransactionPagination
-from lib.query_handler import generate_date_cases
+from lib.date_mapper import jalali_date_mapper
 from subscription.filters import SubscriptionTransactionFilter, TargetTransactionFilter, \
     SubscriptionPeymanTransactionFilter, BaseTransactionFilter
-from business.models import Business, Target
-from subscription.models import BaseTransaction, Subscription
+from subscription.models import BaseTransaction, BusinessDailyIncome
 from subscription.models.transactions import TargetTransaction, SubscriptionPeymanTransaction
 from subscription.models.transactions import SubscriptionTransaction
+from subscription.reports import get_business_transactions_report
 from subscription.serializers.transactions import BaseTransactionSerializer, BusinessTransactionSerializer, \
     TargetTransactionListSerializer, BaseTransactionPanelSerializer, BusinessPeymanTransactionSerializer, \
     BusinessAllTransactionsSerializer
 from utils.filters import PersianFilterBackend
-from utils.time import get_start_day_of_month
 
 
 class TransactionsListAPIView(ListAPIView):
@@ -31,9 +28,7 @@ class TransactionsListAPIView(ListAPIView):
     authentication_classes = (JSONWebTokenAuthentication, SessionAuthentication)
     pagination_class = TransactionPagination
     serializer_class = BaseTransactionSerializer
-    queryset = BaseTransaction.objects.select_related(
-        'target_transaction', 'subscription_transaction', 'payment',  'subscription_peyman_transaction'
-    ).all().order_by('-id')
+    queryset = BaseTransactionSerializer.setup_queryset(BaseTransaction.objects.all()).order_by('-id')
     filter_backends = (filters.OrderingFilter,)
     ordering_fields = ('amount', 'transaction_type', 'created_time')
 
@@ -97,7 +92,7 @@ class DonorsTransactionListAPIViewV3(ListAPIView):
         subscription_invoices = Q(transaction_type=15, subscription_transaction__status__in=[5, 10])
         peyman_subscription_invoices = Q(transaction_type=25, subscription_peyman_transaction__status__in=[10, 20])
 
-        return BaseTransaction.objects.select_related('subscription_peyman_transaction', 'subscription_transaction')\
+        return BaseTransaction.objects.select_related(*BusinessAllTransactionsSerializer.related_fields)\
             .filter(
             Q(subscription_peyman_transaction__subscription__business=self.request.user.business) |
             Q(subscription_transaction__subscription__business=self.request.user.business)
@@ -112,58 +107,28 @@ class DonorsTransactionReportAPIView(APIView):
     pagination_class = TransactionPagination
 
     def get(self, request, *args, **kwargs):
-        # all_transacion
-        start_day_of_month = get_start_day_of_month(timezone.now())
-        all_transactions = SubscriptionTransaction.objects.filter(subscription__business=request.user.business)
-        all_direct_debit_transactions = SubscriptionPeymanTransaction.objects.filter(
-            subscription__business=request.user.business
-        )
-
-        transactions = all_transactions.filter(paid_date__gte=start_day_of_month)
-        direct_debit_transactions = all_direct_debit_transactions.filter(paid_date__gte=start_day_of_month)
-        subscriptions = Subscription.objects.filter(business=request.user.business, is_enable=True)
-        # target transaction
-        targets = Target.objects.filter(business=request.user.business)
-        target_transaction = TargetTransaction.objects.filter(
-            target__business=request.user.business, is_paid=True, )
-        # data
-        data = {
-            # total_income:
-            'total_income': all_transactions.filter(status=10).aggregate(t=Coalesce(Sum('transaction__amount'), 0))[
-                                't'] + all_direct_debit_transactions.filter(status=10).aggregate(
-                t=Coalesce(Sum('transaction__amount'), 0)
-            )['t'],
-            'month_income': transactions.filter(status=10).aggregate(t=Coalesce(Sum('transaction__amount'), 0))['t'] +
-                            direct_debit_transactions.filter(status=10).aggregate(
-                                t=Coalesce(Sum('transaction__amount'), 0))['t'],
-            'total_owed': all_transactions.filter(status=5).aggregate(t=Coalesce(Sum('transaction__amount'), 0))['t'],
-            'paid_ratio': 0,
-            # projects_income:
-            'projects_count': targets.count(),
-            'projects_income_count': target_transaction.count(),
-            'total_project_income': target_transaction.aggregate(t=Coalesce(Sum('transaction__amount'), 0))['t'],
-            'projet_paid_ratio': 0,
-        }
-        if subscriptions.count():
-            data['paid_ratio'] = subscriptions.values('user').aggregate(
-                t=Coalesce(Sum('tier__amount'), 0) / Coalesce(Count('user', distinct=True), 1))['t']
-        if targets.count():
-            data['projet_paid_ratio'] = target_transaction.aggregate(
-                t=Coalesce(Sum('transaction__amount'), 0) / Coalesce(Count('id'), 1))['t']
-        return Response(data)
+        return Response(get_business_transactions_report(request.user.business))
 
 
 class TransactionsChartAPIView(APIView):
-    """Return chart data of subscribers transaction in content provider panel"""
+    """Return chart data of subscribers transaction in content provider panel,
+    total and count of each jalali month are the paid subscription and direct
+    debit incomes of the month from BusinessDailyIncome. Before the rollup
+    they were tier amounts and count of enabled subscriptions by created
+    month"""
     permission_classes = (IsAuthenticated,)
     authentication_classes = (JSONWebTokenAuthentication, SessionAuthentication)
 
     def get(self, request, *args, **kwargs):
-        cases = generate_date_cases()
-        subscriptions = Subscription.objects.filter(
-            business=request.user.business, is_enable=True
-        ).annotate(month=cases).values('month').annotate(total=Sum('tier__amount'), count=Count('id'))
-        return Response(subscriptions)
+        months = jalali_date_mapper()
+        incomes = BusinessDailyIncome.objects.filter(
+            business=request.user.business, kind__in=BusinessDailyIncome.SUBSCRIPTION_KINDS,
+            date__gte=months[-1]['start'].date(),
+        ).values('jalali_year', month=F('jalali_month')).annotate(
+            total=Sum('amount'), count=Sum('count')
+        ).order_by('jalali_year', 'jalali_month')
+        return Response([dict(month=income['month'], total=income['total'], count=income['count'])
+                         for income in incomes])
 
 
 class TargetTransactionListAPIView(ListAPIView):
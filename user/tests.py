@@ -1,3 +1,32 @@
 from django.test import TestCase
 
-# Create your tests here.
+from user.models import User, Device
+from utils.notifications.push import PushDispatcher, FakePushTransport
+
+
+class PushDispatcherTestCase(TestCase):
+
+    def setUp(self):
+        self.users = [User.objects.create_user(phone_number='0912000000{}'.format(i)) for i in range(3)]
+        for i, user in enumerate(self.users):
+            Device.objects.create(user=user, notify_token='token{}'.format(i))
+        # same device token is registered for two users
+        Device.objects.create(user=self.users[1], notify_token='token0')
+
+    def test_multicast_batches(self):
+        transport = FakePushTransport(invalid_tokens=['token2'])
+        dispatcher = PushDispatcher(transport=transport, batch_size=2)
+        with self.assertNumQueries(2):
+            delivered = dispatcher.send_to_users([user.pk for user in self.users], 'message')
+        self.assertEqual(delivered, 2)
+        self.assertEqual([tokens for tokens, *_ in transport.calls], [['token0', 'token1'], ['token2']])
+        self.assertFalse(Device.objects.filter(notify_token='token2').exists(), "Invalid token is not pruned")
+
+    def test_grouped_messages(self):
+        transport = FakePushTransport()
+        dispatcher = PushDispatcher(transport=transport)
+        dispatcher.send_messages([(self.users[0].pk, 'first'), (self.users[2].pk, 'first'), (self.users[1].pk, 'second')])
+        self.assertEqual(
+            [(tokens, message) for tokens, _title, message, _data in transport.calls],
+            [(['token0', 'token2'], 'first'), (['token1', 'token0'], 'second')]
+        )
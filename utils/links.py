@@ -1,14 +1,43 @@
+from functools import lru_cache
 from urllib.parse import urlparse
 
-import requests
+from django.conf import settings
+from django.urls import reverse
+
+SHORTENED_HOSTS = ('website.com',)
+
+
+def short_url(link):
+    base = getattr(settings, 'SHORT_LINK_BASE', None)
+    if base is not None:
+        return base + link.code
+    return settings.BASE_PATH + reverse('short-link', args=[link.code])
+
+
+def make_short_bulk(urls):
+    """
+    Short urls of website links with one select and one insert, other urls
+    are returned as they are
+    :return: dict of url and its short url
+    """
+    from messenger.models import ShortLink
+    urls = list(urls)
+    links = ShortLink.shorten_bulk(url for url in urls if urlparse(url).netloc in SHORTENED_HOSTS)
+    return {url: short_url(links[url]) if url in links else url for url in urls}
 
 
 def make_short(url):
-    parse = urlparse(url)
-    if parse.netloc == 'website.com':
-        try:
-            short_link = requests.post('https://ham3.ir', json={'url': url})
-            url = short_link.json()['url']
-        except:
-            pass
-    return url
+    return make_short_bulk([url])[url]
+
+
+def display_link(url):
+    """Link without scheme which is sent in SMS tokens"""
+    return url.split('://', 1)[-1]
+
+
+@lru_cache(maxsize=getattr(settings, 'SHORT_LINK_CACHE_SIZE', 4096))
+def resolve_short_link(pk):
+    """Url of the short link, missing links raise DoesNotExist so they are
+    not cached"""
+    from messenger.models import ShortLink
+    return ShortLink.objects.values_list('url', flat=True).get(pk=pk)
@@ -1,3 +1,4 @@
+from .push import push_dispatcher
 from .sender import notify_user
 
-__all__ = ['notify_user']
+__all__ = ['notify_user', 'push_dispatcher']
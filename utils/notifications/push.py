@@ -0,0 +1,131 @@
+import logging
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from django.utils.translation import ugettext as _
+
+logger = logging.getLogger(__file__)
+
+# Error codes of firebase_admin which mean the token will never be valid again
+INVALID_TOKEN_CODES = {
+    'registration-token-not-registered', 'invalid-registration-token', 'NOT_FOUND', 'UNREGISTERED',
+}
+
+
+class FirebaseTransport:
+    """Send one multicast request per batch with the firebase app of the
+    process which is initialized once"""
+
+    @staticmethod
+    def error_code(exception):
+        return getattr(exception, 'code', None) or exception.__class__.__name__
+
+    def send(self, tokens, title, message, data):
+        """
+        :return: list of error codes of tokens, None for delivered ones
+        """
+        from firebase_admin import messaging
+        from utils.notifications.initializer import firebase
+        response = messaging.send_multicast(messaging.MulticastMessage(
+            tokens=list(tokens), data=data, notification=messaging.Notification(title=title, body=message)
+        ), app=firebase())
+        return [None if item.success else self.error_code(item.exception) for item in response.responses]
+
+
+class FakePushTransport:
+    """Local transport of tests and development, tokens of invalid_tokens
+    are rejected as unregistered"""
+
+    def __init__(self, invalid_tokens=()):
+        self.invalid_tokens = set(invalid_tokens)
+        self.calls = list()
+
+    def send(self, tokens, title, message, data):
+        self.calls.append((list(tokens), title, message, data))
+        return ['registration-token-not-registered' if token in self.invalid_tokens else None for token in tokens]
+
+
+class PushDispatcher:
+    """
+    Push notifications of many users with a few multicast requests. Tokens
+    of the users are read with one query and deduplicated, users with the
+    same message share the batches, and tokens which the transport reports
+    as invalid are cleared from their devices after the send
+    """
+
+    def __init__(self, transport=None, batch_size=None):
+        self._transport = transport
+        self.batch_size = batch_size or getattr(settings, 'PUSH_MULTICAST_SIZE', 100)
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            self._transport = import_string(
+                getattr(settings, 'PUSH_TRANSPORT', 'utils.notifications.push.FirebaseTransport')
+            )()
+        return self._transport
+
+    @staticmethod
+    def get_tokens(user_ids):
+        """Notify tokens of given users grouped by user id"""
+        from user.models import Device
+        tokens = defaultdict(list)
+        for user_id, token in Device.objects.filter(user_id__in=set(user_ids)).exclude(
+                notify_token='').order_by('pk').values_list('user_id', 'notify_token'):
+            tokens[user_id].append(token)
+        return tokens
+
+    def send_to_tokens(self, tokens, message, data=None):
+        """
+        :param tokens: iterable of notify tokens, duplicates are sent once
+        :return: (delivered count, list of invalid tokens)
+        """
+        title = _("Abreast")
+        data = dict(data or {'title': title, 'message': message})
+        tokens = list(OrderedDict.fromkeys(tokens))
+        delivered, invalid = 0, list()
+        for index in range(0, len(tokens), self.batch_size):
+            batch = tokens[index:index + self.batch_size]
+            try:
+                errors = self.transport.send(batch, title, message, data)
+            except Exception as error:
+                logger.warning('push batch of {} tokens failed: {}'.format(len(batch), error))
+                continue
+            for token, error in zip(batch, errors):
+                if error is None:
+                    delivered += 1
+                elif error in INVALID_TOKEN_CODES:
+                    invalid.append(token)
+        return delivered, invalid
+
+    def send_messages(self, messages):
+        """
+        :param messages: iterable of (user id, message)
+        :return: delivered count
+        """
+        messages = list(messages)
+        tokens = self.get_tokens(user_id for user_id, _message in messages)
+        groups = OrderedDict()
+        for user_id, message in messages:
+            groups.setdefault(message, list()).extend(tokens.get(user_id, ()))
+        delivered, invalid = 0, list()
+        for message, message_tokens in groups.items():
+            sent, rejected = self.send_to_tokens(message_tokens, message)
+            delivered += sent
+            invalid.extend(rejected)
+        self.prune(invalid)
+        return delivered
+
+    def send_to_users(self, user_ids, message):
+        """Send the same message to all devices of given users"""
+        return self.send_messages((user_id, message) for user_id in user_ids)
+
+    @staticmethod
+    def prune(tokens):
+        from user.models import Device
+        if tokens:
+            Device.objects.filter(notify_token__in=set(tokens)).update(notify_token='')
+
+
+push_dispatcher = PushDispatcher()
@@ -63,3 +63,14 @@ def get_start_day_of_month(time=timezone.localtime(timezone.now())):
     jalali_time = convert_to_jalali(time)
     start_day = jalali_time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
     return start_day.todate()
+
+
+def get_jalali_billing_period(time):
+    """
+    Return jalali "year-month" of given datetime, each subscription is charged
+    once per billing period
+    :param time: datetime instance
+    :return: str, e.g. "1399-07"
+    """
+    jalali_time = convert_to_jalali(time)
+    return '{}-{:02d}'.format(jalali_time.year, jalali_time.month)